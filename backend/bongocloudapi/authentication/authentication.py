@@ -1,11 +1,9 @@
 from django.http import HttpRequest
-from django.contrib.auth import get_user_model
 from rest_framework import authentication
 import jwt
 
-from .utils import decode_access_token
-
-User = get_user_model()
+from .cache import user_cache
+from .utils import decode_request_access_token
 
 class JWTAuthentication(authentication.BaseAuthentication):
 	"""
@@ -19,8 +17,11 @@ class JWTAuthentication(authentication.BaseAuthentication):
 		access_token = request.META['HTTP_ACCESS_TOKEN']
 		
 		try:
-			access_payload = decode_access_token(access_token)
-			return (User.objects.get(pk=access_payload['user_id']), None)
+			# RefreshJWTMiddleware has usually verified it already
+			access_payload = decode_request_access_token(request, access_token)
+			# tokens issued before they carried token_version can be served any cached user
+			user = user_cache.get(access_payload['user_id'], access_payload.get('token_version'))
+			return (user, None)
 		except jwt.ExpiredSignatureError:
 			print('Access JWT error: Expired signature.')
 		except Exception as error:
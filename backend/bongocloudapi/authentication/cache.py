@@ -0,0 +1,106 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+
+User = get_user_model()
+
+class UserCache:
+	"""
+	Users that recently authenticated, so that authenticating a request
+	doesn't take a query. Entries live for ttl seconds at most and the
+	least recently used ones are dropped beyond max_size. Each worker
+	process has its own, unless backend names one of the CACHES to keep
+	them in instead, which all the workers can share.
+
+	An entry only serves tokens issued for its token_version, so users
+	are fetched again as soon as they get tokens of a newer version.
+	"""
+	def __init__(self, max_size, ttl, backend=None):
+		self.max_size = max_size
+		self.ttl = ttl
+		self.backend = backend
+		self.entries = OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def key(self, user_id):
+		return f'auth-user:{user_id}'
+
+	def lookup(self, user_id):
+		if self.backend is not None:
+			return caches[self.backend].get(self.key(user_id))
+
+		with self.lock:
+			entry = self.entries.get(user_id)
+			if entry is None:
+				return None
+
+			(expires_at, user) = entry
+			if expires_at < time.monotonic():
+				del self.entries[user_id]
+				return None
+
+			self.entries.move_to_end(user_id)
+			return user
+
+	def store(self, user):
+		if self.backend is not None:
+			caches[self.backend].set(self.key(user.pk), user, timeout=self.ttl)
+			return
+
+		with self.lock:
+			self.entries[str(user.pk)] = (time.monotonic() + self.ttl, user)
+			self.entries.move_to_end(str(user.pk))
+			while len(self.entries) > self.max_size:
+				self.entries.popitem(last=False)
+
+	def get(self, user_id, token_version=None) -> User:
+		"""
+		Returns the user with user_id, from the cache if it's there and not
+		older than token_version. Raises User.DoesNotExist like a query would.
+		"""
+		user_id = str(user_id)
+		user = None
+		if self.max_size > 0 and self.ttl > 0:
+			user = self.lookup(user_id)
+
+		if user is not None and (token_version is None or user.token_version == token_version):
+			self.hits += 1
+			# every request gets its own copy to change
+			return copy.copy(user)
+
+		self.misses += 1
+		user = User.objects.get(pk=user_id)
+		if self.max_size > 0 and self.ttl > 0:
+			self.store(copy.copy(user))
+		return user
+
+	def evict(self, user_id):
+		user_id = str(user_id)
+		if self.backend is not None:
+			caches[self.backend].delete(self.key(user_id))
+			return
+
+		with self.lock:
+			self.entries.pop(user_id, None)
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+			self.hits = 0
+			self.misses = 0
+
+	def stats(self) -> dict:
+		return { 'hits': self.hits, 'misses': self.misses, 'size': len(self.entries) }
+
+user_cache = UserCache(
+	max_size=getattr(settings, 'AUTH_USER_CACHE_SIZE', 1024),
+	ttl=getattr(settings, 'AUTH_USER_CACHE_TTL', 60),
+	backend=getattr(settings, 'AUTH_USER_CACHE_BACKEND', None)
+)
@@ -0,0 +1,96 @@
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import jwt
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.http import HttpResponse
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+from authentication.authentication import JWTAuthentication
+from authentication.cache import user_cache
+from authentication.middleware import RefreshJWTMiddleware
+from authentication.utils import decode_access_token, generate_tokens_for_user
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+	help = (
+		'Reports the time RefreshJWTMiddleware and JWTAuthentication take per request, '
+		'and how many token signatures they verify, next to the old pipeline that verified '
+		'the access token in each of them. Everything runs in a transaction that is rolled back.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--requests', type=int, default=10000)
+
+	def handle(self, *args, **options):
+		with transaction.atomic():
+			user = User.objects.create_user(
+				email=f'{uuid.uuid4().hex}@benchmark.local',
+				username=f'benchmark-{uuid.uuid4().hex[:12]}'
+			)
+			(access_token, refresh_token) = generate_tokens_for_user(user)
+			expired_access_token = jwt.encode(
+				{
+					'user_id': str(user.id),
+					'token_version': user.token_version,
+					'exp': datetime.now(tz=timezone.utc) - timedelta(minutes=1),
+					'iat': datetime.now(tz=timezone.utc) - timedelta(minutes=8)
+				},
+				settings.JWT_ACCESS_TOKEN_SECRET, algorithm='HS256'
+			)
+
+			factory = RequestFactory()
+			authentication = JWTAuthentication()
+			middleware = RefreshJWTMiddleware(lambda request: self.authenticate(authentication, request))
+
+			def request_with(token):
+				request = factory.get('/', HTTP_X_ACCESS_TOKEN=token)
+				request.COOKIES['refresh_token'] = refresh_token
+				return request
+
+			def old_pipeline(request):
+				# RefreshJWTMiddleware checked the expiry with a full decode, then JWTAuthentication decoded again
+				decode_access_token(request.headers['x-access-token'])
+				request.META['HTTP_ACCESS_TOKEN'] = request.headers['x-access-token']
+				access_payload = decode_access_token(Request(request).META['HTTP_ACCESS_TOKEN'])
+				user_cache.get(access_payload['user_id'], access_payload.get('token_version'))
+				return HttpResponse()
+
+			cases = [
+				('verified in each step (before)', lambda: old_pipeline(request_with(access_token))),
+				('verified once', lambda: middleware(request_with(access_token))),
+				('expired, refreshed', lambda: middleware(request_with(expired_access_token))),
+			]
+
+			for (label, run) in cases:
+				# warm up, the user is cached from then on
+				run()
+
+				with mock.patch.object(jwt, 'decode', wraps=jwt.decode) as decode:
+					start = time.perf_counter()
+					for _ in range(options['requests']):
+						run()
+					elapsed = time.perf_counter() - start
+
+				verified = sum(
+					1 for call in decode.call_args_list
+					if call.kwargs.get('options', {}).get('verify_signature', True)
+				)
+				self.stdout.write(
+					f'{label:<32} {elapsed / options["requests"] * 1000000:8.1f} us/request '
+					f'{verified / options["requests"]:4.1f} verifications/request'
+				)
+
+			transaction.set_rollback(True)
+
+	def authenticate(self, authentication, request):
+		authentication.authenticate(Request(request))
+		return HttpResponse()
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib.auth.base_user import BaseUserManager
 
 class UserManager(BaseUserManager):
@@ -10,6 +11,7 @@ class UserManager(BaseUserManager):
 		if not email:
 			raise ValueError('The given email must be set')
 		email = self.normalize_email(email)
+		extra_fields.setdefault('storage_quota', settings.DEFAULT_STORAGE_QUOTA)
 		user = self.model(email=email, **extra_fields)
 		user.set_password(password)
 		user.save(using=self._db)
@@ -1,15 +1,15 @@
 from django.http import HttpRequest
-from django.contrib.auth import get_user_model
+import jwt
 
+from .models import User
 from .utils import (
 	decode_refresh_token,
+	decode_request_access_token,
 	generate_tokens_for_user,
 	set_refresh_token_cookie,
-	is_access_token_expired
+	set_request_access_token
 )
 
-User = get_user_model()
-
 
 class RefreshJWTMiddleware:
 	"""
@@ -32,9 +32,16 @@ class RefreshJWTMiddleware:
 		# this will later be retrived from the JWTAuthentication custom auth class
 		request.META['HTTP_ACCESS_TOKEN'] = access_token
 
-		# if access token is not empty and is expired continue, otherwise skip
+		# if access token is not empty and is expired continue, otherwise skip.
+		# the claims are kept on the request for JWTAuthentication
 		if access_token:
-			if not is_access_token_expired(access_token):
+			try:
+				decode_request_access_token(request, access_token)
+			except jwt.ExpiredSignatureError:
+				pass
+			except jwt.InvalidTokenError:
+				return self.get_response(request)
+			else:
 				return self.get_response(request)
 
 		# check if refresh token is valid
@@ -43,8 +50,9 @@ class RefreshJWTMiddleware:
 		except:
 			return self.get_response(request)
 
-		# fetch the user mentioned in refresh token
-		user = User.objects.get(pk=refresh_payload['user_id'])
+		# fetch the user mentioned in refresh token, from the database: the cached user
+		# may predate a token_version bump made with .update() or by another worker
+		user = User.objects.filter(pk=refresh_payload['user_id']).first()
 
 		# if user not found or token has invalid token_version skip
 		if user is None or user.token_version != refresh_payload['token_version']:
@@ -53,8 +61,8 @@ class RefreshJWTMiddleware:
 		# generate new tokens
 		(new_access_token, new_refresh_token) = generate_tokens_for_user(user)
 		
-		# update access token for JWTAuthentication
-		request.META['HTTP_ACCESS_TOKEN'] = new_access_token
+		# update access token, and its claims, for JWTAuthentication
+		set_request_access_token(request, new_access_token)
 
 		# send access token as respone header and refresh token as cookie
 		response = self.get_response(request)
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.1 on 2026-10-18 14:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0002_alter_user_date_joined_alter_user_email_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='listing_version',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='listing version'),
+        ),
+    ]
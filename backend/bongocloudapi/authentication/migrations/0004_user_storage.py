@@ -0,0 +1,49 @@
+# Generated by Django 4.1.1 on 2026-10-18 14:37
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def forwards(apps, _):
+    User = apps.get_model('authentication', 'User')
+    FilesystemItem = apps.get_model('filesystem', 'FilesystemItem')
+    UploadSession = apps.get_model('filesystem', 'UploadSession')
+
+    # the size of a folder is the size of its subtree, so the items at the root add up to everything
+    totals = (
+        FilesystemItem.objects
+            .filter(parent=None, is_deleted=False)
+            .values('owner_id')
+            .annotate(total=Sum('filesize'))
+            .values_list('owner_id', 'total')
+    )
+    storage_used = dict(totals)
+
+    # open upload sessions have their size reserved
+    sessions = UploadSession.objects.values('owner_id').annotate(total=Sum('filesize')).values_list('owner_id', 'total')
+    for (owner_id, total) in sessions:
+        storage_used[owner_id] = storage_used.get(owner_id, 0) + total
+
+    users = [User(id=owner_id, storage_used=total) for (owner_id, total) in storage_used.items()]
+    User.objects.bulk_update(users, ['storage_used'], batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0003_user_listing_version'),
+        ('filesystem', '0021_filesystemitemtrigram'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='storage_quota',
+            field=models.PositiveBigIntegerField(blank=True, null=True, verbose_name='storage quota'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='storage_used',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='storage used'),
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
@@ -19,6 +19,12 @@ class User(AbstractBaseUser, PermissionsMixin):
 	date_joined = models.DateTimeField(_('date joined'), auto_now_add=True)
 	is_active = models.BooleanField(_('is active'), default=True)
 	token_version = models.IntegerField(_('token version'), default=0)
+	# version of the listing of the root folder, see filesystem.models.touch_listings
+	listing_version = models.PositiveBigIntegerField(_('listing version'), default=0)
+	# total size of the user's files, kept up to date by filesystem.quota
+	storage_used = models.PositiveBigIntegerField(_('storage used'), default=0)
+	# in bytes, None for no limit
+	storage_quota = models.PositiveBigIntegerField(_('storage quota'), null=True, blank=True)
 
 	objects = UserManager()
 
@@ -0,0 +1,13 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import user_cache
+
+User = get_user_model()
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def on_change_user(sender, instance, *args, **kwargs):
+	# other worker processes keep their copy until it expires, unless they share a cache backend
+	user_cache.evict(instance.pk)
@@ -1,3 +1,123 @@
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import jwt
+from django.conf import settings
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from .cache import user_cache
+from .models import User
+from .utils import generate_tokens_for_user
+
+
+class UserCacheTests(TestCase):
+	"""
+	Authenticated users are cached between requests, until they
+	change or get tokens of a newer version.
+	"""
+	def setUp(self):
+		user_cache.clear()
+
+		self.user = User.objects.create_user(email='user@bongo.local', password='password', username='user')
+		(access_token, _) = generate_tokens_for_user(self.user)
+		self.client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+
+	def test_second_request_is_cached(self):
+		# /auth/me/ reads the storage usage fresh, on top of fetching the user
+		with self.assertNumQueries(2):
+			self.client.get('/auth/me/')
+
+		with self.assertNumQueries(1):
+			response = self.client.get('/auth/me/')
+
+		self.assertEqual(response.json()['user']['username'], 'user')
+		self.assertEqual(user_cache.stats()['hits'], 1)
+		self.assertEqual(user_cache.stats()['misses'], 1)
+
+	def test_saving_evicts(self):
+		self.client.get('/auth/me/')
+
+		self.user.first_name = 'Bongo'
+		self.user.save()
+
+		with self.assertNumQueries(2):
+			response = self.client.get('/auth/me/')
+
+		self.assertEqual(response.json()['user']['first_name'], 'Bongo')
+
+	def test_newer_token_version_is_fetched(self):
+		self.client.get('/auth/me/')
+
+		# bumped behind the cache's back
+		User.objects.filter(pk=self.user.pk).update(token_version=self.user.token_version + 1)
+		self.user.refresh_from_db()
+		(access_token, _) = generate_tokens_for_user(self.user)
+
+		with self.assertNumQueries(2):
+			APIClient(HTTP_ACCESS_TOKEN=access_token).get('/auth/me/')
+
+		self.assertEqual(user_cache.stats()['misses'], 2)
+
+	def test_deleted_user_is_not_authenticated(self):
+		self.client.get('/auth/me/')
+		self.user.delete()
+
+		response = self.client.get('/auth/me/')
+		self.assertIn(response.status_code, (401, 403))
+
+
+class AccessTokenVerificationTests(TestCase):
+	"""
+	The access token's signature is verified once per request, by
+	RefreshJWTMiddleware, and JWTAuthentication reuses its claims.
+	"""
+	def setUp(self):
+		self.user = User.objects.create_user(email='user@bongo.local', password='password', username='user')
+		(self.access_token, refresh_token) = generate_tokens_for_user(self.user)
+		self.client = APIClient()
+		self.client.cookies['refresh_token'] = refresh_token
+
+	def get_me(self, access_token):
+		with mock.patch.object(jwt, 'decode', wraps=jwt.decode) as decode:
+			response = self.client.get('/auth/me/', HTTP_X_ACCESS_TOKEN=access_token)
+
+		verified = [call for call in decode.call_args_list if call.kwargs.get('options', {}).get('verify_signature', True)]
+		return (response, len(verified))
+
+	def test_verified_once(self):
+		(response, verified) = self.get_me(self.access_token)
+
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(verified, 1)
+
+	def expired_access_token(self):
+		return jwt.encode(
+			{
+				'user_id': str(self.user.id),
+				'token_version': self.user.token_version,
+				'exp': datetime.now(tz=timezone.utc) - timedelta(minutes=1),
+				'iat': datetime.now(tz=timezone.utc) - timedelta(minutes=8)
+			},
+			settings.JWT_ACCESS_TOKEN_SECRET, algorithm='HS256'
+		)
+
+	def test_expired_token_is_refreshed(self):
+		(response, verified) = self.get_me(self.expired_access_token())
+
+		self.assertEqual(response.status_code, 200)
+		self.assertIn('x-access-token', response.headers)
+		# the expired access token and the refresh token, not the new access token
+		self.assertEqual(verified, 2)
+
+	def test_revoked_refresh_token_is_refused(self):
+		# the user is cached by then
+		self.get_me(self.access_token)
+
+		# revoked behind the cache's back, like another worker would
+		User.objects.filter(pk=self.user.pk).update(token_version=self.user.token_version + 1)
+
+		(response, _) = self.get_me(self.expired_access_token())
 
-# Create your tests here.
+		self.assertIn(response.status_code, (401, 403))
+		self.assertNotIn('x-access-token', response.headers)
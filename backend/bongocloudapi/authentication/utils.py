@@ -7,6 +7,7 @@ def generate_tokens_for_user(user):
 	access_token = jwt.encode(
 		{
 			'user_id': str(user.id),
+			'token_version': user.token_version,
 			'exp': datetime.now(tz=timezone.utc) + timedelta(minutes=7),
 			'iat': datetime.now(tz=timezone.utc)
 		},
@@ -34,12 +35,31 @@ def decode_access_token(access_token):
 def decode_refresh_token(refresh_token):
 	return jwt.decode(refresh_token, settings.JWT_REFRESH_TOKEN_SECRET, algorithms=['HS256'])
 
-def is_access_token_expired(access_token):
-	try:
-		decode_access_token(access_token)
-	except jwt.ExpiredSignatureError:
-		return True
-	except:
-		pass
-	
-	return False
\ No newline at end of file
+def decode_request_access_token(request, access_token):
+	"""
+	decode_access_token, but the signature is verified only once per
+	request, by whichever of RefreshJWTMiddleware and JWTAuthentication
+	gets to it first. Raises the same errors every time it's asked.
+	"""
+	http_request = getattr(request, '_request', request)
+	claims = getattr(http_request, 'access_token_claims', None)
+	if claims is None or claims[0] != access_token:
+		try:
+			claims = (access_token, decode_access_token(access_token), None)
+		except jwt.InvalidTokenError as error:
+			claims = (access_token, None, error)
+		http_request.access_token_claims = claims
+
+	(_, access_payload, error) = claims
+	if error is not None:
+		raise error
+	return access_payload
+
+def set_request_access_token(request, access_token):
+	"""
+	Makes access_token, which was just generated, the one request is
+	authenticated with. It's ours, so it isn't verified again.
+	"""
+	http_request = getattr(request, '_request', request)
+	http_request.META['HTTP_ACCESS_TOKEN'] = access_token
+	http_request.access_token_claims = (access_token, jwt.decode(access_token, options={ 'verify_signature': False }), None)
\ No newline at end of file
@@ -1,5 +1,5 @@
 import hashlib
-from django.contrib.auth import authenticate
+from django.contrib.auth import authenticate, get_user_model
 from rest_framework import status, permissions
 from rest_framework.generics import GenericAPIView
 from rest_framework.response import Response
@@ -7,6 +7,8 @@ from rest_framework.response import Response
 from .serializers import UserSerializer, LoginUserSerializer, RegisterUserSerializer
 from .utils import generate_tokens_for_user, set_refresh_token_cookie
 
+User = get_user_model()
+
 class LoginAPIView(GenericAPIView):
 	serializer_class = LoginUserSerializer
 
@@ -70,4 +72,8 @@ class MeAPIView(GenericAPIView):
 	def get(self, request, *args, **kwargs):
 		user = request.user
 		data = self.get_serializer(user).data
+
+		# read it fresh, request.user may have been loaded before the last upload
+		(storage_used, storage_quota) = User.objects.filter(pk=user.pk).values_list('storage_used', 'storage_quota').get()
+		data['usage'] = { 'used': storage_used, 'quota': storage_quota }
 		return Response({ 'user': data })
\ No newline at end of file
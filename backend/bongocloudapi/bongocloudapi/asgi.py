@@ -9,8 +9,18 @@ https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bongocloudapi.settings')
 
-application = get_asgi_application()
+# what get_asgi_application() does, with a handler that streams downloads without blocking
+django.setup(set_prefix=False)
+
+from django.conf import settings
+
+from .handlers import StreamingASGIHandler
+
+application = StreamingASGIHandler(
+	max_streams=settings.ASGI_MAX_STREAMS,
+	read_threads=settings.ASGI_STREAM_READ_THREADS
+)
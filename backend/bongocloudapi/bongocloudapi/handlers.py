@@ -0,0 +1,103 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+
+# the receive channel of the request being handled, to notice disconnects while streaming
+current_receive = contextvars.ContextVar('current_receive', default=None)
+
+STREAM_END = object()
+
+def read_part(iterator):
+	"""
+	Next part of a streaming response, read in a thread of the stream
+	executor. Generators that query the database, like folder archives,
+	leave a connection behind in the thread, which is closed when they end.
+	"""
+	part = next(iterator, STREAM_END)
+	if part is STREAM_END:
+		close_old_connections()
+	return part
+
+class StreamingASGIHandler(ASGIHandler):
+	"""
+	ASGIHandler that sends streaming responses, which downloads, ranges
+	and folder archives are, without holding the event loop or a thread
+	while the client receives them. Django 4.1 iterates them right on the
+	event loop, so every read from disk blocks all the other requests.
+
+	Here each part is read in a thread of a small executor and then awaited
+	on its way to the client, so a slow client only costs an open file.
+	At most max_streams responses are streamed at once, the rest wait for
+	their turn before their headers are sent. Streams stop as soon as the
+	client disconnects.
+	"""
+	def __init__(self, max_streams, read_threads):
+		super().__init__()
+		self.max_streams = max_streams
+		self.executor = ThreadPoolExecutor(max_workers=read_threads, thread_name_prefix='stream')
+		self.streams = None
+
+	async def handle(self, scope, receive, send):
+		current_receive.set(receive)
+		await super().handle(scope, receive, send)
+
+	def get_response_headers(self, response):
+		# same as ASGIHandler.send_response
+		response_headers = []
+		for header, value in response.items():
+			if isinstance(header, str):
+				header = header.encode('ascii')
+			if isinstance(value, str):
+				value = value.encode('latin1')
+			response_headers.append((bytes(header), bytes(value)))
+		for c in response.cookies.values():
+			response_headers.append((b'Set-Cookie', c.output(header='').encode('ascii').strip()))
+		return response_headers
+
+	async def send_response(self, response, send):
+		if not response.streaming:
+			return await super().send_response(response, send)
+
+		if self.streams is None:
+			# created here to belong to the running event loop
+			self.streams = asyncio.Semaphore(self.max_streams)
+
+		receive = current_receive.get()
+		disconnected = asyncio.ensure_future(wait_for_disconnect(receive)) if receive is not None else None
+		loop = asyncio.get_running_loop()
+
+		try:
+			async with self.streams:
+				await send({
+					'type': 'http.response.start',
+					'status': response.status_code,
+					'headers': self.get_response_headers(response)
+				})
+
+				iterator = iter(response)
+				while disconnected is None or not disconnected.done():
+					part = await loop.run_in_executor(self.executor, read_part, iterator)
+					if part is STREAM_END:
+						break
+
+					for chunk, _ in self.chunk_bytes(part):
+						# waits while the client is behind
+						await send({ 'type': 'http.response.body', 'body': chunk, 'more_body': True })
+
+				await send({ 'type': 'http.response.body' })
+		finally:
+			if disconnected is not None:
+				disconnected.cancel()
+			# like ASGIHandler, so request_finished closes the connections of the views' thread
+			await sync_to_async(response.close, thread_sensitive=True)()
+
+async def wait_for_disconnect(receive):
+	# the body has been read already, all that can arrive is the disconnect
+	while True:
+		message = await receive()
+		if message['type'] == 'http.disconnect':
+			return
@@ -82,6 +82,12 @@ else:
     JWT_ACCESS_TOKEN_SECRET = '1f8c63edb93a8b7d87137f86903fb003e117d15f8ac29a371cd5f15ee760b0ac'
     JWT_REFRESH_TOKEN_SECRET = '9d3c0f6695b3dea490405946c9e5d5a6bdab6ffef6b82f79e79cbf8d1a378872'
 
+# Users are cached by each worker for AUTH_USER_CACHE_TTL seconds after authenticating,
+# AUTH_USER_CACHE_BACKEND can name one of CACHES to share them between workers instead
+AUTH_USER_CACHE_SIZE = int(os.environ.get('AUTH_USER_CACHE_SIZE', 1024))
+AUTH_USER_CACHE_TTL = int(os.environ.get('AUTH_USER_CACHE_TTL', 60))
+AUTH_USER_CACHE_BACKEND = os.environ.get('AUTH_USER_CACHE_BACKEND') or None
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -99,6 +105,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'bongocloudapi.wsgi.application'
+ASGI_APPLICATION = 'bongocloudapi.asgi.application'
 
 
 # Database
@@ -152,6 +159,34 @@ STATIC_URL = 'static/'
 # Media files (uploaded by user)
 MEDIA_ROOT = BASE_DIR.parent / 'bongo-storage'
 
+# Chunked uploads, sessions that aren't committed are purged after UPLOAD_SESSION_MAX_AGE seconds
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_MIN_CHUNK_SIZE = 256 * 1024
+UPLOAD_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+UPLOAD_MAX_FILESIZE = 64 * 1024 * 1024 * 1024
+UPLOAD_SESSION_MAX_AGE = 24 * 60 * 60
+
+# Storage quota in bytes of new users, unlimited when not set
+DEFAULT_STORAGE_QUOTA = int(os.environ['DEFAULT_STORAGE_QUOTA']) if os.environ.get('DEFAULT_STORAGE_QUOTA') else None
+
+# How file downloads are delivered once they pass the permission checks:
+#  - 'django' streams them from the worker process
+#  - 'x-accel-redirect' hands them to nginx, which needs an internal location
+#    aliasing DOWNLOAD_ACCEL_REDIRECT_PREFIX to MEDIA_ROOT, ex.
+#      location /protected-media/ { internal; alias /code/bongo-storage/; }
+#  - 'x-sendfile' hands them to Apache with mod_xsendfile enabled
+DOWNLOAD_DELIVERY = os.environ.get('DOWNLOAD_DELIVERY', 'django')
+DOWNLOAD_ACCEL_REDIRECT_PREFIX = os.environ.get('DOWNLOAD_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+
+# Under ASGI (BONGO_ASGI, see entrypoint.sh) each worker streams at most ASGI_MAX_STREAMS
+# responses at once, the rest wait. Their parts are read by ASGI_STREAM_READ_THREADS threads
+ASGI_MAX_STREAMS = int(os.environ.get('ASGI_MAX_STREAMS', 4096))
+ASGI_STREAM_READ_THREADS = int(os.environ.get('ASGI_STREAM_READ_THREADS', 16))
+
+# Generated folder archives, evicted least recently used first
+ARCHIVE_CACHE_DIR = BASE_DIR.parent / 'bongo-cache' / 'archives'
+ARCHIVE_CACHE_MAX_BYTES = int(os.environ.get('ARCHIVE_CACHE_MAX_BYTES', 5 * 1024 ** 3))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
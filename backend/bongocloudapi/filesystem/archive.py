@@ -0,0 +1,325 @@
+import fcntl
+import os
+import time
+import uuid
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import FilesystemItem
+
+ARCHIVE_CHUNK_SIZE = 64 * 1024
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_FORMAT_VERSION = 1
+# how often requests reading along check for more of an archive being stored, and how
+# long they wait for it before generating the rest themselves
+ARCHIVE_FOLLOW_INTERVAL = 0.05
+ARCHIVE_FOLLOW_TIMEOUT = 30
+# partial archives left behind by a worker that died
+ARCHIVE_PARTIAL_MAX_AGE = 60 * 60
+
+ARCHIVE_CACHE_DIR = getattr(settings, 'ARCHIVE_CACHE_DIR', None)
+ARCHIVE_CACHE_MAX_BYTES = getattr(settings, 'ARCHIVE_CACHE_MAX_BYTES', 0)
+
+class ArchiveStream:
+	"""
+	Write-only file object that collects whatever zipfile writes
+	into it, so that it can be handed out in pieces.
+	"""
+	def __init__(self):
+		self._chunks = []
+
+	def write(self, data):
+		self._chunks.append(bytes(data))
+		return len(data)
+
+	def flush(self):
+		pass
+
+	def drain(self) -> bytes:
+		data = b''.join(self._chunks)
+		self._chunks = []
+		return data
+
+def iter_subtree(folder, batch_size=ARCHIVE_BATCH_SIZE):
+	"""
+	Yields every descendant of folder, fetching them in batches
+	so that the whole subtree is never loaded at once.
+	"""
+	descendants = (
+		folder.descendants()
+			.only('id', 'name', 'path', 'is_file', 'filesize', 'uploaded_file', 'updated_at')
+			.order_by('pk')
+	)
+
+	last_pk = None
+	while True:
+		batch = descendants if last_pk is None else descendants.filter(pk__gt=last_pk)
+		batch = list(batch[:batch_size])
+		if not batch:
+			return
+
+		yield from batch
+		last_pk = batch[-1].pk
+
+def archive_entry_info(arcname, item: FilesystemItem) -> zipfile.ZipInfo:
+	date_time = timezone.localtime(item.updated_at).timetuple()[:6]
+
+	if item.is_file:
+		zinfo = zipfile.ZipInfo(arcname, date_time=date_time)
+		zinfo.external_attr = 0o644 << 16
+		# lets zipfile decide up front whether the entry needs ZIP64 extensions
+		zinfo.file_size = item.filesize
+	else:
+		zinfo = zipfile.ZipInfo(arcname + '/', date_time=date_time)
+		zinfo.external_attr = (0o40755 << 16) | 0x10
+
+	zinfo.compress_type = zipfile.ZIP_STORED
+	return zinfo
+
+def stream_folder_archive(folder: FilesystemItem, chunk_size=ARCHIVE_CHUNK_SIZE):
+	"""
+	Generates an uncompressed ZIP archive of folder on the fly. Entries are
+	written as the subtree is walked and file bodies are copied in chunks,
+	so nothing is buffered beyond a single chunk and the central directory.
+	"""
+	stream = ArchiveStream()
+
+	with zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+		archive.writestr(archive_entry_info(folder.name, folder), b'')
+
+		for item in iter_subtree(folder):
+			arcname = folder.name + item.path[len(folder.path):]
+			zinfo = archive_entry_info(arcname, item)
+
+			if not item.is_file:
+				archive.writestr(zinfo, b'')
+			else:
+				with item.uploaded_file.open('rb') as file, archive.open(zinfo, mode='w') as entry:
+					while True:
+						chunk = file.read(chunk_size)
+						if not chunk:
+							break
+
+						entry.write(chunk)
+						yield stream.drain()
+
+			data = stream.drain()
+			if data:
+				yield data
+
+	yield stream.drain()
+
+def archive_key(folder: FilesystemItem) -> str:
+	# the subtree version changes with everything that ends up in the archive, see touch_listings
+	return f'{folder.pk}.{folder.subtree_version}.{ARCHIVE_FORMAT_VERSION}'
+
+def skip_bytes(chunks, count):
+	# the chunks without their first count bytes
+	for data in chunks:
+		if count >= len(data):
+			count -= len(data)
+			continue
+
+		yield data[count:]
+		count = 0
+
+class ArchiveCache:
+	"""
+	Folder archives kept on local disk, keyed by the subtree version of
+	the folder. The total size is bounded by max_bytes and the least
+	recently used archives are evicted first. An archive that isn't cached
+	yet is stored while it's streamed to the first client asking for it,
+	other requests for the same folder meanwhile read along from the file
+	being written, so the folder is zipped once however many ask for it.
+	"""
+	def __init__(self, directory, max_bytes):
+		self.directory = Path(directory) if directory else None
+		self.max_bytes = max_bytes
+
+	def can_cache(self, folder: FilesystemItem) -> bool:
+		return self.directory is not None and 0 < folder.filesize <= self.max_bytes
+
+	@contextmanager
+	def try_lock(self, name):
+		"""
+		Takes an exclusive lock on name, shared by all the worker processes,
+		without waiting for it: yields False if somebody else holds it.
+		"""
+		self.directory.mkdir(parents=True, exist_ok=True)
+		path = self.directory / f'{name}.lock'
+		with open(path, 'a') as lock_file:
+			try:
+				fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except BlockingIOError:
+				yield False
+				return
+
+			try:
+				yield True
+			finally:
+				# so that lock files don't pile up, at worst two requests both store the same archive
+				try:
+					os.remove(path)
+				except FileNotFoundError:
+					pass
+				fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+	def open(self, folder: FilesystemItem):
+		"""
+		Opens the cached archive of folder, None if it isn't cached. An
+		archive that gets evicted while it's open stays readable.
+		"""
+		path = self.directory / f'{archive_key(folder)}.zip'
+		try:
+			file = open(path, 'rb')
+		except FileNotFoundError:
+			return None
+
+		# the modification time doubles as the last access time for eviction
+		try:
+			os.utime(path)
+		except FileNotFoundError:
+			pass
+
+		return file
+
+	def stream(self, folder: FilesystemItem):
+		"""
+		Generates the archive of folder like stream_folder_archive, and
+		stores it in the cache on the way. Only an archive that was sent
+		completely is kept. While another request is storing it, the
+		archive is read from there instead.
+		"""
+		key = archive_key(folder)
+		path = self.directory / f'{key}.zip'
+
+		with self.try_lock(f'archive-{key}') as locked:
+			if not locked:
+				yield from self.follow(folder, path)
+				return
+
+			# found by the requests following along, unique in case two end up storing it
+			partial_path = self.directory / f'{key}.{uuid.uuid4().hex}.partial'
+			try:
+				with open(partial_path, 'wb') as partial_file:
+					for data in stream_folder_archive(folder):
+						partial_file.write(data)
+						partial_file.flush()
+						yield data
+
+				try:
+					os.replace(partial_path, path)
+				except FileNotFoundError:
+					# removed by evict after its client stalled for too long
+					pass
+			finally:
+				if partial_path.exists():
+					os.remove(partial_path)
+
+		# the archives of earlier versions of the folder won't be asked for again
+		for old_path in self.directory.glob(f'{folder.pk}.*.zip'):
+			if old_path != path:
+				try:
+					os.remove(old_path)
+				except FileNotFoundError:
+					pass
+
+		self.evict(keep=path)
+
+	def follow(self, folder: FilesystemItem, path):
+		"""
+		Generates the archive of folder at path, which another request is
+		storing, from the partial file it's writing, as it's written. If
+		that request stops before the end, the rest comes from an archive
+		generated here, which has the same bytes.
+		"""
+		partial_file = None
+		for partial_path in self.directory.glob(f'{path.stem}.*.partial'):
+			try:
+				partial_file = open(partial_path, 'rb')
+				break
+			except FileNotFoundError:
+				continue
+
+		if partial_file is None:
+			# stored meanwhile, or not started yet
+			archive = self.open(folder)
+			if archive is not None:
+				with archive:
+					yield from iter(lambda: archive.read(ARCHIVE_CHUNK_SIZE), b'')
+			else:
+				yield from stream_folder_archive(folder)
+			return
+
+		with partial_file:
+			sent = 0
+			last_read = time.monotonic()
+			while True:
+				data = partial_file.read(ARCHIVE_CHUNK_SIZE)
+				if data:
+					sent += len(data)
+					last_read = time.monotonic()
+					yield data
+					continue
+
+				if self.is_stored(partial_file, path):
+					# moved into place once complete, what's left can be read right away
+					yield from iter(lambda: partial_file.read(ARCHIVE_CHUNK_SIZE), b'')
+					return
+
+				abandoned = time.monotonic() - last_read > ARCHIVE_FOLLOW_TIMEOUT
+				if (abandoned or not partial_path.exists()) and not self.is_stored(partial_file, path):
+					yield from skip_bytes(stream_folder_archive(folder), sent)
+					return
+
+				time.sleep(ARCHIVE_FOLLOW_INTERVAL)
+
+	def is_stored(self, partial_file, path) -> bool:
+		# whether the partial file has become the cached archive
+		try:
+			return os.path.samestat(os.fstat(partial_file.fileno()), os.stat(path))
+		except FileNotFoundError:
+			return False
+
+	def evict(self, keep=None):
+		"""
+		Removes the least recently used archives until the cache fits
+		in its byte budget. Skipped if another process is already at it.
+		"""
+		with self.try_lock('evict') as locked:
+			if not locked:
+				return
+
+			archives = []
+			for path in self.directory.glob('*.zip'):
+				try:
+					stat = path.stat()
+				except FileNotFoundError:
+					continue
+				archives.append((stat.st_mtime, stat.st_size, path))
+
+			for path in self.directory.glob('*.partial'):
+				try:
+					if path.stat().st_mtime < time.time() - ARCHIVE_PARTIAL_MAX_AGE:
+						os.remove(path)
+				except FileNotFoundError:
+					pass
+
+			total = sum(size for (_, size, _) in archives)
+			for (_, size, path) in sorted(archives):
+				if total <= self.max_bytes:
+					break
+				if path == keep:
+					continue
+
+				try:
+					os.remove(path)
+				except FileNotFoundError:
+					pass
+				total -= size
+
+archive_cache = ArchiveCache(ARCHIVE_CACHE_DIR, ARCHIVE_CACHE_MAX_BYTES)
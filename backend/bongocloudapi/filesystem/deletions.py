@@ -0,0 +1,98 @@
+import os
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .quota import delete_upload_sessions
+from .models import (
+	Blob,
+	DeletionTask,
+	FilesystemItem,
+	FilesystemItemAncestry,
+	FilesystemItemTrigram,
+	FilesystemSharedItem,
+	UploadSession
+)
+
+DELETION_BATCH_SIZE = 1000
+
+def delete_item_rows(ids):
+	"""
+	Deletes the rows of the items with ids with a plain DELETE. Django's
+	Collector would load them, look for their relations again and send
+	post_delete for every one of them.
+	"""
+	table = connection.ops.quote_name(FilesystemItem._meta.db_table)
+	pk_field = FilesystemItem._meta.pk
+	placeholders = ', '.join(['%s'] * len(ids))
+	with connection.cursor() as cursor:
+		cursor.execute(
+			f'DELETE FROM {table} WHERE {connection.ops.quote_name(pk_field.column)} IN ({placeholders})',
+			[pk_field.get_db_prep_value(id, connection) for id in ids]
+		)
+
+def delete_next_batch(task: DeletionTask, batch_size=DELETION_BATCH_SIZE) -> int:
+	"""
+	Removes up to batch_size of the deepest items left in the subtree of
+	task, with their shares, upload sessions and closure rows, and drops
+	their references to blobs. The task goes along with the root of the
+	subtree. Returns how many items were removed.
+	"""
+	links = list(
+		FilesystemItemAncestry.objects
+			.filter(ancestor_id=task.item_id)
+			.order_by('-depth')
+			.values_list('descendant_id', 'depth')[:batch_size]
+	)
+	if not links:
+		task.delete()
+		return 0
+
+	# one level at a time, so that no item of the batch is the parent of another
+	depth = links[0][1]
+	ids = [id for (id, link_depth) in links if link_depth == depth]
+
+	items = list(FilesystemItem.all_objects.filter(pk__in=ids).values_list('blob_id', 'uploaded_file'))
+	references = Counter(blob_id for (blob_id, _) in items if blob_id is not None)
+	for (blob_id, count) in references.items():
+		# the blobs themselves are removed by collect_blobs, once nothing references them
+		Blob.objects.filter(pk=blob_id).update(refcount=F('refcount') - count, updated_at=timezone.now())
+
+	FilesystemSharedItem.objects.filter(item_id__in=ids).delete()
+	delete_upload_sessions(UploadSession.objects.filter(parent_id__in=ids))
+	FilesystemItemAncestry.objects.filter(descendant_id__in=ids).delete()
+	FilesystemItemTrigram.objects.filter(item_id__in=ids).delete()
+	DeletionTask.objects.filter(item_id__in=ids).delete()
+	delete_item_rows(ids)
+
+	# files uploaded before the blob store existed belong to their item alone
+	legacy_paths = [os.path.join(settings.MEDIA_ROOT, name) for (blob_id, name) in items if blob_id is None and name]
+	transaction.on_commit(lambda: remove_files(legacy_paths))
+
+	return len(ids)
+
+def remove_files(paths):
+	for path in paths:
+		try:
+			os.remove(path)
+		except FileNotFoundError:
+			pass
+
+def process_deletions(batch_size=DELETION_BATCH_SIZE) -> int:
+	"""
+	Works through the queued deletions until there are none left, one
+	batch per transaction. Any number of workers can run at once, each
+	task is locked by the one working on it. Returns how many items
+	were removed.
+	"""
+	removed = 0
+	while True:
+		with transaction.atomic():
+			task = DeletionTask.objects.select_for_update(skip_locked=True).order_by('created_at').first()
+			if task is None:
+				return removed
+
+			removed += delete_next_batch(task, batch_size)
@@ -0,0 +1,266 @@
+import mimetypes
+import uuid
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+from .models import FilesystemItem
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+DOWNLOAD_DELIVERIES = ('django', 'x-accel-redirect', 'x-sendfile')
+
+def get_download_delivery() -> str:
+	# a typo would otherwise quietly stream every download from the workers
+	delivery = getattr(settings, 'DOWNLOAD_DELIVERY', 'django')
+	if delivery not in DOWNLOAD_DELIVERIES:
+		raise ImproperlyConfigured(f'DOWNLOAD_DELIVERY must be one of {", ".join(DOWNLOAD_DELIVERIES)}, not {delivery!r}.')
+	return delivery
+
+DOWNLOAD_DELIVERY = get_download_delivery()
+DOWNLOAD_ACCEL_REDIRECT_PREFIX = getattr(settings, 'DOWNLOAD_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+
+# requests asking for more (non-overlapping) ranges than this get the whole file
+MAX_RANGES = 16
+
+def parse_range_header(header: str, size: int):
+	"""
+	Parses a Range header (RFC 7233) against a representation of size bytes.
+	Returns None when the header should be ignored, otherwise the list of
+	satisfiable (first, last) byte ranges, sorted and coalesced. An empty
+	list means that none of the ranges can be satisfied.
+	"""
+	units, sep, specs = header.partition('=')
+	if not sep or units.strip().lower() != 'bytes':
+		return None
+
+	ranges = []
+	for spec in specs.split(','):
+		spec = spec.strip()
+		if not spec:
+			continue
+
+		first, sep, last = spec.partition('-')
+		first, last = first.strip(), last.strip()
+		if not sep or (first and not first.isdigit()) or (last and not last.isdigit()):
+			return None
+
+		if not first:
+			# suffix range: the last n bytes
+			if not last:
+				return None
+			suffix = int(last)
+			if suffix > 0 and size > 0:
+				ranges.append((max(size - suffix, 0), size - 1))
+			continue
+
+		first = int(first)
+		if last and int(last) < first:
+			return None
+		last = int(last) if last else size - 1
+		if first < size:
+			ranges.append((first, min(last, size - 1)))
+
+	if not ranges:
+		return []
+
+	ranges.sort()
+	coalesced = [ranges[0]]
+	for (first, last) in ranges[1:]:
+		(prev_first, prev_last) = coalesced[-1]
+		if first <= prev_last + 1:
+			coalesced[-1] = (prev_first, max(prev_last, last))
+		else:
+			coalesced.append((first, last))
+
+	if len(coalesced) > MAX_RANGES:
+		return None
+
+	return coalesced
+
+def if_range_matches(request, etag, last_modified) -> bool:
+	"""
+	Whether the validator in If-Range still matches the representation,
+	in which case the Range header applies.
+	"""
+	if_range = request.META.get('HTTP_IF_RANGE')
+	if not if_range:
+		return True
+
+	if if_range.startswith('"'):
+		return etag is not None and if_range == etag
+
+	if if_range.startswith('W/'):
+		# weak validators can't be used with ranges
+		return False
+
+	if_range_date = parse_http_date_safe(if_range)
+	return if_range_date is not None and last_modified is not None and if_range_date == last_modified
+
+def iter_file_ranges(file, ranges, chunk_size=DOWNLOAD_CHUNK_SIZE, part_headers=None, closing=b''):
+	"""
+	Reads the given byte ranges of file in chunks. When part_headers are
+	given they are written before each range, as multipart/byteranges needs.
+	"""
+	try:
+		for (index, (first, last)) in enumerate(ranges):
+			if part_headers is not None:
+				yield part_headers[index]
+
+			file.seek(first)
+			remaining = last - first + 1
+			while remaining > 0:
+				chunk = file.read(min(chunk_size, remaining))
+				if not chunk:
+					break
+				remaining -= len(chunk)
+				yield chunk
+
+		if closing:
+			yield closing
+	finally:
+		file.close()
+
+class FileRange:
+	"""
+	File-like view of the length bytes of file that start at first. It
+	exposes the real file descriptor, already positioned at first, so that
+	WSGI servers implementing wsgi.file_wrapper with os.sendfile (like
+	gunicorn) send the range without copying it through Python.
+	"""
+	def __init__(self, file, first, length):
+		file.seek(first)
+		self.file = file
+		self.remaining = length
+
+	def fileno(self):
+		return self.file.fileno()
+
+	def read(self, size=-1):
+		if self.remaining <= 0:
+			return b''
+		if size < 0 or size > self.remaining:
+			size = self.remaining
+
+		data = self.file.read(size)
+		self.remaining -= len(data)
+		return data
+
+	def close(self):
+		self.file.close()
+
+def item_file_etag(item: FilesystemItem) -> str:
+	"""
+	Strong ETag of the contents of the file item. Files uploaded before
+	they were hashed fall back to their modification time and size.
+	"""
+	if item.sha256:
+		return f'"{item.sha256}"'
+	return f'"{int(item.updated_at.timestamp())}-{item.filesize}"'
+
+def offload_item_file(item: FilesystemItem, delivery):
+	"""
+	Returns an empty response that tells the reverse proxy in front of us
+	to send the file itself. The proxy takes care of ranges too.
+	"""
+	content_type = mimetypes.guess_type(item.name)[0] or 'application/octet-stream'
+	response = HttpResponse(content_type=content_type)
+
+	if delivery == 'x-accel-redirect':
+		response['X-Accel-Redirect'] = DOWNLOAD_ACCEL_REDIRECT_PREFIX + quote(item.uploaded_file.name)
+	else:
+		response['X-Sendfile'] = item.uploaded_file.path
+
+	response['Content-Disposition'] = f'inline; filename="{item.name}"'
+	return response
+
+def serve_item_file(request, item: FilesystemItem):
+	"""
+	Returns the contents of the file item, honoring Range and If-Range
+	headers with 206 and 416 responses. Depending on DOWNLOAD_DELIVERY
+	the file is either sent from here or handed to the reverse proxy.
+
+	Whole files and single ranges are returned as FileResponses, which the
+	WSGI server can send with sendfile. The headers come from the stored
+	metadata of the item, so the file doesn't even have to be stat'ed, and
+	conditional GETs (If-None-Match, If-Modified-Since) are answered with
+	a 304 before it's opened.
+	"""
+	etag = item_file_etag(item)
+	last_modified = int(item.updated_at.timestamp())
+
+	# shares are downloaded with a POST, which a matching If-None-Match would turn into a 412
+	if request.method in ('GET', 'HEAD'):
+		response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+		if response is not None:
+			response['ETag'] = etag
+			response['Last-Modified'] = http_date(last_modified)
+			return response
+
+	if DOWNLOAD_DELIVERY != 'django':
+		return offload_item_file(item, DOWNLOAD_DELIVERY)
+
+	try:
+		file = open(item.uploaded_file.path, 'rb')
+	except (FileNotFoundError, ValueError):
+		raise Http404
+
+	size = item.filesize
+	content_type = mimetypes.guess_type(item.name)[0] or 'application/octet-stream'
+
+	range_header = request.META.get('HTTP_RANGE')
+	ranges = None
+	if range_header and if_range_matches(request, etag, last_modified):
+		ranges = parse_range_header(range_header, size)
+
+	if ranges is None:
+		response = FileResponse(FileRange(file, 0, size), content_type=content_type)
+		response['Content-Length'] = str(size)
+	elif not ranges:
+		file.close()
+		response = HttpResponse(status=416)
+		response['Content-Range'] = f'bytes */{size}'
+	elif len(ranges) == 1:
+		(first, last) = ranges[0]
+		response = FileResponse(FileRange(file, first, last - first + 1), status=206, content_type=content_type)
+		response['Content-Range'] = f'bytes {first}-{last}/{size}'
+		response['Content-Length'] = str(last - first + 1)
+	else:
+		boundary = uuid.uuid4().hex
+		part_headers = [
+			(
+				f'--{boundary}\r\n'
+				f'Content-Type: {content_type}\r\n'
+				f'Content-Range: bytes {first}-{last}/{size}\r\n\r\n'
+			).encode()
+			for (first, last) in ranges
+		]
+		# every part but the first is preceded by the CRLF that ends the previous one
+		part_headers = part_headers[:1] + [b'\r\n' + headers for headers in part_headers[1:]]
+		closing = f'\r\n--{boundary}--\r\n'.encode()
+
+		response = StreamingHttpResponse(
+			iter_file_ranges(file, ranges, part_headers=part_headers, closing=closing),
+			status=206,
+			content_type=f'multipart/byteranges; boundary={boundary}'
+		)
+		response['Content-Length'] = str(
+			sum(len(headers) for headers in part_headers)
+			+ sum(last - first + 1 for (first, last) in ranges)
+			+ len(closing)
+		)
+
+	if isinstance(response, FileResponse):
+		# used when the server can't sendfile, much larger than the default 4 KiB
+		response.block_size = DOWNLOAD_CHUNK_SIZE
+
+	response['Accept-Ranges'] = 'bytes'
+	response['ETag'] = etag
+	response['Last-Modified'] = http_date(last_modified)
+	if response.status_code != 416:
+		response['Content-Disposition'] = f'inline; filename="{item.name}"'
+	return response
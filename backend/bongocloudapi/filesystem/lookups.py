@@ -0,0 +1,60 @@
+from django.core.exceptions import ValidationError
+from django.http import Http404
+
+from .models import FilesystemItem, FilesystemSharedItem, ShareGroup, UploadSession
+
+def request_cache(request) -> dict:
+	"""
+	Dict that lives as long as the request. It's kept on the HttpRequest,
+	so DRF's Request and the permission classes see the same one.
+	"""
+	http_request = getattr(request, '_request', request)
+	if not hasattr(http_request, 'filesystem_cache'):
+		http_request.filesystem_cache = {}
+	return http_request.filesystem_cache
+
+def get_cached_object_or_404(request, queryset, pk):
+	cache = request_cache(request)
+	key = (queryset.model, str(pk))
+	if key not in cache:
+		# a missing object is remembered too
+		try:
+			cache[key] = queryset.filter(pk=pk).first()
+		except (ValidationError, ValueError):
+			cache[key] = None
+
+	if cache[key] is None:
+		raise Http404
+	return cache[key]
+
+def get_item_or_404(request, pk) -> FilesystemItem:
+	"""
+	The FilesystemItem with pk, along with whether it's shared. It's fetched
+	only once per request, by whichever of the permission checks and the
+	view asks for it first.
+	"""
+	return get_cached_object_or_404(request, FilesystemItem.objects.with_share_state(), pk)
+
+def get_shared_item_or_404(request, pk) -> FilesystemSharedItem:
+	"""
+	The FilesystemSharedItem with pk, its item, the item's owner and
+	whether the user may access it, fetched only once per request.
+	Expired shares, and shares of deleted items, aren't found.
+	"""
+	queryset = (
+		FilesystemSharedItem.objects
+			.active()
+			.filter(item__is_deleted=False)
+			.with_access_state(request.user)
+			.select_related('item__owner')
+	)
+	shared_item = get_cached_object_or_404(request, queryset, pk)
+	# it obviously is shared, is_shared() doesn't have to ask
+	shared_item.item.has_share = True
+	return shared_item
+
+def get_upload_session_or_404(request, pk) -> UploadSession:
+	return get_cached_object_or_404(request, UploadSession.objects.all(), pk)
+
+def get_share_group_or_404(request, pk) -> ShareGroup:
+	return get_cached_object_or_404(request, ShareGroup.objects.all(), pk)
@@ -0,0 +1,118 @@
+import os
+import socket
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.utils import timezone
+from django.views.static import serve
+
+from filesystem.downloads import serve_item_file
+from filesystem.models import FilesystemItem
+
+
+class Drain(threading.Thread):
+	"""
+	Reads and discards everything that arrives on sock, like a fast client.
+	"""
+	def __init__(self, sock):
+		super().__init__(daemon=True)
+		self.sock = sock
+		self.received = 0
+
+	def run(self):
+		buffer = bytearray(1024 * 1024)
+		while True:
+			count = self.sock.recv_into(buffer)
+			if count == 0:
+				return
+			self.received += count
+
+	def wait_for(self, total):
+		while self.received < total:
+			time.sleep(0.001)
+
+
+def send_with_python(response, sock):
+	for chunk in response:
+		sock.sendall(chunk)
+
+def send_with_sendfile(response, sock):
+	# what gunicorn does with responses that went through wsgi.file_wrapper
+	fd = response.file_to_stream.fileno()
+	offset = os.lseek(fd, 0, os.SEEK_CUR)
+	remaining = int(response['Content-Length'])
+	while remaining > 0:
+		sent = os.sendfile(sock.fileno(), fd, offset, remaining)
+		if sent == 0:
+			break
+		offset += sent
+		remaining -= sent
+
+
+class Command(BaseCommand):
+	help = (
+		'Compares the throughput and CPU time per GB of the old django.views.static.serve '
+		'download path with serve_item_file, with and without sendfile.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--size-mb', type=int, default=512)
+		parser.add_argument('--runs', type=int, default=3)
+
+	def handle(self, *args, **options):
+		size = options['size_mb'] * 1024 * 1024
+		name = f'benchmark-{uuid.uuid4().hex}'
+		path = os.path.join(settings.MEDIA_ROOT, name)
+
+		os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
+		with open(path, 'wb') as file:
+			block = os.urandom(1024 * 1024)
+			for _ in range(options['size_mb']):
+				file.write(block)
+
+		item = FilesystemItem(name='benchmark.bin', is_file=True, filesize=size, uploaded_file=name, updated_at=timezone.now())
+		request = RequestFactory().get('/')
+
+		cases = [
+			('serve(), Python copy', lambda: serve(request, name, document_root=settings.MEDIA_ROOT), send_with_python),
+			('serve_item_file(), Python copy', lambda: serve_item_file(request, item), send_with_python),
+			('serve_item_file(), sendfile', lambda: serve_item_file(request, item), send_with_sendfile),
+		]
+
+		(sender, receiver) = socket.socketpair()
+		drain = Drain(receiver)
+		drain.start()
+
+		total = 0
+		try:
+			for (label, get_response, send) in cases:
+				best_wall = best_cpu = None
+				for _ in range(options['runs']):
+					response = get_response()
+
+					wall_start = time.perf_counter()
+					cpu_start = time.thread_time()
+					send(response, sender)
+					cpu = time.thread_time() - cpu_start
+					total += size
+					drain.wait_for(total)
+					wall = time.perf_counter() - wall_start
+					response.close()
+
+					best_wall = wall if best_wall is None else min(best_wall, wall)
+					best_cpu = cpu if best_cpu is None else min(best_cpu, cpu)
+
+				gigabytes = size / 1024 ** 3
+				self.stdout.write(
+					f'{label:<32} {size / 1024 ** 2 / best_wall:8.0f} MB/s '
+					f'{best_cpu / gigabytes:8.3f} CPU s/GB'
+				)
+		finally:
+			sender.close()
+			drain.join()
+			receiver.close()
+			os.remove(path)
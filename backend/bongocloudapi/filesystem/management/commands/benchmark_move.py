@@ -0,0 +1,82 @@
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from filesystem.models import FilesystemItem, FilesystemItemAncestry, hash_path, rewrite_subtree_paths
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+	help = (
+		'Builds a synthetic tree, renames its root and reports how long rewriting the '
+		'descendant paths took. Everything runs in a transaction that is rolled back.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--nodes', type=int, default=100000)
+		parser.add_argument('--fanout', type=int, default=10)
+		parser.add_argument('--batch-size', type=int, default=1000)
+
+	def handle(self, *args, **options):
+		with transaction.atomic():
+			root = self.build_tree(options['nodes'], options['fanout'], options['batch_size'])
+
+			old_path = root.path
+			root.name = 'benchmark-renamed'
+			root.save(update_fields=['name', 'path', 'updated_at'])
+
+			with CaptureQueriesContext(connection) as queries:
+				start = time.perf_counter()
+				rewritten = rewrite_subtree_paths(root, old_path)
+				elapsed = time.perf_counter() - start
+
+			self.stdout.write(f'Rewrote {rewritten} paths in {elapsed * 1000:.1f} ms using {len(queries)} queries.')
+			transaction.set_rollback(True)
+
+	def build_tree(self, nodes, fanout, batch_size):
+		owner = User.objects.create_user(
+			email=f'{uuid.uuid4().hex}@benchmark.local',
+			username=f'benchmark-{uuid.uuid4().hex[:12]}'
+		)
+
+		root = FilesystemItem(owner=owner, name='benchmark', is_file=False)
+		root.save()
+
+		items = []
+		links = []
+		ancestors = {root.pk: [root.pk]}
+		folders = [root]
+		while len(items) + 1 < nodes:
+			parent = folders.pop(0)
+			for i in range(fanout):
+				if len(items) + 1 >= nodes:
+					break
+
+				name = f'item-{len(items)}'
+				path = f'{parent.path}/{name}'
+				child = FilesystemItem(
+					owner=owner,
+					parent=parent,
+					name=name,
+					path=path,
+					path_hash=hash_path(path),
+					is_file=i % 2 == 1
+				)
+				items.append(child)
+				if not child.is_file:
+					folders.append(child)
+
+				ancestors[child.pk] = ancestors[parent.pk] + [child.pk]
+				depth = len(ancestors[child.pk]) - 1
+				for (level, ancestor_id) in enumerate(ancestors[child.pk]):
+					links.append(FilesystemItemAncestry(ancestor_id=ancestor_id, descendant_id=child.pk, depth=depth - level))
+
+		FilesystemItem.objects.bulk_create(items, batch_size=batch_size)
+		FilesystemItemAncestry.objects.bulk_create(links, batch_size=batch_size)
+		self.stdout.write(f'Built a tree of {len(items) + 1} items.')
+		return root
@@ -0,0 +1,93 @@
+import random
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from filesystem.models import FilesystemItem, FilesystemItemAncestry, FilesystemItemTrigram, hash_path, name_trigrams
+from filesystem.search import search_items
+
+User = get_user_model()
+
+WORDS = [
+	'report', 'invoice', 'holiday', 'backup', 'draft', 'final', 'budget', 'photo', 'scan', 'notes',
+	'contract', 'summary', 'meeting', 'project', 'archive', 'family', 'design', 'export', 'review', 'plan',
+]
+EXTENSIONS = ['pdf', 'jpg', 'png', 'txt', 'docx', 'xlsx', 'zip', 'mp4']
+
+SEARCHES = [
+	('substring', 'report', ''),
+	('substring', 'ject-12', ''),
+	('substring', '', 'docx'),
+	('substring', 'holiday', 'jpg'),
+	('prefix', 'inv', ''),
+]
+
+
+class Command(BaseCommand):
+	help = (
+		'Fills the tree of a new user with items of random names and reports the p50 and p99 '
+		'time of a first page of search results for a few searches. Everything runs in a '
+		'transaction that is rolled back.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--items', type=int, default=100000)
+		parser.add_argument('--runs', type=int, default=100)
+		parser.add_argument('--page-size', type=int, default=50)
+		parser.add_argument('--batch-size', type=int, default=5000)
+
+	def handle(self, *args, **options):
+		with transaction.atomic():
+			owner = self.build_tree(options['items'], options['batch_size'])
+
+			for (match, query, extension) in SEARCHES:
+				timings = []
+				for _ in range(options['runs']):
+					start = time.perf_counter()
+					results = list(search_items(owner, query, match, extension)[:options['page_size']])
+					timings.append(time.perf_counter() - start)
+
+				timings.sort()
+				p50 = timings[len(timings) // 2]
+				p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+				label = f'{match} q={query!r} ext={extension!r}'
+				self.stdout.write(f'{label:<40} p50 {p50 * 1000:8.2f} ms  p99 {p99 * 1000:8.2f} ms  {len(results)} results')
+
+			transaction.set_rollback(True)
+
+	def build_tree(self, count, batch_size):
+		owner = User.objects.create_user(
+			email=f'{uuid.uuid4().hex}@benchmark.local',
+			username=f'benchmark-{uuid.uuid4().hex[:12]}'
+		)
+
+		root = FilesystemItem(owner=owner, name='benchmark', is_file=False)
+		root.save()
+
+		items = []
+		links = []
+		trigrams = []
+		for i in range(count):
+			name = f'{random.choice(WORDS)} {random.choice(WORDS)}-{i}.{random.choice(EXTENSIONS)}'
+			path = f'{root.path}/{name}'
+			item = FilesystemItem(owner=owner, parent=root, name=name, path=path, path_hash=hash_path(path), is_file=True)
+			items.append(item)
+			links.append(FilesystemItemAncestry(ancestor_id=item.pk, descendant_id=item.pk, depth=0))
+			links.append(FilesystemItemAncestry(ancestor_id=root.pk, descendant_id=item.pk, depth=1))
+			trigrams.extend(FilesystemItemTrigram(owner=owner, item_id=item.pk, trigram=trigram) for trigram in name_trigrams(name))
+
+			if len(items) >= batch_size:
+				self.insert(items, links, trigrams, batch_size)
+				(items, links, trigrams) = ([], [], [])
+
+		self.insert(items, links, trigrams, batch_size)
+		self.stdout.write(f'Built a tree of {count + 1} items.')
+		return owner
+
+	def insert(self, items, links, trigrams, batch_size):
+		FilesystemItem.objects.bulk_create(items, batch_size=batch_size)
+		FilesystemItemAncestry.objects.bulk_create(links, batch_size=batch_size)
+		FilesystemItemTrigram.objects.bulk_create(trigrams, batch_size=batch_size)
@@ -0,0 +1,83 @@
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from filesystem.lookups import get_shared_item_or_404
+from filesystem.models import FilesystemItem, FilesystemSharedItem
+from filesystem.permissions import IsOwnerOrInAllowedUsersOfSharedItem
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+	help = (
+		'Times the access check of shares with growing numbers of allowed users, for an allowed '
+		'user and for one who isn\'t, next to the old check that loaded every allowed user. '
+		'Everything runs in a transaction that is rolled back.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--sizes', type=int, nargs='+', default=[1, 1000, 100000])
+		parser.add_argument('--runs', type=int, default=20)
+		parser.add_argument('--batch-size', type=int, default=5000)
+
+	def handle(self, *args, **options):
+		with transaction.atomic():
+			owner = self.create_users(1, options['batch_size'])[0]
+			item = FilesystemItem(owner=owner, name=f'benchmark-{uuid.uuid4().hex}', is_file=True)
+			item.save()
+
+			factory = RequestFactory()
+			permission = IsOwnerOrInAllowedUsersOfSharedItem()
+
+			for size in options['sizes']:
+				users = self.create_users(size + 1, options['batch_size'])
+				(outsider, allowed_users) = (users[0], users[1:])
+
+				shared_item = FilesystemSharedItem.objects.create(item=item)
+				FilesystemSharedItem.allowed_users.through.objects.bulk_create(
+					[FilesystemSharedItem.allowed_users.through(filesystemshareditem_id=shared_item.pk, user_id=user.pk) for user in allowed_users],
+					batch_size=options['batch_size']
+				)
+
+				def old_check(user):
+					shared_item = FilesystemSharedItem.objects.select_related('item__owner').get(pk=shared_item_pk)
+					allowed_user_ids = list(shared_item.allowed_users.values_list('id', flat=True))
+					return len(allowed_user_ids) == 0 or user.id in allowed_user_ids
+
+				def new_check(user):
+					request = factory.get('/')
+					request.user = user
+					return permission.does_user_has_permission(request, get_shared_item_or_404(request, shared_item_pk))
+
+				shared_item_pk = shared_item.pk
+				for (label, check) in (('old', old_check), ('exists', new_check)):
+					for (who, user, expected) in (('allowed', allowed_users[-1], True), ('not allowed', outsider, False)):
+						with CaptureQueriesContext(connection) as queries:
+							start = time.perf_counter()
+							for _ in range(options['runs']):
+								assert check(user) == expected
+							elapsed = time.perf_counter() - start
+
+						self.stdout.write(
+							f'{size:>7} allowed users  {label:<7} {who:<12} '
+							f'{elapsed / options["runs"] * 1000:8.2f} ms/check '
+							f'{len(queries) / options["runs"]:4.1f} queries/check'
+						)
+
+			transaction.set_rollback(True)
+
+	def create_users(self, count, batch_size):
+		prefix = uuid.uuid4().hex[:12]
+		users = [
+			# an unusable password, hashing one would take longer than the benchmark
+			User(email=f'{prefix}-{i}@benchmark.local', username=f'benchmark-{prefix}-{i}', password='!')
+			for i in range(count)
+		]
+		User.objects.bulk_create(users, batch_size=batch_size)
+		return users
@@ -0,0 +1,60 @@
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from filesystem.models import Blob
+
+
+class Command(BaseCommand):
+	help = 'Removes the blobs that no FilesystemItem references anymore, and optionally stray files in the blob store.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--grace', type=int, default=3600, help='Seconds a blob, or stray file, is left alone after its last change.')
+		parser.add_argument('--orphans', action='store_true', help='Also remove files in the blob store without a Blob row.')
+
+	def handle(self, *args, **options):
+		cutoff = timezone.now() - timedelta(seconds=options['grace'])
+
+		collected = 0
+		candidates = Blob.objects.filter(refcount=0, updated_at__lt=cutoff).values_list('pk', flat=True)
+		for sha256 in candidates.iterator():
+			with transaction.atomic():
+				# an upload may have taken a new reference in the meantime
+				blob = Blob.objects.select_for_update().filter(pk=sha256, refcount=0).first()
+				if blob is None or blob.items.exists():
+					continue
+
+				# while the row is locked, store_blob waits for it and then finds neither the
+				# row nor the file. A rollback leaves a row without a file, which isn't referenced
+				blob_path = blob.path()
+				if os.path.isfile(blob_path):
+					os.remove(blob_path)
+				blob.delete()
+			collected += 1
+
+		self.stdout.write(self.style.SUCCESS(f'Collected {collected} blobs.'))
+
+		if options['orphans']:
+			self.remove_orphans(time.time() - options['grace'])
+
+	def remove_orphans(self, cutoff):
+		removed = 0
+		for (directory, _, filenames) in os.walk(os.path.join(settings.MEDIA_ROOT, 'blobs')):
+			for filename in filenames:
+				path = os.path.join(directory, filename)
+				try:
+					if os.path.getmtime(path) >= cutoff:
+						continue
+				except FileNotFoundError:
+					continue
+
+				if not Blob.objects.filter(pk=filename).exists():
+					os.remove(path)
+					removed += 1
+
+		self.stdout.write(self.style.SUCCESS(f'Removed {removed} orphaned files.'))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from filesystem.deletions import DELETION_BATCH_SIZE, process_deletions
+
+
+class Command(BaseCommand):
+	help = 'Removes the rows and files of deleted items in batches. Deletions that were cut short are picked up again.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=DELETION_BATCH_SIZE)
+		parser.add_argument('--loop', action='store_true', help='Keep waiting for new deletions instead of exiting.')
+		parser.add_argument('--interval', type=float, default=5, help='Seconds to wait when there is nothing to delete, with --loop.')
+
+	def handle(self, *args, **options):
+		while True:
+			removed = process_deletions(options['batch_size'])
+			if removed or not options['loop']:
+				self.stdout.write(self.style.SUCCESS(f'Removed {removed} items.'))
+
+			if not options['loop']:
+				return
+			if not removed:
+				time.sleep(options['interval'])
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from filesystem.models import FilesystemSharedItem
+
+
+class Command(BaseCommand):
+	help = 'Deletes the expired shares, a batch at a time. Until then they are only hidden.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=500)
+		parser.add_argument('--loop', action='store_true', help='Keep sweeping instead of exiting.')
+		parser.add_argument('--interval', type=float, default=60, help='Seconds between sweeps, with --loop.')
+
+	def handle(self, *args, **options):
+		while True:
+			purged = self.purge(options['batch_size'])
+			if purged or not options['loop']:
+				self.stdout.write(self.style.SUCCESS(f'Purged {purged} expired shares.'))
+
+			if not options['loop']:
+				return
+			time.sleep(options['interval'])
+
+	def purge(self, batch_size):
+		purged = 0
+		while True:
+			# a range scan of the (does_expire, expiry) index
+			ids = list(FilesystemSharedItem.objects.expired().values_list('pk', flat=True)[:batch_size])
+			if not ids:
+				return purged
+
+			with transaction.atomic():
+				# through the Collector, the allowed users go too and the listings are touched
+				FilesystemSharedItem.objects.filter(pk__in=ids).delete()
+			purged += len(ids)
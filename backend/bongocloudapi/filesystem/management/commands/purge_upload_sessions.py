@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from filesystem.models import UploadSession
+from filesystem.quota import delete_upload_sessions
+
+
+class Command(BaseCommand):
+	help = 'Deletes the upload sessions, and their blobs, that were not committed in time.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--max-age', type=int, default=settings.UPLOAD_SESSION_MAX_AGE, help='Seconds since the last received chunk.')
+
+	def handle(self, *args, **options):
+		cutoff = timezone.now() - timedelta(seconds=options['max_age'])
+
+		purged = 0
+		for session in UploadSession.objects.filter(updated_at__lt=cutoff).iterator():
+			# one by one, so that a purge that stops halfway leaves no reservation behind
+			with transaction.atomic():
+				delete_upload_sessions(UploadSession.objects.filter(pk=session.pk))
+			purged += 1
+
+		self.stdout.write(self.style.SUCCESS(f'Purged {purged} upload sessions.'))
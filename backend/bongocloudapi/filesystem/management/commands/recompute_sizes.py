@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from filesystem.models import FilesystemItem, FilesystemItemAncestry
+
+
+class Command(BaseCommand):
+	help = 'Recomputes the stored size of every folder from the files in its subtree.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=1000)
+
+	def handle(self, *args, **options):
+		batch_size = options['batch_size']
+
+		(folders, changed, last_id) = (0, 0, None)
+		while True:
+			with transaction.atomic():
+				batch = FilesystemItem.objects.filter(is_file=False).order_by('pk')
+				if last_id is not None:
+					batch = batch.filter(pk__gt=last_id)
+				# locked until the batch is written, uploads and deletes meanwhile wait for
+				# it and change the sizes it computed instead of being overwritten by them
+				folder_sizes = dict(batch.select_for_update().values_list('id', 'filesize')[:batch_size])
+				if not folder_sizes:
+					break
+
+				# one grouped query over the closure table sums the files under the folders
+				totals = dict(
+					FilesystemItemAncestry.objects
+						.filter(ancestor_id__in=folder_sizes.keys(), descendant__is_file=True, descendant__is_deleted=False, depth__gt=0)
+						.values('ancestor_id')
+						.annotate(total=Sum('descendant__filesize'))
+						.values_list('ancestor_id', 'total')
+				)
+
+				corrected = [
+					FilesystemItem(id=id, filesize=totals.get(id, 0))
+					for (id, filesize) in folder_sizes.items()
+					if totals.get(id, 0) != filesize
+				]
+				FilesystemItem.objects.bulk_update(corrected, ['filesize'], batch_size=batch_size)
+
+			folders += len(folder_sizes)
+			changed += len(corrected)
+			last_id = list(folder_sizes)[-1]
+
+		self.stdout.write(self.style.SUCCESS(f'Updated the size of {changed} of {folders} folders.'))
@@ -0,0 +1,41 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from filesystem.quota import actual_storage_used
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+	help = (
+		'Recomputes the storage used by every user from the sizes of the items at the root of '
+		'their tree, which include their subtrees, and of their open upload sessions. Run '
+		'recompute_sizes first if those may be off.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=1000)
+
+	def handle(self, *args, **options):
+		batch_size = options['batch_size']
+
+		storage_used = actual_storage_used()
+
+		(users, changed, last_id) = (0, 0, None)
+		while True:
+			batch = User.objects.order_by('pk')
+			if last_id is not None:
+				batch = batch.filter(pk__gt=last_id)
+			ids = list(batch.values_list('pk', flat=True)[:batch_size])
+			if not ids:
+				break
+
+			# one UPDATE per batch, so uploads finishing meanwhile aren't lost
+			changed += User.objects.filter(pk__in=ids).annotate(actual=storage_used).exclude(storage_used=F('actual')).count()
+			User.objects.filter(pk__in=ids).update(storage_used=storage_used)
+
+			users += len(ids)
+			last_id = ids[-1]
+
+		self.stdout.write(self.style.SUCCESS(f'Corrected the storage used by {changed} of {users} users.'))
@@ -0,0 +1,173 @@
+import os
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from filesystem.models import Blob, FilesystemItem, UploadSession
+from filesystem.quota import actual_storage_used
+
+User = get_user_model()
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+	help = (
+		'Finds the files in MEDIA_ROOT that nothing in the database refers to anymore: blobs without a '
+		'Blob row, uploads without an UploadSession, files of deleted items and leftover staged uploads. '
+		'Also finds the Blob rows whose file is missing, and the users whose storage used is off.'
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument('--grace', type=int, default=3600, help='Seconds a file is left alone after its last change.')
+		parser.add_argument(
+			'--fix', '--delete', dest='fix', action='store_true',
+			help=(
+				'Remove the orphaned files, and the rows of unreferenced blobs without a file, and '
+				'correct the storage used, instead of only listing them. Referenced blobs without a '
+				'file are only listed.'
+			)
+		)
+
+	def handle(self, *args, **options):
+		self.fix = options['fix']
+		self.orphans = 0
+		cutoff = time.time() - options['grace']
+
+		batch = []
+		for (name, path) in self.iter_files(cutoff):
+			batch.append((name, path))
+			if len(batch) >= BATCH_SIZE:
+				self.check_batch(batch)
+				batch = []
+		self.check_batch(batch)
+
+		verb = 'Removed' if self.fix else 'Found'
+		self.stdout.write(self.style.SUCCESS(f'{verb} {self.orphans} orphaned files.'))
+
+		missing = self.check_blob_rows(timezone.now() - timedelta(seconds=options['grace']))
+		self.stdout.write(self.style.SUCCESS(f'Found {missing} blobs without a file.'))
+
+		drifted = self.check_storage_used()
+		verb = 'Corrected' if self.fix else 'Found'
+		self.stdout.write(self.style.SUCCESS(f'{verb} the storage used of {drifted} users.'))
+
+	def iter_files(self, cutoff):
+		# (storage name, path) of every file in MEDIA_ROOT old enough to be looked at
+		for (directory, _, filenames) in os.walk(settings.MEDIA_ROOT):
+			for filename in filenames:
+				path = os.path.join(directory, filename)
+				try:
+					if os.path.getmtime(path) >= cutoff:
+						continue
+				except FileNotFoundError:
+					continue
+
+				yield (os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/'), path)
+
+	def check_batch(self, batch):
+		blobs = {}
+		uploads = {}
+		files = {}
+		for (name, path) in batch:
+			if name.startswith('blobs/'):
+				blobs[os.path.basename(name)] = path
+			elif name.startswith('uploads/'):
+				uploads[os.path.basename(name)] = path
+			elif name.startswith('staging/'):
+				# a staged upload is moved into the blob store within its request
+				self.orphaned(path)
+			else:
+				files[name] = path
+
+		known = set(Blob.objects.filter(pk__in=blobs).values_list('pk', flat=True))
+		for (sha256, path) in blobs.items():
+			if sha256 not in known:
+				self.orphaned(path)
+
+		known = {str(id) for id in UploadSession.objects.filter(pk__in=self.valid_uuids(uploads)).values_list('pk', flat=True)}
+		for (id, path) in uploads.items():
+			if id not in known:
+				self.orphaned(path)
+
+		# files uploaded before the blob store existed, all_objects because deleted items still own theirs
+		known = set(FilesystemItem.all_objects.filter(uploaded_file__in=files).values_list('uploaded_file', flat=True))
+		for (name, path) in files.items():
+			if name not in known:
+				self.orphaned(path)
+
+	def valid_uuids(self, names):
+		valid = []
+		for name in names:
+			try:
+				valid.append(uuid.UUID(name))
+			except ValueError:
+				pass
+		return valid
+
+	def check_blob_rows(self, cutoff):
+		# Blob rows whose file is gone, the unreferenced ones are removed like collect_blobs would
+		(missing, last_pk) = (0, None)
+		while True:
+			batch = Blob.objects.filter(updated_at__lt=cutoff).order_by('pk')
+			if last_pk is not None:
+				batch = batch.filter(pk__gt=last_pk)
+			batch = list(batch[:BATCH_SIZE])
+			if not batch:
+				return missing
+
+			for blob in batch:
+				if os.path.isfile(blob.path()):
+					continue
+
+				missing += 1
+				self.stdout.write(f'{blob.sha256}: missing file, {blob.refcount} references')
+				if self.fix:
+					with transaction.atomic():
+						# locked like in collect_blobs, an upload may be putting the file back
+						blob = Blob.objects.select_for_update().filter(pk=blob.pk, refcount=0).first()
+						if blob is not None and not blob.items.exists() and not os.path.isfile(blob.path()):
+							blob.delete()
+
+			last_pk = batch[-1].pk
+
+	def check_storage_used(self):
+		storage_used = actual_storage_used()
+
+		(drifted, last_id) = (0, None)
+		while True:
+			batch = User.objects.order_by('pk')
+			if last_id is not None:
+				batch = batch.filter(pk__gt=last_id)
+			ids = list(batch.values_list('pk', flat=True)[:BATCH_SIZE])
+			if not ids:
+				return drifted
+
+			users = User.objects.filter(pk__in=ids).annotate(actual=storage_used).exclude(storage_used=F('actual'))
+			for (username, stored, actual) in users.values_list('username', 'storage_used', 'actual'):
+				drifted += 1
+				self.stdout.write(f'{username}: storage used is {stored}, should be {actual}')
+
+			if self.fix:
+				# computed in the UPDATE, like recompute_usage, so uploads finishing meanwhile aren't lost
+				User.objects.filter(pk__in=ids).update(storage_used=storage_used)
+
+			last_id = ids[-1]
+
+	def orphaned(self, path):
+		self.orphans += 1
+		if not self.fix:
+			self.stdout.write(path)
+			return
+
+		try:
+			os.remove(path)
+		except FileNotFoundError:
+			pass
@@ -0,0 +1,47 @@
+# Generated by Django 4.1.1 on 2026-10-18 13:40
+
+from collections import defaultdict
+from django.db import migrations
+
+def forwards(apps, _):
+	FilesystemItem = apps.get_model('filesystem', 'FilesystemItem')
+
+	children = defaultdict(list)
+	file_sizes = {}
+	for (id, parent_id, is_file, filesize) in FilesystemItem.objects.values_list('id', 'parent_id', 'is_file', 'filesize'):
+		children[parent_id].append(id)
+		if is_file:
+			file_sizes[id] = filesize
+
+	totals = {}
+	stack = [(id, False) for id in children[None]]
+	while stack:
+		(id, visited) = stack.pop()
+		if id in file_sizes:
+			totals[id] = file_sizes[id]
+		elif visited:
+			totals[id] = sum(totals[child] for child in children[id])
+		else:
+			stack.append((id, True))
+			stack.extend((child, False) for child in children[id])
+
+	folders = [
+		FilesystemItem(id=id, filesize=size)
+		for (id, size) in totals.items()
+		if id not in file_sizes
+	]
+	FilesystemItem.objects.bulk_update(folders, ['filesize'], batch_size=1000)
+
+def backwards(apps, _):
+	FilesystemItem = apps.get_model('filesystem', 'FilesystemItem')
+	FilesystemItem.objects.filter(is_file=False).update(filesize=0)
+
+class Migration(migrations.Migration):
+
+	dependencies = [
+		('filesystem', '0009_filesystemshareditem_created_at_and_more'),
+	]
+
+	operations = [
+		migrations.RunPython(forwards, backwards)
+	]
@@ -0,0 +1,49 @@
+# Generated by Django 4.1.1 on 2026-10-18 13:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def forwards(apps, _):
+    FilesystemItem = apps.get_model('filesystem', 'FilesystemItem')
+    FilesystemItemAncestry = apps.get_model('filesystem', 'FilesystemItemAncestry')
+
+    parents = dict(FilesystemItem.objects.values_list('id', 'parent_id'))
+
+    links = []
+    for id in parents:
+        ancestor_id = id
+        depth = 0
+        while ancestor_id is not None:
+            links.append(FilesystemItemAncestry(ancestor_id=ancestor_id, descendant_id=id, depth=depth))
+            ancestor_id = parents[ancestor_id]
+            depth += 1
+
+    FilesystemItemAncestry.objects.bulk_create(links, batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesystem', '0010_folder_sizes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilesystemItemAncestry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='filesystem.filesystemitem')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='filesystem.filesystemitem')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='filesystemitemancestry',
+            index=models.Index(fields=['descendant', 'depth'], name='filesystem__descend_4f084e_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='filesystemitemancestry',
+            constraint=models.UniqueConstraint(fields=('ancestor', 'descendant'), name='unique_filesystemitem_ancestry'),
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.1 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesystem', '0012_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filesystemitem',
+            name='sha256',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
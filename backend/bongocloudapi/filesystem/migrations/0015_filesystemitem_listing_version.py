@@ -0,0 +1,18 @@
+# Generated by Django 4.1.1 on 2026-10-18 14:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesystem', '0014_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filesystemitem',
+            name='listing_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
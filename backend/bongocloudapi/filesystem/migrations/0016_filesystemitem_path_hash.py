@@ -0,0 +1,41 @@
+# Generated by Django 4.1.1 on 2026-10-18 14:11
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_path_hashes(apps, schema_editor):
+    FilesystemItem = apps.get_model('filesystem', 'FilesystemItem')
+
+    seen = set()
+    items = []
+    for (id, owner_id, path) in FilesystemItem.objects.order_by('created_at').values_list('id', 'owner_id', 'path').iterator():
+        path_hash = hashlib.sha256(path.encode('utf-8')).hexdigest()
+        # names used to be allowed to contain slashes, only the oldest item of an ambiguous path keeps it
+        if (owner_id, path_hash) in seen:
+            continue
+        seen.add((owner_id, path_hash))
+        items.append(FilesystemItem(id=id, path_hash=path_hash))
+
+    FilesystemItem.objects.bulk_update(items, ['path_hash'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesystem', '0015_filesystemitem_listing_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filesystemitem',
+            name='path_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.RunPython(backfill_path_hashes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='filesystemitem',
+            constraint=models.UniqueConstraint(fields=('owner', 'path_hash'), name='unique_filesystemitem_path'),
+        ),
+    ]
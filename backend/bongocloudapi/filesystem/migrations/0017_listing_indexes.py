@@ -0,0 +1,53 @@
+# Generated by Django 4.1.1 on 2026-10-18 14:13
+
+from django.db import migrations, models
+from django.db.models.functions import Length
+
+
+def check_name_lengths(apps, schema_editor):
+    FilesystemItem = apps.get_model('filesystem', 'FilesystemItem')
+
+    # refuse to truncate anybody's names, they have to be renamed first
+    too_long = list(FilesystemItem.objects.annotate(name_length=Length('name')).filter(name_length__gt=255).values_list('id', flat=True)[:20])
+    if too_long:
+        raise RuntimeError(
+            'These items have names longer than 255 characters, rename them and run the migration again: '
+            + ', '.join(str(id) for id in too_long)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesystem', '0016_filesystemitem_path_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_name_lengths, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='filesystemitem',
+            name='name',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='uploadsession',
+            name='name',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='filesystemitem',
+            index=models.Index(fields=['owner', 'parent', 'is_file', 'name', 'id'], name='filesystemitem_listing_name'),
+        ),
+        migrations.AddIndex(
+            model_name='filesystemitem',
+            index=models.Index(fields=['owner', 'parent', 'is_file', 'filesize', 'id'], name='filesystemitem_listing_size'),
+        ),
+        migrations.AddIndex(
+            model_name='filesystemitem',
+            index=models.Index(fields=['owner', 'parent', 'is_file', 'created_at', 'id'], name='filesystemitem_listing_created'),
+        ),
+        migrations.AddIndex(
+            model_name='filesystemitem',
+            index=models.Index(fields=['owner', 'parent', 'is_file', 'updated_at', 'id'], name='filesystemitem_listing_updated'),
+        ),
+    ]
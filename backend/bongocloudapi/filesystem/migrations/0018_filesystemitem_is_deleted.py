@@ -0,0 +1,27 @@
+# Generated by Django 4.1.1 on 2026-10-18 14:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesystem', '0017_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filesystemitem',
+            name='is_deleted',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='DeletionTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='deletion_task', to='filesystem.filesystemitem')),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.1 on 2026-10-18 14:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesystem', '0018_filesystemitem_is_deleted'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='filesystemshareditem',
+            index=models.Index(fields=['does_expire', 'expiry'], name='filesystemshareditem_expiry'),
+        ),
+    ]
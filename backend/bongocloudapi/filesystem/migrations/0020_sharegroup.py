@@ -0,0 +1,37 @@
+# Generated by Django 4.1.1 on 2026-10-18 14:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('filesystem', '0019_filesystemshareditem_expiry_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShareGroup',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('members', models.ManyToManyField(blank=True, related_name='member_of_share_groups', to=settings.AUTH_USER_MODEL)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='share_groups', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='filesystemshareditem',
+            name='allowed_groups',
+            field=models.ManyToManyField(blank=True, related_name='shared_items', to='filesystem.sharegroup'),
+        ),
+        migrations.AddConstraint(
+            model_name='sharegroup',
+            constraint=models.UniqueConstraint(fields=('owner', 'name'), name='unique_sharegroup_name'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.1.1 on 2026-10-18 14:34
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def name_trigrams(name):
+    # same as filesystem.models.name_trigrams
+    name = f'/{name.lower()}/'
+    return { name[i:i + 3] for i in range(len(name) - 2) }
+
+def forwards(apps, _):
+    FilesystemItem = apps.get_model('filesystem', 'FilesystemItem')
+    FilesystemItemTrigram = apps.get_model('filesystem', 'FilesystemItemTrigram')
+
+    rows = []
+    for (id, owner_id, name) in FilesystemItem.objects.values_list('id', 'owner_id', 'name').iterator(chunk_size=1000):
+        rows.extend(FilesystemItemTrigram(owner_id=owner_id, item_id=id, trigram=trigram) for trigram in name_trigrams(name))
+        if len(rows) >= 10000:
+            FilesystemItemTrigram.objects.bulk_create(rows, batch_size=1000)
+            rows = []
+
+    FilesystemItemTrigram.objects.bulk_create(rows, batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('filesystem', '0020_sharegroup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilesystemItemTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='name_trigrams', to='filesystem.filesystemitem')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='filesystemitemtrigram',
+            index=models.Index(fields=['owner', 'trigram', 'item'], name='filesystemitemtrigram_lookup'),
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.1 on 2026-10-18 14:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('filesystem', '0021_filesystemitemtrigram'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filesystemitem',
+            name='subtree_version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
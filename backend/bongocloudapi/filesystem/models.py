@@ -1,61 +1,395 @@
+import hashlib
+import os
 import uuid
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Case, Exists, F, OuterRef, Q, Value, When
+from django.db.models.functions import SHA256, Concat, Substr
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.utils import timezone
 
 User = settings.AUTH_USER_MODEL
 
 def filesystemitem_gen_path(item):
-	path = ''
-	if item.parent is not None:
-		parent = item.parent
-		while (parent is not None):
-			path = '/' + parent.name + path
-			parent = parent.parent
+	names = []
+	if item.parent_id is not None:
+		names = list(
+			FilesystemItem.objects
+				.filter(descendant_links__descendant_id=item.parent_id)
+				.order_by('-descendant_links__depth')
+				.values_list('name', flat=True)
+		)
 
-	path += '/' + item.name
-	return path
+	names.append(item.name)
+	return '/' + '/'.join(names)
+
+def normalize_path(path):
+	names = [name for name in path.split('/') if name]
+	return '/' + '/'.join(names)
+
+def hash_path(path):
+	# has to match what the SHA256 database function gives for the same path
+	return hashlib.sha256(path.encode('utf-8')).hexdigest()
+
+def name_trigrams(name):
+	"""
+	Every distinct three character sequence of name, lowercased and
+	between slashes, which no name contains, so that the start and the
+	end of the name have trigrams of their own. See filesystem.search.
+	"""
+	name = f'/{name.lower()}/'
+	return { name[i:i + 3] for i in range(len(name) - 2) }
+
+def propagate_size_change(parent_id, delta):
+	"""
+	Adds delta to the stored size of the folder with parent_id
+	and of all of its ancestors. Callers are expected to run this
+	inside the same transaction as the change that caused it.
+	"""
+	if parent_id is None or delta == 0:
+		return
+
+	# the sizes show up in the listings of these folders too
+	ancestors = FilesystemItem.objects.filter(pk__in=FilesystemItemAncestry.objects.filter(descendant_id=parent_id).values('ancestor_id'))
+	ancestors.update(filesize=F('filesize') + delta, listing_version=F('listing_version') + 1)
+
+def touch_listings(owner_id, folder_ids):
+	"""
+	Bumps the listing version of the given folders, where None stands for
+	the root folder of owner_id, so that clients holding an ETag of their
+	listings fetch them again. The subtree versions of these folders and
+	of all the folders above them are bumped along, in the same UPDATE.
+	"""
+	folder_ids = set(folder_ids)
+	if None in folder_ids:
+		folder_ids.discard(None)
+		get_user_model().objects.filter(pk=owner_id).update(listing_version=F('listing_version') + 1)
+
+	if folder_ids:
+		ancestor_ids = FilesystemItemAncestry.objects.filter(descendant_id__in=folder_ids).values('ancestor_id')
+		FilesystemItem.objects.filter(pk__in=ancestor_ids).update(
+			listing_version=Case(
+				When(pk__in=folder_ids, then=F('listing_version') + 1),
+				default=F('listing_version'),
+				output_field=models.PositiveBigIntegerField()
+			),
+			subtree_version=F('subtree_version') + 1
+		)
+
+def rewrite_subtree_paths(item, old_path):
+	"""
+	Rewrites the path of every descendant of item, after item was renamed
+	or moved away from old_path, with a single prefix-replacing UPDATE.
+	"""
+	if item.is_file or item.path == old_path:
+		return 0
+
+	new_path = Concat(Value(item.path), Substr('path', len(old_path) + 1))
+	# a subquery rather than a join, MySQL can't update a joined table without Django selecting the ids first
+	descendant_ids = FilesystemItemAncestry.objects.filter(ancestor=item, depth__gt=0).values('descendant_id')
+	return FilesystemItem.objects.filter(pk__in=descendant_ids).update(
+		# path_hash goes first, MySQL evaluates the assignments in order
+		path_hash=SHA256(new_path),
+		path=new_path,
+		# the listings of the subfolders show the paths of their children
+		listing_version=F('listing_version') + 1
+	)
+
+def move_subtree_ancestry(item):
+	"""
+	Relinks the subtree of item under its new parent in the closure table:
+	drops every link from the old ancestors into the subtree and inserts
+	the cross product of the new ancestors with the subtree.
+	"""
+	subtree = FilesystemItemAncestry.objects.filter(ancestor=item).values('descendant_id')
+	FilesystemItemAncestry.objects.filter(descendant_id__in=subtree).exclude(ancestor_id__in=subtree).delete()
+
+	if item.parent_id is None:
+		return
+
+	table = connection.ops.quote_name(FilesystemItemAncestry._meta.db_table)
+	pk_field = FilesystemItem._meta.pk
+	with connection.cursor() as cursor:
+		cursor.execute(
+			f"""
+			INSERT INTO {table} (ancestor_id, descendant_id, depth)
+			SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth + 1
+			FROM {table} a, {table} d
+			WHERE a.descendant_id = %s AND d.ancestor_id = %s
+			""",
+			[
+				pk_field.get_db_prep_value(item.parent_id, connection),
+				pk_field.get_db_prep_value(item.pk, connection),
+			]
+		)
+
+def detach_subtree(item):
+	"""
+	Deletes item and its subtree as far as everything else can tell, with
+	a single UPDATE, and queues them for process_deletions to remove for
+	real. Callers are expected to have taken the size of item off its
+	ancestors already.
+	"""
+	# subqueries, like in rewrite_subtree_paths
+	subtree_ids = FilesystemItemAncestry.objects.filter(ancestor=item).values('descendant_id')
+	# the path_hash is freed for new items at the same paths
+	FilesystemItem.all_objects.filter(pk__in=subtree_ids).update(is_deleted=True, path_hash=None)
+
+	# a subfolder that was deleted earlier is covered by this task from now on
+	DeletionTask.objects.filter(item_id__in=subtree_ids).delete()
+	DeletionTask.objects.create(item=item)
+
+def blob_storage_name(sha256):
+	# blobs are stored in MEDIA_ROOT/blobs/<ab>/<cd>/<sha256>
+	return f'blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}'
+
+def store_blob(path, sha256, size):
+	"""
+	Takes a reference to the blob with the contents of the file at path,
+	which must be in MEDIA_ROOT. The file is moved into the blob store if
+	the blob is new, otherwise it's just removed.
+	"""
+	with transaction.atomic():
+		(blob, _) = Blob.objects.select_for_update().get_or_create(sha256=sha256, defaults={ 'size': size })
+		Blob.objects.filter(pk=sha256).update(refcount=F('refcount') + 1)
+
+		blob_path = blob.path()
+		if os.path.isfile(blob_path):
+			os.remove(path)
+		else:
+			os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+			os.rename(path, blob_path)
+
+	return blob
+
+def reference_blob(sha256, size):
+	"""
+	Takes one more reference to an existing blob, if there is one
+	with these contents, without anything being uploaded.
+	"""
+	with transaction.atomic():
+		blob = Blob.objects.select_for_update().filter(sha256=sha256, size=size).first()
+		if blob is None or not os.path.isfile(blob.path()):
+			return None
+
+		Blob.objects.filter(pk=sha256).update(refcount=F('refcount') + 1)
+
+	return blob
 
 def user_directory_path(instance, filename):
     # file will be uploaded to MEDIA_ROOT/u_<id>/<fsi_id>
     return 'u_{0}/{1}'.format(instance.owner.id, instance.id)
 
+class Blob(models.Model):
+	"""
+	Content-addressed file, stored once no matter how many FilesystemItems
+	of how many users have the same contents. Blobs that aren't referenced
+	anymore are removed by the collect_blobs command.
+	"""
+	sha256 = models.CharField(primary_key=True, max_length=64)
+	size = models.PositiveBigIntegerField()
+	refcount = models.PositiveIntegerField(default=0, db_index=True)
+	updated_at = models.DateTimeField(auto_now=True)
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	def __str__(self):
+		return self.sha256
+
+	def storage_name(self):
+		return blob_storage_name(self.sha256)
+
+	def path(self):
+		return os.path.join(settings.MEDIA_ROOT, self.storage_name())
+
+class FilesystemItemQuerySet(models.QuerySet):
+	def with_share_state(self):
+		"""
+		Annotates whether each item is shared, so that serializing
+		many items doesn't take a query per item.
+		"""
+		return self.annotate(has_share=Exists(FilesystemSharedItem.objects.active().filter(item=OuterRef('pk'))))
+
+class FilesystemItemManager(models.Manager.from_queryset(FilesystemItemQuerySet)):
+	"""
+	Items that haven't been deleted, deleted ones only wait
+	for process_deletions. FilesystemItem.all_objects has both.
+	"""
+	def get_queryset(self):
+		return super().get_queryset().filter(is_deleted=False)
+
 class FilesystemItem(models.Model):
 	id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
 	owner = models.ForeignKey(User, on_delete=models.CASCADE)
 	parent = models.ForeignKey('FilesystemItem', on_delete=models.CASCADE, null=True, blank=True)
-	name = models.CharField(max_length=1024)
+	# like on most filesystems, and short enough for the listing indexes below
+	name = models.CharField(max_length=255)
+	# for folders this is the total size of their subtree
 	filesize = models.PositiveBigIntegerField(default=0)
 	path = models.CharField(max_length=4096)
+	# sha256 of path, a path is too long to be indexed itself
+	path_hash = models.CharField(max_length=64, null=True, blank=True)
 	is_file = models.BooleanField()
 	uploaded_file = models.FileField(upload_to=user_directory_path, null=True, blank=True)
+	sha256 = models.CharField(max_length=64, null=True, blank=True)
+	# files uploaded before the blob store existed have no blob
+	blob = models.ForeignKey('Blob', on_delete=models.PROTECT, null=True, blank=True, related_name='items')
+	# bumped whenever anything in the listing of this folder changes, see touch_listings
+	listing_version = models.PositiveBigIntegerField(default=0)
+	# bumped whenever anything in the subtree of this folder changes, see touch_listings
+	subtree_version = models.PositiveBigIntegerField(default=0)
+	# see detach_subtree
+	is_deleted = models.BooleanField(default=False)
 	updated_at = models.DateTimeField(auto_now=True)
 	created_at = models.DateTimeField(auto_now_add=True)
 
+	objects = FilesystemItemManager()
+	all_objects = FilesystemItemQuerySet.as_manager()
+
 	def __str__(self):
 		return self.name
 
 	def save(self, *args, **kwargs):
 		self.path = filesystemitem_gen_path(self)
-		super(FilesystemItem, self).save(*args, **kwargs)
+		self.path_hash = hash_path(self.path)
+		adding = self._state.adding
+
+		with transaction.atomic():
+			super(FilesystemItem, self).save(*args, **kwargs)
+			if adding:
+				self.insert_ancestry()
+				self.insert_name_trigrams()
+
+	def insert_ancestry(self):
+		links = [FilesystemItemAncestry(ancestor_id=self.pk, descendant_id=self.pk, depth=0)]
+		if self.parent_id is not None:
+			parent_links = FilesystemItemAncestry.objects.filter(descendant_id=self.parent_id).values_list('ancestor_id', 'depth')
+			for (ancestor_id, depth) in parent_links:
+				links.append(FilesystemItemAncestry(ancestor_id=ancestor_id, descendant_id=self.pk, depth=depth + 1))
+		FilesystemItemAncestry.objects.bulk_create(links)
+
+	def insert_name_trigrams(self):
+		FilesystemItemTrigram.objects.bulk_create([
+			FilesystemItemTrigram(owner_id=self.owner_id, item_id=self.pk, trigram=trigram)
+			for trigram in name_trigrams(self.name)
+		])
+
+	def reindex_name(self):
+		# after a rename, a move changes the path alone which isn't indexed
+		FilesystemItemTrigram.objects.filter(item_id=self.pk).delete()
+		self.insert_name_trigrams()
+
+	def ancestors(self):
+		"""
+		Every folder above this item, starting from the root.
+		"""
+		return FilesystemItem.objects.filter(
+			descendant_links__descendant=self,
+			descendant_links__depth__gt=0
+		).order_by('-descendant_links__depth')
+
+	def descendants(self):
+		return FilesystemItem.objects.filter(ancestor_links__ancestor=self, ancestor_links__depth__gt=0)
+
+	def is_descendant_of(self, item) -> bool:
+		return FilesystemItemAncestry.objects.filter(ancestor=item, descendant=self).exclude(depth=0).exists()
 
 	def size(self):
-		if not self.is_file:
-			totalsize = 0
-			for child in self.filesystemitem_set.all():
-				totalsize += child.size()
-			return totalsize
-		else:
-			return self.filesize
+		return self.filesize
+
+	def listing_etag(self):
+		return f'"{self.id}.{self.listing_version}"'
 
 	def is_shared(self):
-		shared = FilesystemSharedItem.objects.all().filter(item__id=self.id)
-		return shared.count() > 0
+		# fetched along with the item by FilesystemItem.objects.with_share_state()
+		if hasattr(self, 'has_share'):
+			return self.has_share
+
+		return FilesystemSharedItem.objects.active().filter(item__id=self.id).exists()
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=['owner', 'path_hash'], name='unique_filesystemitem_path'),
+		]
+		# one per sort key of listings, see filesystem.pagination
+		indexes = [
+			models.Index(fields=['owner', 'parent', 'is_file', 'name', 'id'], name='filesystemitem_listing_name'),
+			models.Index(fields=['owner', 'parent', 'is_file', 'filesize', 'id'], name='filesystemitem_listing_size'),
+			models.Index(fields=['owner', 'parent', 'is_file', 'created_at', 'id'], name='filesystemitem_listing_created'),
+			models.Index(fields=['owner', 'parent', 'is_file', 'updated_at', 'id'], name='filesystemitem_listing_updated'),
+		]
+
+class FilesystemItemAncestry(models.Model):
+	"""
+	Closure table of the filesystem tree. There is a row for every
+	(ancestor, descendant) pair, including each item with itself at depth 0.
+	"""
+	ancestor = models.ForeignKey('FilesystemItem', on_delete=models.CASCADE, related_name='descendant_links')
+	descendant = models.ForeignKey('FilesystemItem', on_delete=models.CASCADE, related_name='ancestor_links')
+	depth = models.PositiveIntegerField()
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=['ancestor', 'descendant'], name='unique_filesystemitem_ancestry'),
+		]
+		indexes = [
+			models.Index(fields=['descendant', 'depth']),
+		]
+
+class FilesystemItemTrigram(models.Model):
+	"""
+	Search index of the item names, a row for each trigram of a name,
+	see name_trigrams. The owner is repeated here so that a lookup
+	never leaves the rows of one user.
+	"""
+	owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+	item = models.ForeignKey('FilesystemItem', on_delete=models.CASCADE, related_name='name_trigrams')
+	trigram = models.CharField(max_length=3)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['owner', 'trigram', 'item'], name='filesystemitemtrigram_lookup'),
+		]
+
+class DeletionTask(models.Model):
+	"""
+	A deleted subtree, whose rows and files process_deletions removes in
+	batches. Every batch is committed on its own, so a task that was cut
+	short continues where it stopped.
+	"""
+	item = models.OneToOneField('FilesystemItem', on_delete=models.CASCADE, related_name='deletion_task')
+	created_at = models.DateTimeField(auto_now_add=True)
+
+class FilesystemSharedItemQuerySet(models.QuerySet):
+	def active(self):
+		"""
+		Shares that haven't expired. Expired ones are left for
+		purge_expired_shares to delete.
+		"""
+		return self.filter(Q(does_expire=False) | Q(expiry__isnull=True) | Q(expiry__gte=timezone.now()))
+
+	def expired(self):
+		return self.filter(does_expire=True, expiry__lt=timezone.now())
+
+	def with_access_state(self, user):
+		"""
+		Annotates whether each share is open to everyone, and whether user
+		is one of its allowed users or a member of one of its allowed groups,
+		with EXISTS subqueries on the indexed M2M tables instead of loading
+		the allowed users.
+		"""
+		allowed_users = FilesystemSharedItem.allowed_users.through.objects.filter(filesystemshareditem_id=OuterRef('pk'))
+		allowed_groups = FilesystemSharedItem.allowed_groups.through.objects.filter(filesystemshareditem_id=OuterRef('pk'))
+		return self.annotate(
+			is_public=~Exists(allowed_users) & ~Exists(allowed_groups),
+			is_allowed_user=Exists(allowed_users.filter(user_id=user.id)) | Exists(allowed_groups.filter(sharegroup__members=user.id))
+		)
 
 class FilesystemSharedItem(models.Model):
 	id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
 	item = models.ForeignKey('FilesystemItem', on_delete=models.CASCADE, null=False)
 	allowed_users = models.ManyToManyField(User, blank=True)
+	# sharing with a group is a single row, however many members it has
+	allowed_groups = models.ManyToManyField('ShareGroup', blank=True, related_name='shared_items')
 	has_password = models.BooleanField(default=False)
 	password = models.CharField(max_length=100, null=True, blank=True)
 	does_expire = models.BooleanField(default=False)
@@ -63,8 +397,75 @@ class FilesystemSharedItem(models.Model):
 	updated_at = models.DateTimeField(auto_now=True)
 	created_at = models.DateTimeField(auto_now_add=True)
 
+	objects = FilesystemSharedItemQuerySet.as_manager()
+
 	def is_expired(self) -> bool:
 		if not self.does_expire or self.expiry is None:
 			return False
 		return self.expiry < timezone.now()
-		
\ No newline at end of file
+
+	class Meta:
+		indexes = [
+			# for purge_expired_shares
+			models.Index(fields=['does_expire', 'expiry'], name='filesystemshareditem_expiry'),
+		]
+
+
+class ShareGroup(models.Model):
+	"""
+	Named set of users that shares can be opened to as a whole. Only its
+	owner can use it, and changes to its members apply to every share
+	that references it.
+	"""
+	id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+	owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='share_groups')
+	name = models.CharField(max_length=255)
+	members = models.ManyToManyField(User, blank=True, related_name='member_of_share_groups')
+	updated_at = models.DateTimeField(auto_now=True)
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	def __str__(self):
+		return self.name
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=['owner', 'name'], name='unique_sharegroup_name'),
+		]
+
+def upload_session_blob_path(session):
+	# chunks are written straight into MEDIA_ROOT/uploads/<session_id>
+	return os.path.join(settings.MEDIA_ROOT, 'uploads', str(session.id))
+
+class UploadSession(models.Model):
+	"""
+	A file being uploaded in chunks. Chunks can arrive in any order and
+	are written at their offset in a single preallocated blob, which
+	becomes the file of the FilesystemItem created on commit.
+	"""
+	id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+	owner = models.ForeignKey(User, on_delete=models.CASCADE)
+	parent = models.ForeignKey('FilesystemItem', on_delete=models.CASCADE, null=True, blank=True)
+	name = models.CharField(max_length=255)
+	filesize = models.PositiveBigIntegerField()
+	chunk_size = models.PositiveIntegerField()
+	updated_at = models.DateTimeField(auto_now=True)
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	def chunk_count(self) -> int:
+		return (self.filesize + self.chunk_size - 1) // self.chunk_size
+
+	def chunk_length(self, index) -> int:
+		return min(self.chunk_size, self.filesize - index * self.chunk_size)
+
+	def blob_path(self):
+		return upload_session_blob_path(self)
+
+class UploadSessionChunk(models.Model):
+	session = models.ForeignKey('UploadSession', on_delete=models.CASCADE, related_name='chunks')
+	index = models.PositiveIntegerField()
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=['session', 'index'], name='unique_uploadsessionchunk_index'),
+		]
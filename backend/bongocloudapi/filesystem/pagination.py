@@ -0,0 +1,178 @@
+import base64
+import binascii
+import json
+import uuid
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+
+# ordering query parameter -> model field, each one has an index (owner, parent, is_file, field)
+LISTING_ORDERINGS = {
+	'name': 'name',
+	'size': 'filesize',
+	'created_at': 'created_at',
+	'updated_at': 'updated_at',
+}
+
+def get_listing_ordering(request):
+	"""
+	Returns (field, descending) from the ordering query parameter,
+	name, size, created_at or updated_at, prefixed with - for descending.
+	"""
+	ordering = request.query_params.get('ordering', 'name')
+	descending = ordering.startswith('-')
+	field = LISTING_ORDERINGS.get(ordering.lstrip('-'))
+	if field is None:
+		raise ValidationError({ 'ordering': [f'Must be one of {", ".join(LISTING_ORDERINGS)}, optionally prefixed with -.'] })
+	return (field, descending)
+
+def order_listing(queryset, field, descending):
+	# folders always come first, the id makes the order total
+	prefix = '-' if descending else ''
+	return queryset.order_by('is_file', prefix + field, prefix + 'id')
+
+class FilesystemItemCursorPagination(BasePagination):
+	"""
+	Keyset pagination of the children of a folder, in the order of
+	get_listing_ordering. Instead of an offset, the cursor holds the sort
+	key of the last item of the previous page, so every page costs the same
+	index range scan however deep into the folder it is. Folders and files
+	are scanned separately, a page that crosses over takes two queries.
+
+	Listings are only paginated when page_size or cursor is given.
+	"""
+	page_size_query_param = 'page_size'
+	cursor_query_param = 'cursor'
+	page_size = 100
+	max_page_size = 1000
+
+	def paginate_queryset(self, queryset, request, view=None):
+		if self.page_size_query_param not in request.query_params and self.cursor_query_param not in request.query_params:
+			return None
+
+		self.page_size = self.get_page_size(request)
+		(self.field, self.descending) = get_listing_ordering(request)
+
+		(is_file, after) = (False, None)
+		cursor = self.decode_cursor(request)
+		if cursor is not None:
+			(is_file, value, id) = cursor
+			after = (value, id)
+
+		page = self.get_items(queryset, is_file, after, self.page_size + 1)
+		if not is_file and len(page) <= self.page_size:
+			page += self.get_items(queryset, True, None, self.page_size + 1 - len(page))
+
+		self.has_next = len(page) > self.page_size
+		self.page = page[:self.page_size]
+		return self.page
+
+	def get_items(self, queryset, is_file, after, limit):
+		queryset = queryset.filter(is_file=is_file)
+		if after is not None:
+			(value, id) = after
+			direction = 'lt' if self.descending else 'gt'
+			queryset = queryset.filter(
+				Q(**{ f'{self.field}__{direction}': value }) |
+				Q(**{ self.field: value, f'id__{direction}': id })
+			)
+
+		return list(order_listing(queryset, self.field, self.descending)[:limit])
+
+	def get_page_size(self, request):
+		try:
+			page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+		except ValueError:
+			raise ValidationError({ self.page_size_query_param: ['A valid integer is required.'] })
+
+		if page_size < 1:
+			raise ValidationError({ self.page_size_query_param: ['Must be at least 1.'] })
+		return min(page_size, self.max_page_size)
+
+	def get_next_cursor(self):
+		if not self.has_next:
+			return None
+
+		item = self.page[-1]
+		value = getattr(item, self.field)
+		if self.field in ('created_at', 'updated_at'):
+			value = value.isoformat()
+
+		# the ordering is part of the cursor, it can't be used with another one
+		data = json.dumps([self.field, self.descending, item.is_file, value, str(item.id)])
+		return base64.urlsafe_b64encode(data.encode()).decode()
+
+	def decode_cursor(self, request):
+		encoded = request.query_params.get(self.cursor_query_param)
+		if not encoded:
+			return None
+
+		try:
+			(field, descending, is_file, value, id) = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+			id = uuid.UUID(id)
+		except (binascii.Error, AttributeError, TypeError, ValueError):
+			raise NotFound('Invalid cursor.')
+
+		if field != self.field or descending != self.descending:
+			raise NotFound('Invalid cursor.')
+
+		if field in ('created_at', 'updated_at'):
+			value = parse_datetime(value) if isinstance(value, str) else None
+		elif not isinstance(value, int if field == 'filesize' else str):
+			value = None
+
+		if value is None:
+			raise NotFound('Invalid cursor.')
+
+		return (bool(is_file), value, id)
+
+class SearchCursorPagination(FilesystemItemCursorPagination):
+	"""
+	Keyset pagination of search results, in the order of search_items.
+	The cursor holds the rank, name and id of the last result. Search
+	results are always paginated.
+	"""
+	page_size = 50
+
+	def paginate_queryset(self, queryset, request, view=None):
+		self.page_size = self.get_page_size(request)
+
+		cursor = self.decode_cursor(request)
+		if cursor is not None:
+			(rank, name, id) = cursor
+			queryset = queryset.filter(
+				Q(rank__gt=rank) |
+				Q(rank=rank, name__gt=name) |
+				Q(rank=rank, name=name, id__gt=id)
+			)
+
+		page = list(queryset[:self.page_size + 1])
+		self.has_next = len(page) > self.page_size
+		self.page = page[:self.page_size]
+		return self.page
+
+	def get_next_cursor(self):
+		if not self.has_next:
+			return None
+
+		item = self.page[-1]
+		data = json.dumps([item.rank, item.name, str(item.id)])
+		return base64.urlsafe_b64encode(data.encode()).decode()
+
+	def decode_cursor(self, request):
+		encoded = request.query_params.get(self.cursor_query_param)
+		if not encoded:
+			return None
+
+		try:
+			(rank, name, id) = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+			id = uuid.UUID(id)
+		except (binascii.Error, AttributeError, TypeError, ValueError):
+			raise NotFound('Invalid cursor.')
+
+		if not isinstance(rank, int) or not isinstance(name, str):
+			raise NotFound('Invalid cursor.')
+
+		return (rank, name, id)
@@ -1,10 +1,9 @@
-from django.shortcuts import get_object_or_404
 from django.http import Http404
 from rest_framework import permissions
 from rest_framework.request import Request
 
-from .models import FilesystemItem, FilesystemSharedItem
-from authentication.authentication import JWTAuthentication
+from .lookups import get_item_or_404, get_share_group_or_404, get_shared_item_or_404, get_upload_session_or_404
+from .models import FilesystemItem, FilesystemSharedItem, ShareGroup, UploadSession
 
 """
 Only allow user to access if he's the owner of the FilesystemItem.
@@ -13,7 +12,7 @@ class IsOwnerOfItem(permissions.BasePermission):
 	def has_permission(self, request, view):
 		try:
 			if 'pk' in view.kwargs:
-				filesystem_item = get_object_or_404(FilesystemItem, pk=view.kwargs['pk'])
+				filesystem_item = get_item_or_404(request, view.kwargs['pk'])
 				return self.does_user_has_permission(request, filesystem_item)
 			else:
 				return True
@@ -27,16 +26,7 @@ class IsOwnerOfItem(permissions.BasePermission):
 		return self.does_user_has_permission(request, obj)
 	
 	def does_user_has_permission(self, request: Request, fsitem: FilesystemItem) -> bool:
-		user = None
-		try:
-			(user, _) = JWTAuthentication().authenticate(request)
-		except Exception as error:
-			print(error)
-
-		if user is not None:
-			return user == fsitem.owner
-		else:
-			return request.user == fsitem.owner
+		return fsitem.owner_id == request.user.id
 
 class FilesystemItemOwnerPermissionsMixin():
 	permission_classes = [permissions.IsAuthenticated, IsOwnerOfItem]
@@ -49,7 +39,7 @@ class IsOwnerOfSharedItem(permissions.BasePermission):
 	def has_permission(self, request, view):
 		try:
 			if 'pk' in view.kwargs:
-				filesystem_shared_item = get_object_or_404(FilesystemSharedItem, pk=view.kwargs['pk'])
+				filesystem_shared_item = get_shared_item_or_404(request, view.kwargs['pk'])
 				return self.does_user_has_permission(request, filesystem_shared_item)
 		except Http404:
 			return True
@@ -61,21 +51,8 @@ class IsOwnerOfSharedItem(permissions.BasePermission):
 		return self.does_user_has_permission(request, obj)
 
 	def does_user_has_permission(self, request: Request, shared_item: FilesystemSharedItem) -> bool:
-		user = None
-		try:
-			(user, _) = JWTAuthentication().authenticate(request)
-		except Exception as error:
-			print(error)
-
-		if user is None:
-			return False
-
-		# If user is the owner of the item, has permission
-		if shared_item.item.owner == user:
-			return True
-
-		# In every other case, the users doesn't have permissions
-		return False
+		# Only the owner of the item has permission
+		return shared_item.item.owner_id == request.user.id
 
 """
 Only allow user who either is the owner of the item, or
@@ -85,7 +62,7 @@ class IsOwnerOrInAllowedUsersOfSharedItem(permissions.BasePermission):
 	def has_permission(self, request, view):
 		try:
 			if 'pk' in view.kwargs:
-				filesystem_shared_item = get_object_or_404(FilesystemSharedItem, pk=view.kwargs['pk'])
+				filesystem_shared_item = get_shared_item_or_404(request, view.kwargs['pk'])
 				return self.does_user_has_permission(request, filesystem_shared_item)
 		except Http404:
 			return True
@@ -97,35 +74,75 @@ class IsOwnerOrInAllowedUsersOfSharedItem(permissions.BasePermission):
 		return self.does_user_has_permission(request, obj)
 
 	def does_user_has_permission(self, request: Request, shared_item: FilesystemSharedItem) -> bool:
-		user = None
+		# If user is the owner of the item, has permission
+		if shared_item.item.owner_id == request.user.id:
+			return True
+
+		# If the allowed_users and allowed_groups lists are empty, the file is shared across
+		# everyone, otherwise only the users in them, or in their groups, have permission
+		if hasattr(shared_item, 'is_public'):
+			# fetched along with the share by FilesystemSharedItem.objects.with_access_state()
+			return shared_item.is_public or shared_item.is_allowed_user
+
+		(allowed_users, allowed_groups) = (shared_item.allowed_users, shared_item.allowed_groups)
+		if not allowed_users.exists() and not allowed_groups.exists():
+			return True
+		return allowed_users.filter(pk=request.user.id).exists() or allowed_groups.filter(members=request.user.id).exists()
+
+class FilesystemSharedItemOwnerPermissionsMixin():
+	permission_classes = [permissions.IsAuthenticated, IsOwnerOfSharedItem]
+
+class FilesystemSharedItemOwnerOrInAllowedUsersPermissionsMixin():
+	permission_classes = [permissions.IsAuthenticated, IsOwnerOrInAllowedUsersOfSharedItem]
+
+"""
+Only allow the user who started the UploadSession to continue it.
+"""
+class IsOwnerOfUploadSession(permissions.BasePermission):
+	def has_permission(self, request, view):
 		try:
-			(user, _) = JWTAuthentication().authenticate(request)
+			if 'pk' in view.kwargs:
+				upload_session = get_upload_session_or_404(request, view.kwargs['pk'])
+				return self.does_user_has_permission(request, upload_session)
+			else:
+				return True
+		except Http404:
+			return True
 		except Exception as error:
 			print(error)
-
-		print(user)
-
-		if user is None:
 			return False
 
-		# If the allowed_users list is empty, the file is shared across everyone.
-		if shared_item.allowed_users.count() == 0:
-			return True
+	def has_object_permission(self, request, view, obj):
+		return self.does_user_has_permission(request, obj)
 
-		# If user is the owner of the item, has permission
-		if shared_item.item.owner == user:
-			return True
+	def does_user_has_permission(self, request: Request, upload_session: UploadSession) -> bool:
+		return upload_session.owner_id == request.user.id
 
-		# If user is in allowed_users, has permissions
-		for allowed_user in shared_item.allowed_users.all():
-			if user == allowed_user:
+class UploadSessionOwnerPermissionsMixin():
+	permission_classes = [permissions.IsAuthenticated, IsOwnerOfUploadSession]
+
+"""
+Only allow the owner of the ShareGroup to see or change it.
+"""
+class IsOwnerOfShareGroup(permissions.BasePermission):
+	def has_permission(self, request, view):
+		try:
+			if 'pk' in view.kwargs:
+				share_group = get_share_group_or_404(request, view.kwargs['pk'])
+				return self.does_user_has_permission(request, share_group)
+			else:
 				return True
+		except Http404:
+			return True
+		except Exception as error:
+			print(error)
+			return False
 
-		# In every other case, the users doesn't have permissions
-		return False
+	def has_object_permission(self, request, view, obj):
+		return self.does_user_has_permission(request, obj)
 
-class FilesystemSharedItemOwnerPermissionsMixin():
-	permission_classes = [permissions.IsAuthenticated, IsOwnerOfSharedItem]
+	def does_user_has_permission(self, request: Request, share_group: ShareGroup) -> bool:
+		return share_group.owner_id == request.user.id
 
-class FilesystemSharedItemOwnerOrInAllowedUsersPermissionsMixin():
-	permission_classes = [permissions.IsAuthenticated, IsOwnerOrInAllowedUsersOfSharedItem]
\ No newline at end of file
+class ShareGroupOwnerPermissionsMixin():
+	permission_classes = [permissions.IsAuthenticated, IsOwnerOfShareGroup]
\ No newline at end of file
@@ -0,0 +1,60 @@
+import hashlib
+import hmac
+import secrets
+
+from django.core import signing
+
+from .models import Blob
+
+POSSESSION_SALT = 'filesystem.possession'
+POSSESSION_RANGE_COUNT = 4
+POSSESSION_RANGE_LENGTH = 64 * 1024
+POSSESSION_CHALLENGE_MAX_AGE = 10 * 60
+
+def create_possession_challenge(user, sha256, size) -> dict:
+	"""
+	Random byte ranges of the file with this sha256 and size, which a client
+	only knows the contents of if it has the file. The challenge is the same
+	whether or not anyone stores the file, it's signed instead of saved.
+	"""
+	ranges = []
+	if size > 0:
+		length = min(POSSESSION_RANGE_LENGTH, size)
+		ranges = sorted([secrets.randbelow(size - length + 1), length] for _ in range(POSSESSION_RANGE_COUNT))
+
+	challenge = signing.dumps({ 'user': str(user.pk), 'sha256': sha256, 'size': size, 'ranges': ranges }, salt=POSSESSION_SALT)
+	return { 'challenge': challenge, 'ranges': ranges }
+
+def hash_ranges(file, ranges) -> str:
+	# the sha256 of the ranges one after the other, what the client sends as proof
+	digest = hashlib.sha256()
+	for (offset, length) in ranges:
+		file.seek(offset)
+		digest.update(file.read(length))
+	return digest.hexdigest()
+
+def verify_possession(user, sha256, size, challenge, proof) -> bool:
+	"""
+	Whether proof is the hash of the ranges of challenge in the blob with
+	sha256 and size, for a challenge given to user for this very blob and
+	not expired yet. False as well when there is no such blob.
+	"""
+	try:
+		data = signing.loads(challenge, salt=POSSESSION_SALT, max_age=POSSESSION_CHALLENGE_MAX_AGE)
+	except signing.BadSignature:
+		return False
+
+	if data['user'] != str(user.pk) or data['sha256'] != sha256 or data['size'] != size:
+		return False
+
+	blob = Blob.objects.filter(sha256=sha256, size=size).first()
+	if blob is None:
+		return False
+
+	try:
+		with open(blob.path(), 'rb') as file:
+			expected = hash_ranges(file, data['ranges'])
+	except FileNotFoundError:
+		return False
+
+	return hmac.compare_digest(expected, proof)
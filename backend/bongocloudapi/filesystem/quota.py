@@ -0,0 +1,110 @@
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.db.models import Case, F, OuterRef, PositiveBigIntegerField, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import FilesystemItem, UploadSession
+
+User = get_user_model()
+
+class StorageQuotaExceeded(APIException):
+	status_code = status.HTTP_507_INSUFFICIENT_STORAGE
+	default_detail = 'There is not enough storage left for this file.'
+	default_code = 'storage_quota_exceeded'
+
+def get_declared_size(request) -> int:
+	# of the whole body, a bit more than the file itself for multipart uploads
+	try:
+		return max(int(request.META.get('CONTENT_LENGTH') or 0), 0)
+	except ValueError:
+		return 0
+
+def check_storage_quota(user, size):
+	"""
+	Raises StorageQuotaExceeded if size bytes don't fit in what's left of
+	the quota of user, before any of them are received. charge_storage
+	makes sure of it again once they have been.
+	"""
+	# the quota comes along with the cached user, the usage may have changed since
+	if user.storage_quota is None:
+		return
+
+	storage_used = User.objects.filter(pk=user.pk).values_list('storage_used', flat=True).get()
+	if storage_used + size > user.storage_quota:
+		raise StorageQuotaExceeded()
+
+def charge_storage(user_id, size):
+	"""
+	Adds size to the storage used by the user, or raises StorageQuotaExceeded
+	if it doesn't fit in the quota. The check is part of the UPDATE, so two
+	uploads can't both take the last of the space. Callers are expected to
+	run this inside the transaction that creates the item.
+	"""
+	if size == 0:
+		return
+
+	updated = (
+		User.objects
+			.filter(Q(storage_quota__isnull=True) | Q(storage_quota__gte=F('storage_used') + size), pk=user_id)
+			.update(storage_used=F('storage_used') + size)
+	)
+	if not updated:
+		raise StorageQuotaExceeded()
+
+def release_storage(user_id, size):
+	if size == 0:
+		return
+
+	# never below 0, the column is unsigned on MySQL
+	User.objects.filter(pk=user_id).update(storage_used=Case(
+		When(storage_used__gte=size, then=F('storage_used') - size),
+		default=Value(0)
+	))
+
+def delete_upload_sessions(sessions):
+	"""
+	Deletes the upload sessions of the queryset sessions, which haven't
+	been committed, and gives back the storage they reserved when they
+	were created. A commit takes over the reservation instead. Callers are
+	expected to run this inside a transaction.
+	"""
+	# locked, a session being committed meanwhile is gone once the lock is released
+	locked = list(sessions.select_for_update().values_list('pk', 'owner_id', 'filesize'))
+
+	reserved = Counter()
+	for (_, owner_id, filesize) in locked:
+		reserved[owner_id] += filesize
+	for (owner_id, total) in reserved.items():
+		release_storage(owner_id, total)
+
+	sessions.model.objects.filter(pk__in=[pk for (pk, _, _) in locked]).delete()
+
+def actual_storage_used():
+	"""
+	What the storage used by each user of a User queryset should be, from
+	the sizes of the items at the root of their tree, which include their
+	subtrees, and of their open upload sessions, which are reserved.
+	"""
+	root_total = (
+		FilesystemItem.objects
+			.filter(owner=OuterRef('pk'), parent=None)
+			.order_by()
+			.values('owner')
+			.annotate(total=Sum('filesize'))
+			.values('total')
+	)
+	session_total = (
+		UploadSession.objects
+			.filter(owner=OuterRef('pk'))
+			.order_by()
+			.values('owner')
+			.annotate(total=Sum('filesize'))
+			.values('total')
+	)
+	return (
+		Coalesce(Subquery(root_total), Value(0), output_field=PositiveBigIntegerField()) +
+		Coalesce(Subquery(session_total), Value(0), output_field=PositiveBigIntegerField())
+	)
@@ -0,0 +1,73 @@
+from django.db.models import Case, Count, IntegerField, Value, When
+from rest_framework.exceptions import ValidationError
+
+from .models import FilesystemItem, FilesystemItemTrigram, name_trigrams
+
+SEARCH_MATCHES = ('substring', 'prefix')
+
+def get_search_terms(request):
+	"""
+	Returns (query, match, extension) from the q, match and ext query
+	parameters. Either q or ext has to be long enough to give a trigram,
+	the search never scans all the items of the user.
+	"""
+	query = request.query_params.get('q', '').strip()
+	match = request.query_params.get('match', 'substring')
+	extension = request.query_params.get('ext', '').strip().lstrip('.')
+
+	if match not in SEARCH_MATCHES:
+		raise ValidationError({ 'match': [f'Must be one of {", ".join(SEARCH_MATCHES)}.'] })
+	if '/' in query:
+		raise ValidationError({ 'q': ['Names can\'t contain "/".'] })
+	if '/' in extension:
+		raise ValidationError({ 'ext': ['Names can\'t contain "/".'] })
+	if not search_trigrams(query, match, extension):
+		raise ValidationError({ 'q': ['Give at least 3 characters, 2 for a prefix, or an extension.'] })
+
+	return (query, match, extension)
+
+def search_trigrams(query, match, extension):
+	# the trigrams that every name found has, name_trigrams puts the slashes around names
+	trigrams = set()
+	if query:
+		pattern = f'/{query.lower()}' if match == 'prefix' else query.lower()
+		trigrams |= { pattern[i:i + 3] for i in range(len(pattern) - 2) }
+	if extension:
+		pattern = f'.{extension.lower()}/'
+		trigrams |= { pattern[i:i + 3] for i in range(len(pattern) - 2) }
+	return trigrams
+
+def search_items(user, query, match, extension):
+	"""
+	The items of user whose name matches, ranked exact names first, then
+	names starting with query, then the others, each by name. The trigram
+	index narrows them down to the items having every trigram of the
+	search, which the LIKE filters then check row by row.
+	"""
+	trigrams = search_trigrams(query, match, extension)
+	candidates = (
+		FilesystemItemTrigram.objects
+			.filter(owner=user, trigram__in=trigrams)
+			.values('item_id')
+			.annotate(matched=Count('id'))
+			# >= as a case insensitive collation can match more than one trigram of a name
+			.filter(matched__gte=len(trigrams))
+			.values('item_id')
+	)
+
+	items = FilesystemItem.objects.with_share_state().filter(owner=user, pk__in=candidates)
+	if query:
+		items = items.filter(name__istartswith=query) if match == 'prefix' else items.filter(name__icontains=query)
+	if extension:
+		items = items.filter(name__iendswith=f'.{extension}')
+
+	if query:
+		rank = Case(
+			When(name__iexact=query, then=Value(0)),
+			When(name__istartswith=query, then=Value(1)),
+			default=Value(2),
+			output_field=IntegerField()
+		)
+	else:
+		rank = Value(0, output_field=IntegerField())
+	return items.annotate(rank=rank).order_by('rank', 'name', 'id')
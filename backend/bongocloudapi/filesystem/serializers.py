@@ -1,16 +1,90 @@
 from rest_framework import serializers
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
 from django.utils import timezone
 
 from authentication.serializers import PublicUserSerializer
 from .models import (
 	FilesystemItem,
 	FilesystemSharedItem,
-	filesystemitem_gen_path,
+	ShareGroup,
+	UploadSession,
+	move_subtree_ancestry,
+	propagate_size_change,
+	rewrite_subtree_paths,
+	touch_listings,
 )
 
+User = get_user_model()
+
+# how many paths can be resolved in one request
+RESOLVE_MAX_PATHS = 100
+
+def quote_names(names):
+	return ', '.join(f'"{name}"' for name in sorted(names, key=str))
+
+class UsernamesField(serializers.ListField):
+	"""
+	Users, given and shown by their usernames. They are looked up with a
+	single query, and every username that doesn't exist is reported at
+	once. The user making the request is left out.
+	"""
+	child = serializers.CharField()
+
+	def to_internal_value(self, data):
+		usernames = set(super().to_internal_value(data))
+		usernames.discard(self.context['request'].user.username)
+
+		users = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+		missing = usernames - users.keys()
+		if missing:
+			raise serializers.ValidationError(f'Users not found: {quote_names(missing)}.')
+		return list(users.values())
+
+	def to_representation(self, value):
+		return [user.username for user in value.all()]
+
+class ShareGroupsField(serializers.ListField):
+	"""
+	ShareGroups of the user making the request, given by their ids,
+	looked up with a single query.
+	"""
+	child = serializers.UUIDField()
+
+	def to_internal_value(self, data):
+		ids = set(super().to_internal_value(data))
+
+		found = set(ShareGroup.objects.filter(owner=self.context['request'].user, pk__in=ids).values_list('pk', flat=True))
+		missing = ids - found
+		if missing:
+			raise serializers.ValidationError(f'Groups not found: {quote_names(missing)}.')
+		return list(found)
+
+	def to_representation(self, value):
+		return [{ 'id': str(group.id), 'name': group.name } for group in value.all()]
+
+class CachedHyperlinkedIdentityField(serializers.HyperlinkedIdentityField):
+	"""
+	Reverses the URL only once per serialization, with a placeholder
+	pk, and fills in the pk of every object after that.
+	"""
+	placeholder_pk = '00000000-0000-0000-0000-000000000000'
+
+	def get_url(self, obj, view_name, request, format):
+		if obj.pk is None:
+			return None
+
+		# the context is shared by every item of a list
+		templates = self.context.setdefault('url_templates', {})
+		if (view_name, format) not in templates:
+			kwargs = { self.lookup_url_kwarg: self.placeholder_pk }
+			templates[(view_name, format)] = self.reverse(view_name, kwargs=kwargs, request=request, format=format)
+
+		return templates[(view_name, format)].replace(self.placeholder_pk, str(obj.pk))
 
 class FilesystemItemSerializer(serializers.ModelSerializer):
-	download_url = serializers.HyperlinkedIdentityField(view_name='filesystem_item-download', lookup_field='pk')
+	download_url = CachedHyperlinkedIdentityField(view_name='filesystem_item-download', lookup_field='pk')
 
 	class Meta:
 		model = FilesystemItem
@@ -37,7 +111,12 @@ class PublicFilesystemItemSerializer(serializers.ModelSerializer):
 
 class CreateFilesystemItemSerializer(serializers.ModelSerializer):
 	is_file = serializers.BooleanField(read_only=True)
-	filesize = serializers.IntegerField(read_only=True)
+	# sha256 and filesize can be sent instead of uploaded_file, when we may already have the file
+	filesize = serializers.IntegerField(required=False, min_value=0)
+	sha256 = serializers.RegexField(r'^[0-9a-f]{64}$', required=False)
+	# answer to the challenge of a first request with only sha256 and filesize, see filesystem.possession
+	challenge = serializers.CharField(required=False, write_only=True)
+	proof = serializers.RegexField(r'^[0-9a-f]{64}$', required=False, write_only=True)
 
 	class Meta:
 		model = FilesystemItem
@@ -46,14 +125,30 @@ class CreateFilesystemItemSerializer(serializers.ModelSerializer):
 			'name',
 			'is_file',
 			'filesize',
+			'sha256',
 			'uploaded_file',
+			'challenge',
+			'proof',
 		]
 
+	def create(self, validated_data):
+		validated_data.pop('challenge', None)
+		validated_data.pop('proof', None)
+		return super().create(validated_data)
+
+	def validate(self, data):
+		if data.get('uploaded_file') is None and 'sha256' in data and 'filesize' not in data:
+			raise serializers.ValidationError({ 'filesize': ['This field is required along with sha256.'] })
+		return data
+
 	def validate_name(self, value):
 		request = self.context.get('request')
 		user = request.user
 
 		name = value
+		if '/' in name:
+			raise serializers.ValidationError('Names can\'t contain "/".')
+
 		parent = self.initial_data['parent']
 		if parent == '':
 			parent = None
@@ -68,6 +163,13 @@ class CreateFilesystemItemSerializer(serializers.ModelSerializer):
 			raise serializers.ValidationError(f'{value.name} is not a folder.')
 		return value
 
+class ResolveFilesystemItemPathsSerializer(serializers.Serializer):
+	paths = serializers.ListField(
+		child=serializers.CharField(max_length=4096, trim_whitespace=False),
+		allow_empty=False,
+		max_length=RESOLVE_MAX_PATHS
+	)
+
 class MoveFilesystemItemSerializer(serializers.ModelSerializer):
 	path = serializers.CharField(read_only=True)
 
@@ -80,34 +182,62 @@ class MoveFilesystemItemSerializer(serializers.ModelSerializer):
 			'path',
 		]
 
-	"""
-	This function iterates recursively in the item's children and 
-	regenerates the path because a parent was renamed or moved.
-	"""
-	def iterate_children(self, item):
-		children = item.filesystemitem_set.all()
-		for child in children:
-			child.path = filesystemitem_gen_path(child)
-			child.save()
-			if not child.is_file:
-				self.iterate_children(child)
+	def update(self, instance, validated_data):
+		for attr, value in validated_data.items():
+			setattr(instance, attr, value)
+
+		# don't write back filesize, it may have changed since the item was fetched
+		instance.save(update_fields=['parent', 'name', 'path', 'path_hash', 'updated_at'])
+		return instance
 
 	def save(self, **kwargs):
-		super().save(**kwargs)
-		item = self.instance
-		self.iterate_children(item)
+		old_parent_id = self.instance.parent_id
+		old_path = self.instance.path
+		old_name = self.instance.name
+
+		try:
+			with transaction.atomic():
+				super().save(**kwargs)
+				item = self.instance
+
+				if item.parent_id != old_parent_id:
+					move_subtree_ancestry(item)
+					size = FilesystemItem.objects.filter(pk=item.pk).values_list('filesize', flat=True).get()
+					propagate_size_change(old_parent_id, -size)
+					propagate_size_change(item.parent_id, size)
+
+				if item.name != old_name:
+					item.reindex_name()
+
+				rewrite_subtree_paths(item, old_path)
+				touch_listings(item.owner_id, [old_parent_id, item.parent_id, item.id, None])
+		except IntegrityError:
+			# an item of the same name created in the folder meanwhile
+			raise serializers.ValidationError({ 'name': [f'"{self.instance.name}" already exists at this location.'] })
+
 		return item
 
 	def validate_name(self, value):
-		request = self.context.get('request')
-		user = request.user
-
 		name = value
-		parent = self.initial_data['parent']
-		if FilesystemItem.objects.all().filter(owner=user, parent=parent, name__exact=name).exists():
-			raise serializers.ValidationError(f'"{name}" already exists at this location.')
+		if '/' in name:
+			raise serializers.ValidationError('Names can\'t contain "/".')
 		return value
 
+	def validate(self, attrs):
+		# the name has to be free in the folder the item ends up in, whichever of the two changes
+		instance = self.instance
+		if 'parent' in attrs:
+			parent_id = attrs['parent'].pk if attrs['parent'] is not None else None
+		else:
+			parent_id = instance.parent_id
+		name = attrs.get('name', instance.name)
+
+		if (parent_id, name) != (instance.parent_id, instance.name):
+			siblings = FilesystemItem.objects.all().filter(owner=instance.owner_id, parent=parent_id, name__exact=name)
+			if siblings.exclude(pk=instance.pk).exists():
+				raise serializers.ValidationError({ 'name': [f'"{name}" already exists at this location.'] })
+		return attrs
+
 	def validate_parent(self, value):
 		if value is None:
 			return value
@@ -125,18 +255,16 @@ class MoveFilesystemItemSerializer(serializers.ModelSerializer):
 		if value is not None and value.is_file:
 			raise serializers.ValidationError(f'"{value.name}" is not a folder.')
 		
-		super_parent = value.parent
-		while super_parent is not None:
-			if super_parent == instance:
-				raise serializers.ValidationError(f'"{value.name}" is a subfolder of "{instance.name}".')
-			super_parent = super_parent.parent
+		if value.is_descendant_of(instance):
+			raise serializers.ValidationError(f'"{value.name}" is a subfolder of "{instance.name}".')
 
 		return value
 
 class FilesystemSharedItemSerializer(serializers.ModelSerializer):
 	item = FilesystemItemSerializer()
-	allowed_users = serializers.SerializerMethodField()
-	download_url = serializers.HyperlinkedIdentityField(view_name='filesystem_shared_item-download', lookup_field='pk')
+	allowed_users = UsernamesField()
+	allowed_groups = ShareGroupsField()
+	download_url = CachedHyperlinkedIdentityField(view_name='filesystem_shared_item-download', lookup_field='pk')
 
 	class Meta:
 		model = FilesystemSharedItem
@@ -144,6 +272,7 @@ class FilesystemSharedItemSerializer(serializers.ModelSerializer):
 			'id',
 			'item',
 			'allowed_users',
+			'allowed_groups',
 			'has_password',
 			'does_expire',
 			'expiry',
@@ -151,17 +280,10 @@ class FilesystemSharedItemSerializer(serializers.ModelSerializer):
 			'download_url'
 		]
 
-	def get_allowed_users(self, obj):
-		allowed_user_names = []
-		allowed_users = obj.allowed_users.all()
-		for allowed_user in allowed_users:
-			allowed_user_names.append(allowed_user.username)
-		return allowed_user_names
-
 class PublicFilesystemSharedItemSerializer(serializers.ModelSerializer):
 	item = PublicFilesystemItemSerializer()
 	sharer = PublicUserSerializer(source='item.owner')
-	download_url = serializers.HyperlinkedIdentityField(view_name='filesystem_shared_item-download', lookup_field='pk')
+	download_url = CachedHyperlinkedIdentityField(view_name='filesystem_shared_item-download', lookup_field='pk')
 
 	class Meta:
 		model = FilesystemSharedItem
@@ -182,6 +304,8 @@ def validate_expiry(value):
 
 class CreateFilesystemSharedItemSerializer(serializers.ModelSerializer):
 	item = FilesystemItemSerializer(read_only=True)
+	allowed_users = UsernamesField(required=False)
+	allowed_groups = ShareGroupsField(required=False)
 	has_password = serializers.BooleanField(default=False, read_only=True)
 	does_expire = serializers.BooleanField(default=False, read_only=True)
 
@@ -191,6 +315,7 @@ class CreateFilesystemSharedItemSerializer(serializers.ModelSerializer):
 			'id',
 			'item',
 			'allowed_users',
+			'allowed_groups',
 			'has_password',
 			'password',
 			'does_expire',
@@ -206,6 +331,8 @@ class CreateFilesystemSharedItemSerializer(serializers.ModelSerializer):
 		return validate_expiry(value)
 
 class UpdateFilesystemSharedItemSerializer(serializers.ModelSerializer):
+	allowed_users = UsernamesField(required=False)
+	allowed_groups = ShareGroupsField(required=False)
 	has_password = serializers.BooleanField(default=False, read_only=True)
 	does_expire = serializers.BooleanField(default=False, read_only=True)
 
@@ -214,6 +341,7 @@ class UpdateFilesystemSharedItemSerializer(serializers.ModelSerializer):
 		fields = [
 			'id',
 			'allowed_users',
+			'allowed_groups',
 			'has_password',
 			'password',
 			'does_expire',
@@ -223,5 +351,88 @@ class UpdateFilesystemSharedItemSerializer(serializers.ModelSerializer):
 	def validate_expiry(self, value):
 		return validate_expiry(value)
 
+class ShareGroupSerializer(serializers.ModelSerializer):
+	members = UsernamesField(required=False)
+
+	class Meta:
+		model = ShareGroup
+		fields = [
+			'id',
+			'name',
+			'members',
+			'created_at',
+		]
+
+	def validate_name(self, value):
+		user = self.context['request'].user
+
+		groups = ShareGroup.objects.filter(owner=user, name__exact=value)
+		if self.instance is not None:
+			groups = groups.exclude(pk=self.instance.pk)
+
+		if groups.exists():
+			raise serializers.ValidationError(f'You already have a group named "{value}".')
+		return value
+
 class DownloadFilesystemSharedItemSerializer(serializers.Serializer):
-	password = serializers.CharField(required=False)
\ No newline at end of file
+	password = serializers.CharField(required=False)
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+	chunk_count = serializers.IntegerField(read_only=True)
+	received_chunks = serializers.SerializerMethodField()
+
+	class Meta:
+		model = UploadSession
+		fields = [
+			'id',
+			'parent',
+			'name',
+			'filesize',
+			'chunk_size',
+			'chunk_count',
+			'received_chunks',
+			'created_at',
+		]
+
+	def get_received_chunks(self, obj):
+		return list(obj.chunks.order_by('index').values_list('index', flat=True))
+
+class CreateUploadSessionSerializer(serializers.ModelSerializer):
+	filesize = serializers.IntegerField(min_value=0, max_value=settings.UPLOAD_MAX_FILESIZE)
+	chunk_size = serializers.IntegerField(
+		required=False,
+		min_value=settings.UPLOAD_MIN_CHUNK_SIZE,
+		max_value=settings.UPLOAD_MAX_CHUNK_SIZE
+	)
+
+	class Meta:
+		model = UploadSession
+		fields = [
+			'id',
+			'parent',
+			'name',
+			'filesize',
+			'chunk_size',
+		]
+
+	def validate_name(self, value):
+		request = self.context.get('request')
+		user = request.user
+
+		name = value
+		if '/' in name:
+			raise serializers.ValidationError('Names can\'t contain "/".')
+
+		parent = self.initial_data.get('parent')
+		if parent == '':
+			parent = None
+
+		if FilesystemItem.objects.all().filter(owner=user, parent=parent, name__exact=name).exists():
+			raise serializers.ValidationError(f'"{name}" already exists at this location.')
+
+		return value
+
+	def validate_parent(self, value):
+		if value is not None and value.is_file:
+			raise serializers.ValidationError(f'{value.name} is not a folder.')
+		return value
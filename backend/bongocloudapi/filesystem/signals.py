@@ -1,12 +1,50 @@
 import os
 
-from django.db.models.signals import post_delete
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
 
-from .models import FilesystemItem
+from .models import Blob, FilesystemItem, FilesystemSharedItem, UploadSession, touch_listings
 
 @receiver(post_delete, sender=FilesystemItem)
 def on_delete_filesystem_item(sender, instance, *args, **kwargs):
-	if instance.uploaded_file:
-		if os.path.isfile(instance.uploaded_file.path):
-			os.remove(instance.uploaded_file.path)
\ No newline at end of file
+	if instance.blob_id is not None:
+		# the blob itself is removed by collect_blobs, once nothing references it. Its
+		# grace period runs from the last reference dropped, .update() skips auto_now
+		Blob.objects.filter(pk=instance.blob_id).update(refcount=F('refcount') - 1, updated_at=timezone.now())
+	elif instance.uploaded_file:
+		file_path = instance.uploaded_file.path
+
+		# a rolled back delete keeps its file
+		def remove_file():
+			if os.path.isfile(file_path):
+				os.remove(file_path)
+
+		transaction.on_commit(remove_file)
+
+@receiver(post_delete, sender=UploadSession)
+def on_delete_upload_session(sender, instance, *args, **kwargs):
+	blob_path = instance.blob_path()
+
+	# wait for the commit, a committed session's blob has already been moved away
+	def remove_blob():
+		if os.path.isfile(blob_path):
+			os.remove(blob_path)
+
+	transaction.on_commit(remove_blob)
+def touch_shared_item_listings(shared_item):
+	# is_shared shows up in the listing of the item's folder, and in its own
+	item = FilesystemItem.objects.filter(pk=shared_item.item_id).values('owner_id', 'parent_id').first()
+	if item is not None:
+		touch_listings(item['owner_id'], [item['parent_id'], shared_item.item_id])
+
+@receiver(post_save, sender=FilesystemSharedItem)
+def on_save_filesystem_shared_item(sender, instance, created, *args, **kwargs):
+	if created:
+		touch_shared_item_listings(instance)
+
+@receiver(post_delete, sender=FilesystemSharedItem)
+def on_delete_filesystem_shared_item(sender, instance, *args, **kwargs):
+	touch_shared_item_listings(instance)
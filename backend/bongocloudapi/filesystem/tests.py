@@ -1,3 +1,1465 @@
-from django.test import TestCase
+import asyncio
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+import zipfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+from urllib import parse
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, connection
+from django.http import FileResponse, StreamingHttpResponse
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from authentication.cache import user_cache
+from authentication.models import User
+from authentication.utils import generate_tokens_for_user
+from bongocloudapi.handlers import StreamingASGIHandler, current_receive
+from .archive import ArchiveCache, archive_key, stream_folder_archive
+from .downloads import get_download_delivery, iter_file_ranges, parse_range_header
+from .possession import hash_ranges
+from .serializers import CreateFilesystemItemSerializer, MoveFilesystemItemSerializer
+from .uploadhandlers import StreamingStorageUploadHandler
+from .models import (
+	Blob,
+	DeletionTask,
+	FilesystemItem,
+	FilesystemItemAncestry,
+	FilesystemSharedItem,
+	UploadSession,
+	detach_subtree,
+	hash_path,
+	move_subtree_ancestry,
+	propagate_size_change,
+	rewrite_subtree_paths
+)
+
+
+class ListingQueryCountTests(TestCase):
+	"""
+	Listing a folder, or fetching a single item, takes the same number
+	of queries however many items there are.
+	"""
+	def setUp(self):
+		# the user is fetched too, it isn't cached yet
+		user_cache.clear()
+
+		self.user = User.objects.create_user(email='owner@bongo.local', password='password', username='owner')
+		(access_token, _) = generate_tokens_for_user(self.user)
+		self.client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+
+		self.folder = FilesystemItem(owner=self.user, name='folder', is_file=False)
+		self.folder.save()
+
+	def create_children(self, count):
+		children = []
+		for i in range(count):
+			path = f'{self.folder.path}/file-{i}'
+			children.append(FilesystemItem(
+				owner=self.user,
+				parent=self.folder,
+				name=f'file-{i}',
+				path=path,
+				path_hash=hash_path(path),
+				is_file=True
+			))
+
+		FilesystemItem.objects.bulk_create(children, batch_size=1000)
+		# every other one is shared
+		FilesystemSharedItem.objects.bulk_create([FilesystemSharedItem(item=child) for child in children[::2]], batch_size=1000)
+
+	def assert_listing_queries(self, count, queries):
+		self.create_children(count)
+
+		with self.assertNumQueries(queries):
+			response = self.client.get(f'/filesystem/{self.folder.id}/')
+
+		self.assertEqual(response.status_code, 200)
+		items = response.json()['items']
+		self.assertEqual(len(items), count)
+		self.assertEqual(sum(item['is_shared'] for item in items), (count + 1) // 2)
+
+	def test_listing_1_item(self):
+		self.assert_listing_queries(1, 3)
+
+	def test_listing_100_items(self):
+		self.assert_listing_queries(100, 3)
+
+	def test_listing_10000_items(self):
+		self.assert_listing_queries(10000, 3)
+
+	def test_paginated_listing(self):
+		self.create_children(250)
+
+		# one for the folders of the page and one for its files
+		with self.assertNumQueries(4):
+			response = self.client.get(f'/filesystem/{self.folder.id}/?page_size=100')
+
+		self.assertEqual(len(response.json()['items']), 100)
+
+	def test_info(self):
+		self.create_children(1)
+		item = FilesystemItem.objects.get(parent=self.folder)
+
+		with self.assertNumQueries(2):
+			response = self.client.get(f'/filesystem/{item.id}/info/')
+
+		self.assertTrue(response.json()['is_shared'])
+
+	def test_path(self):
+		self.create_children(1)
+
+		with self.assertNumQueries(2):
+			response = self.client.get('/filesystem/path/%252Ffolder%252Ffile-0/')
+
+		self.assertTrue(response.json()['item']['is_shared'])
+
+
+class ListingPaginationTests(TestCase):
+	"""
+	Paging through a folder gives every child once, folders first, in the
+	order asked for, ties broken the same way on every page.
+	"""
+	def setUp(self):
+		self.user = User.objects.create_user(email='owner@bongo.local', password='password', username='owner')
+		(access_token, _) = generate_tokens_for_user(self.user)
+		self.client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+
+		self.folder = FilesystemItem(owner=self.user, name='folder', is_file=False)
+		self.folder.save()
+		for name in ('b', 'a'):
+			FilesystemItem(owner=self.user, parent=self.folder, name=name, is_file=False).save()
+		for (name, filesize) in (('one', 5), ('two', 3), ('three', 3), ('four', 0), ('five', 7)):
+			FilesystemItem(owner=self.user, parent=self.folder, name=name, is_file=True, filesize=filesize).save()
+
+	def names(self, **params):
+		response = self.client.get(f'/filesystem/{self.folder.id}/', params)
+		self.assertEqual(response.status_code, 200)
+		return [item['name'] for item in response.json()['items']]
+
+	def pages(self, **params):
+		(names, params) = ([], { **params, 'page_size': 2 })
+		while True:
+			response = self.client.get(f'/filesystem/{self.folder.id}/', params).json()
+			names += [item['name'] for item in response['items']]
+			if response['next_cursor'] is None:
+				return names
+			params['cursor'] = response['next_cursor']
+
+	def test_orderings(self):
+		self.assertEqual(self.names(), ['a', 'b', 'five', 'four', 'one', 'three', 'two'])
+
+		# the ties are ordered by id
+		names = self.names(ordering='-size')
+		self.assertCountEqual(names[:2], ['a', 'b'])
+		self.assertEqual(names[2:4], ['five', 'one'])
+		self.assertCountEqual(names[4:6], ['two', 'three'])
+		self.assertEqual(names[6:], ['four'])
+
+	def test_pages(self):
+		for ordering in ('name', '-name', 'size', '-size', 'created_at', '-updated_at'):
+			with self.subTest(ordering=ordering):
+				self.assertEqual(self.pages(ordering=ordering), self.names(ordering=ordering))
+
+	def test_invalid(self):
+		self.assertEqual(self.client.get(f'/filesystem/{self.folder.id}/', { 'ordering': 'owner' }).status_code, 400)
+		self.assertEqual(self.client.get(f'/filesystem/{self.folder.id}/', { 'page_size': 2, 'cursor': 'garbage' }).status_code, 404)
+
+
+class TreeTests(TestCase):
+	"""
+	The closure table, paths and folder sizes follow the tree as items
+	are created and moved, each change with a fixed number of statements.
+	"""
+	def setUp(self):
+		self.user = User.objects.create_user(email='owner@bongo.local', password='password', username='owner')
+
+		self.a = self.create('a', None)
+		self.b = self.create('b', self.a)
+		self.c = self.create('c', self.b)
+		self.file = self.create('file.txt', self.c, is_file=True)
+		self.other = self.create('other', None)
+
+	def create(self, name, parent, is_file=False):
+		item = FilesystemItem(owner=self.user, parent=parent, name=name, is_file=is_file)
+		item.save()
+		return item
+
+	def links(self, item):
+		return dict(FilesystemItemAncestry.objects.filter(descendant=item).values_list('ancestor__name', 'depth'))
+
+	def test_subtree_updates_are_single_statements(self):
+		# like on MySQL, where updating through a join makes Django select the ids first
+		with mock.patch.object(connection.features, 'update_can_self_select', False):
+			old_path = self.b.path
+			self.b.name = 'renamed'
+			self.b.save(update_fields=['name', 'path', 'path_hash', 'updated_at'])
+
+			with self.assertNumQueries(1):
+				self.assertEqual(rewrite_subtree_paths(self.b, old_path), 2)
+			with self.assertNumQueries(1):
+				propagate_size_change(self.c.id, 10)
+
+		self.assertEqual(FilesystemItem.objects.get(pk=self.file.pk).path, '/a/renamed/c/file.txt')
+		self.assertEqual(FilesystemItem.objects.get(pk=self.a.pk).filesize, 10)
+
+	def test_created_items_are_linked_to_every_ancestor(self):
+		self.assertEqual(self.links(self.file), { 'file.txt': 0, 'c': 1, 'b': 2, 'a': 3 })
+		self.assertEqual(self.links(self.other), { 'other': 0 })
+
+	def test_move_subtree_ancestry(self):
+		self.b.parent = self.other
+		self.b.save(update_fields=['parent'])
+		move_subtree_ancestry(self.b)
+
+		self.assertEqual(self.links(self.file), { 'file.txt': 0, 'c': 1, 'b': 2, 'other': 3 })
+		self.assertEqual(self.links(self.b), { 'b': 0, 'other': 1 })
+		self.assertEqual(FilesystemItemAncestry.objects.filter(ancestor=self.a).count(), 1)
+
+		# to the root, the subtree keeps only its own links
+		self.b.parent = None
+		self.b.save(update_fields=['parent'])
+		move_subtree_ancestry(self.b)
+
+		self.assertEqual(self.links(self.file), { 'file.txt': 0, 'c': 1, 'b': 2 })
+		self.assertEqual(FilesystemItemAncestry.objects.filter(ancestor=self.other).count(), 1)
+
+	def test_move(self):
+		(access_token, _) = generate_tokens_for_user(self.user)
+		client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+
+		FilesystemItem.objects.filter(pk=self.file.pk).update(filesize=10)
+		propagate_size_change(self.c.id, 10)
+
+		response = client.put(f'/filesystem/{self.b.id}/move/', { 'parent': self.other.id, 'name': 'moved' }, format='json')
+		self.assertEqual(response.status_code, 200)
+
+		self.assertEqual(FilesystemItem.objects.get(pk=self.file.pk).path, '/other/moved/c/file.txt')
+		self.assertEqual(FilesystemItem.objects.get(pk=self.file.pk).path_hash, hash_path('/other/moved/c/file.txt'))
+		self.assertEqual(self.links(self.file), { 'file.txt': 0, 'c': 1, 'moved': 2, 'other': 3 })
+		self.assertEqual(FilesystemItem.objects.get(pk=self.a.pk).filesize, 0)
+		self.assertEqual(FilesystemItem.objects.get(pk=self.other.pk).filesize, 10)
+
+		# not into its own subtree
+		response = client.put(f'/filesystem/{self.other.id}/move/', { 'parent': self.c.id, 'name': 'other' }, format='json')
+		self.assertEqual(response.status_code, 400)
+
+	def test_recompute_sizes(self):
+		FilesystemItem.objects.filter(pk=self.file.pk).update(filesize=10)
+		propagate_size_change(self.c.id, 10)
+		deleted = self.create('deleted.txt', self.b, is_file=True)
+		FilesystemItem.all_objects.filter(pk=deleted.pk).update(filesize=5, is_deleted=True)
+
+		FilesystemItem.objects.filter(pk__in=[self.a.pk, self.c.pk]).update(filesize=999)
+		FilesystemItem.objects.filter(pk=self.other.pk).update(filesize=7)
+
+		out = StringIO()
+		call_command('recompute_sizes', batch_size=2, stdout=out)
+
+		sizes = dict(FilesystemItem.objects.filter(is_file=False).values_list('name', 'filesize'))
+		self.assertEqual(sizes, { 'a': 10, 'b': 10, 'c': 10, 'other': 0 })
+		self.assertIn('Updated the size of 3 of 4 folders.', out.getvalue())
+
+	def test_move_into_a_taken_name(self):
+		(access_token, _) = generate_tokens_for_user(self.user)
+		client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+		self.create('b', self.other)
+
+		# only the parent is sent, the name it keeps is taken there
+		response = client.patch(f'/filesystem/{self.b.id}/move/', { 'parent': self.other.id }, format='json')
+		self.assertEqual(response.status_code, 400)
+		self.assertIn('name', response.json())
+
+		response = client.patch(f'/filesystem/{self.b.id}/move/', { 'name': 'renamed' }, format='json')
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(FilesystemItem.objects.get(pk=self.file.pk).path, '/a/renamed/c/file.txt')
+
+	def test_name_taken_meanwhile(self):
+		(access_token, _) = generate_tokens_for_user(self.user)
+		client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+
+		# as if the other request had created it between the checks and the INSERT or UPDATE
+		with mock.patch.object(MoveFilesystemItemSerializer, 'validate', lambda serializer, attrs: attrs):
+			response = client.patch(f'/filesystem/{self.other.id}/move/', { 'name': 'a' }, format='json')
+		self.assertEqual(response.status_code, 400)
+		self.assertEqual(FilesystemItem.objects.get(pk=self.other.pk).path, '/other')
+
+		with mock.patch.object(CreateFilesystemItemSerializer, 'validate_name', lambda serializer, value: value):
+			response = client.post('/filesystem/create/', { 'parent': '', 'name': 'a' }, format='multipart')
+		self.assertEqual(response.status_code, 400)
+		self.assertEqual(FilesystemItem.objects.filter(name='a').count(), 1)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class EndpointQueryCountTests(TestCase):
+	"""
+	The item, share or upload session an endpoint works on is fetched once
+	per request, however many permission checks need it. The users have
+	made a request before, so they are cached and aren't fetched at all.
+	"""
+	def setUp(self):
+		user_cache.clear()
+
+		self.user = User.objects.create_user(email='owner@bongo.local', password='password', username='owner')
+		(access_token, _) = generate_tokens_for_user(self.user)
+		self.client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+
+		self.other_user = User.objects.create_user(email='other@bongo.local', password='password', username='other')
+		(access_token, _) = generate_tokens_for_user(self.other_user)
+		self.other_client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+
+		self.folder = FilesystemItem(owner=self.user, name='folder', is_file=False)
+		self.folder.save()
+
+		response = self.client.post('/filesystem/create/', {
+			'parent': self.folder.id,
+			'name': 'file.txt',
+			'uploaded_file': SimpleUploadedFile('file.txt', b'contents')
+		}, format='multipart')
+		self.file = FilesystemItem.objects.get(pk=response.json()['id'])
+		self.other_client.get('/auth/me/')
+
+	@classmethod
+	def tearDownClass(cls):
+		super().tearDownClass()
+		shutil.rmtree(cls._overridden_settings['MEDIA_ROOT'], ignore_errors=True)
+
+	def share(self, **data):
+		response = self.client.post(f'/filesystem/{self.file.id}/share/', data, format='json')
+		self.assertEqual(response.status_code, 201)
+		return response.json()['id']
+
+	def test_download(self):
+		with self.assertNumQueries(1):
+			response = self.client.get(f'/filesystem/{self.file.id}/download/')
+
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(b''.join(response.streaming_content), b'contents')
+
+	def test_download_of_someone_elses_item(self):
+		with self.assertNumQueries(1):
+			response = self.other_client.get(f'/filesystem/{self.file.id}/download/')
+
+		self.assertEqual(response.status_code, 403)
+
+	def test_move(self):
+		with self.assertNumQueries(14):
+			response = self.client.patch(f'/filesystem/{self.file.id}/move/', { 'parent': None, 'name': 'moved.txt' }, format='json')
+
+		self.assertEqual(response.status_code, 200)
+
+	def test_delete(self):
+		with self.assertNumQueries(10):
+			response = self.client.delete(f'/filesystem/{self.file.id}/delete/')
+
+		self.assertEqual(response.status_code, 204)
+
+	def test_share(self):
+		with self.assertNumQueries(6):
+			response = self.client.post(f'/filesystem/{self.file.id}/share/', {}, format='json')
+
+		self.assertEqual(response.status_code, 201)
+
+	def test_retrieve_share(self):
+		shared_item_id = self.share()
+
+		with self.assertNumQueries(1):
+			response = self.other_client.get(f'/filesystem/share/{shared_item_id}/')
+
+		self.assertEqual(response.status_code, 200)
+
+	def test_retrieve_share_from_item(self):
+		self.share()
+
+		with self.assertNumQueries(4):
+			response = self.client.get(f'/filesystem/share/item/{self.file.id}/')
+
+		self.assertEqual(response.status_code, 200)
+
+	def test_download_share(self):
+		shared_item_id = self.share()
+
+		with self.assertNumQueries(1):
+			response = self.other_client.post(f'/filesystem/share/{shared_item_id}/download/', {}, format='json')
+
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(b''.join(response.streaming_content), b'contents')
+
+	def test_download_share_not_allowed(self):
+		User.objects.create_user(email='third@bongo.local', password='password', username='third')
+		shared_item_id = self.share(allowed_users=['third'])
+
+		with self.assertNumQueries(1):
+			response = self.other_client.post(f'/filesystem/share/{shared_item_id}/download/', {}, format='json')
+
+		self.assertEqual(response.status_code, 403)
+
+	def test_download_share_allowed(self):
+		shared_item_id = self.share(allowed_users=['other'])
+
+		# the allowed users are checked in the same query that fetches the share
+		with self.assertNumQueries(1):
+			response = self.other_client.post(f'/filesystem/share/{shared_item_id}/download/', {}, format='json')
+
+		self.assertEqual(response.status_code, 200)
+
+	def test_update_share(self):
+		shared_item_id = self.share()
+
+		with self.assertNumQueries(4):
+			response = self.client.patch(f'/filesystem/share/{shared_item_id}/update/', { 'password': 'secret' }, format='json')
+
+		self.assertEqual(response.status_code, 200)
+
+	def test_delete_share(self):
+		shared_item_id = self.share()
+
+		with self.assertNumQueries(6):
+			response = self.client.delete(f'/filesystem/share/{shared_item_id}/delete/')
+
+		self.assertEqual(response.status_code, 204)
+
+	def test_upload_session(self):
+		response = self.client.post('/filesystem/uploads/create/', { 'parent': self.folder.id, 'name': 'upload.bin', 'filesize': 10 }, format='json')
+		session_id = response.json()['id']
+
+		with self.assertNumQueries(2):
+			response = self.client.get(f'/filesystem/uploads/{session_id}/')
+
+		self.assertEqual(response.status_code, 200)
+
+		# the session is locked and its reservation released before it's deleted
+		with self.assertNumQueries(8):
+			response = self.client.delete(f'/filesystem/uploads/{session_id}/delete/')
+
+		self.assertEqual(response.status_code, 204)
+
+
+class RangeTests(SimpleTestCase):
+	"""
+	Range headers are parsed into sorted, coalesced byte ranges, or
+	ignored altogether when they are malformed. Unknown ways of delivering
+	downloads are refused up front.
+	"""
+	def test_parse_range_header(self):
+		self.assertEqual(parse_range_header('bytes=0-9', 100), [(0, 9)])
+		self.assertEqual(parse_range_header('bytes=90-', 100), [(90, 99)])
+		self.assertEqual(parse_range_header('bytes=-10', 100), [(90, 99)])
+		self.assertEqual(parse_range_header('bytes=-200', 100), [(0, 99)])
+		self.assertEqual(parse_range_header('bytes=50-500', 100), [(50, 99)])
+
+	def test_ranges_are_sorted_and_coalesced(self):
+		self.assertEqual(parse_range_header('bytes=20-29, 0-9', 100), [(0, 9), (20, 29)])
+		self.assertEqual(parse_range_header('bytes=0-9,10-19,15-40', 100), [(0, 40)])
+
+	def test_unsatisfiable(self):
+		self.assertEqual(parse_range_header('bytes=100-', 100), [])
+		self.assertEqual(parse_range_header('bytes=-0', 100), [])
+		self.assertEqual(parse_range_header('bytes=0-', 0), [])
+
+	def test_ignored(self):
+		for header in ('items=0-9', 'bytes', 'bytes=a-9', 'bytes=9-0', 'bytes=-', 'bytes=0-9;x'):
+			with self.subTest(header=header):
+				self.assertIsNone(parse_range_header(header, 100))
+
+		too_many = ','.join(f'{i * 10}-{i * 10 + 1}' for i in range(20))
+		self.assertIsNone(parse_range_header(f'bytes={too_many}', 1000))
+
+	def test_iter_file_ranges(self):
+		file = BytesIO(bytes(range(100)))
+		parts = list(iter_file_ranges(file, [(0, 9), (50, 54)], chunk_size=4, part_headers=[b'<a>', b'<b>'], closing=b'<end>'))
+
+		self.assertEqual(b''.join(parts), b'<a>' + bytes(range(10)) + b'<b>' + bytes(range(50, 55)) + b'<end>')
+		self.assertTrue(all(len(part) <= 4 for part in parts if not part.startswith(b'<')))
+		self.assertTrue(file.closed)
+
+	def test_download_delivery(self):
+		for delivery in ('django', 'x-accel-redirect', 'x-sendfile'):
+			with self.subTest(delivery=delivery), self.settings(DOWNLOAD_DELIVERY=delivery):
+				self.assertEqual(get_download_delivery(), delivery)
+
+		with self.settings(DOWNLOAD_DELIVERY='x-accel'):
+			with self.assertRaises(ImproperlyConfigured):
+				get_download_delivery()
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class DownloadTests(TestCase):
+	"""
+	Files are downloaded whole, or by the ranges asked for, and not at all
+	when the client has them already.
+	"""
+	contents = b'0123456789abcdefghij'
+
+	def setUp(self):
+		self.user = User.objects.create_user(email='owner@bongo.local', password='password', username='owner')
+		(access_token, _) = generate_tokens_for_user(self.user)
+		self.client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+
+		response = self.client.post('/filesystem/create/', {
+			'parent': '',
+			'name': 'file.txt',
+			'uploaded_file': SimpleUploadedFile('file.txt', self.contents)
+		}, format='multipart')
+		self.file = FilesystemItem.objects.get(pk=response.json()['id'])
+		self.url = f'/filesystem/{self.file.id}/download/'
+
+	@classmethod
+	def tearDownClass(cls):
+		super().tearDownClass()
+		shutil.rmtree(cls._overridden_settings['MEDIA_ROOT'], ignore_errors=True)
+
+	def test_single_range(self):
+		response = self.client.get(self.url, HTTP_RANGE='bytes=5-9')
+
+		self.assertEqual(response.status_code, 206)
+		self.assertEqual(response['Content-Range'], 'bytes 5-9/20')
+		self.assertEqual(b''.join(response.streaming_content), b'56789')
+
+	def test_multiple_ranges(self):
+		response = self.client.get(self.url, HTTP_RANGE='bytes=0-1,-2')
+		body = b''.join(response.streaming_content)
+
+		self.assertEqual(response.status_code, 206)
+		self.assertTrue(response['Content-Type'].startswith('multipart/byteranges; boundary='))
+		self.assertEqual(int(response['Content-Length']), len(body))
+		self.assertIn(b'Content-Range: bytes 0-1/20\r\n\r\n01\r\n', body)
+		self.assertIn(b'Content-Range: bytes 18-19/20\r\n\r\nij\r\n', body)
+
+	def test_unsatisfiable_range(self):
+		response = self.client.get(self.url, HTTP_RANGE='bytes=20-')
+
+		self.assertEqual(response.status_code, 416)
+		self.assertEqual(response['Content-Range'], 'bytes */20')
+
+	def test_if_range(self):
+		# the file changed since the client got its first part, it gets all of it
+		response = self.client.get(self.url, HTTP_RANGE='bytes=5-9', HTTP_IF_RANGE='"outdated"')
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(b''.join(response.streaming_content), self.contents)
+
+		response = self.client.get(self.url, HTTP_RANGE='bytes=5-9', HTTP_IF_RANGE=f'"{self.file.sha256}"')
+		self.assertEqual(response.status_code, 206)
+
+	def test_if_none_match(self):
+		response = self.client.get(self.url)
+		self.assertEqual(response['ETag'], f'"{self.file.sha256}"')
+
+		response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+		self.assertEqual(response.status_code, 304)
+		self.assertEqual(response['ETag'], f'"{self.file.sha256}"')
+
+		self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"outdated"').status_code, 200)
+
+	def test_share_download_ignores_if_none_match(self):
+		shared_item = FilesystemSharedItem.objects.create(item=self.file)
+
+		response = self.client.post(f'/filesystem/share/{shared_item.id}/download/', {}, format='json', HTTP_IF_NONE_MATCH=f'"{self.file.sha256}"')
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(b''.join(response.streaming_content), self.contents)
+
+	def offloaded_downloads(self, delivery):
+		shared_item = FilesystemSharedItem.objects.create(item=self.file)
+		with mock.patch('filesystem.downloads.DOWNLOAD_DELIVERY', delivery):
+			return [
+				self.client.get(self.url),
+				self.client.post(f'/filesystem/share/{shared_item.id}/download/', {}, format='json'),
+			]
+
+	def test_x_accel_redirect(self):
+		for response in self.offloaded_downloads('x-accel-redirect'):
+			self.assertEqual(response.status_code, 200)
+			self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.file.uploaded_file.name}')
+			self.assertNotIn('X-Sendfile', response)
+			self.assertEqual(response['Content-Disposition'], 'inline; filename="file.txt"')
+			self.assertEqual(response.content, b'')
+
+	def test_x_sendfile(self):
+		for response in self.offloaded_downloads('x-sendfile'):
+			self.assertEqual(response.status_code, 200)
+			self.assertEqual(response['X-Sendfile'], self.file.uploaded_file.path)
+			self.assertNotIn('X-Accel-Redirect', response)
+			self.assertEqual(response.content, b'')
+
+	def test_listing_etag(self):
+		response = self.client.get('/filesystem/')
+		etag = response['ETag']
+		self.assertEqual(self.client.get('/filesystem/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+		# a new item changes the listing
+		self.client.post('/filesystem/create/', { 'parent': '', 'name': 'folder' }, format='multipart')
+		response = self.client.get('/filesystem/', HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 200)
+		self.assertNotEqual(response['ETag'], etag)
+
+
+class PathLookupTests(TestCase):
+	"""
+	Items are found by path through the hash of the path, among the items
+	of the user only.
+	"""
+	def setUp(self):
+		self.user = User.objects.create_user(email='owner@bongo.local', password='password', username='owner')
+		(access_token, _) = generate_tokens_for_user(self.user)
+		self.client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+
+		self.folder = FilesystemItem(owner=self.user, name='Docs', is_file=False)
+		self.folder.save()
+		self.file = FilesystemItem(owner=self.user, parent=self.folder, name='report.txt', is_file=True)
+		self.file.save()
+
+		other_user = User.objects.create_user(email='other@bongo.local', password='password', username='other')
+		FilesystemItem(owner=other_user, name='Elsewhere', is_file=False).save()
+
+	def retrieve(self, path):
+		return self.client.get(f'/filesystem/path/{parse.quote(parse.quote(path, safe=""))}/')
+
+	def test_path_hash(self):
+		self.assertEqual(self.file.path, '/Docs/report.txt')
+		self.assertEqual(self.file.path_hash, hash_path('/Docs/report.txt'))
+
+	def test_retrieve(self):
+		response = self.retrieve('/Docs/report.txt')
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response.json()['item']['id'], str(self.file.id))
+
+		# normalized first
+		self.assertEqual(self.retrieve('Docs//report.txt/').status_code, 200)
+
+		# paths are case sensitive, whatever the collation
+		self.assertEqual(self.retrieve('/docs/report.txt').status_code, 404)
+		self.assertEqual(self.retrieve('/Elsewhere').status_code, 404)
+
+	def test_resolve(self):
+		response = self.client.post('/filesystem/paths/', { 'paths': ['/Docs/report.txt', '/Elsewhere', '/Docs/'] }, format='json')
+		items = response.json()['items']
+
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual([item and item['id'] for item in items], [str(self.file.id), None, str(self.folder.id)])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class DeletionTests(TestCase):
+	"""
+	Deleting a folder hides its subtree right away, process_deletions
+	removes it later in batches.
+	"""
+	def setUp(self):
+		self.user = User.objects.create_user(email='owner@bongo.local', password='password', username='owner')
+		(access_token, _) = generate_tokens_for_user(self.user)
+		self.client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+
+		self.folder = self.create_folder('folder', None)
+		self.subfolder = self.create_folder('subfolder', self.folder)
+		self.file = self.create_file('file.txt', self.subfolder)
+		FilesystemSharedItem.objects.create(item=self.file)
+		self.subtree = [self.folder.id, self.subfolder.id, self.file.id]
+
+	@classmethod
+	def tearDownClass(cls):
+		super().tearDownClass()
+		shutil.rmtree(cls._overridden_settings['MEDIA_ROOT'], ignore_errors=True)
+
+	def create_folder(self, name, parent):
+		response = self.client.post('/filesystem/create/', { 'parent': parent.id if parent else '', 'name': name }, format='multipart')
+		return FilesystemItem.objects.get(pk=response.json()['id'])
+
+	def create_file(self, name, parent):
+		response = self.client.post('/filesystem/create/', {
+			'parent': parent.id,
+			'name': name,
+			'uploaded_file': SimpleUploadedFile(name, b'contents')
+		}, format='multipart')
+		return FilesystemItem.objects.get(pk=response.json()['id'])
+
+	def test_delete_hides_subtree(self):
+		response = self.client.delete(f'/filesystem/{self.folder.id}/delete/')
+		self.assertEqual(response.status_code, 204)
+
+		self.assertEqual(self.client.get(f'/filesystem/{self.file.id}/info/').status_code, 404)
+		self.assertEqual(self.client.get('/filesystem/path/%252Ffolder%252Fsubfolder/').status_code, 404)
+		self.assertEqual(FilesystemItem.all_objects.filter(pk__in=self.subtree).count(), 3)
+
+		# the same paths can be used again before the old ones are gone
+		folder = self.create_folder('folder', None)
+		self.create_folder('subfolder', folder)
+
+	def test_share_of_deleted_item_is_hidden(self):
+		other_user = User.objects.create_user(email='other@bongo.local', password='password', username='other')
+		(access_token, _) = generate_tokens_for_user(other_user)
+		other_client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+		url = f'/filesystem/share/item/{self.file.id}/'
+
+		self.assertEqual(self.client.get(url).status_code, 200)
+		self.assertEqual(other_client.get(url).status_code, 403)
+
+		self.client.delete(f'/filesystem/{self.file.id}/delete/')
+		self.assertEqual(self.client.get(url).status_code, 404)
+		self.assertEqual(other_client.get(url).status_code, 404)
+
+	def test_detach_is_a_fixed_number_of_statements(self):
+		# like on MySQL, where updating through a join makes Django select the ids first
+		with mock.patch.object(connection.features, 'update_can_self_select', False):
+			with self.assertNumQueries(3):
+				detach_subtree(self.folder)
+
+		self.assertFalse(FilesystemItem.objects.filter(pk__in=self.subtree).exists())
+		self.assertEqual(list(DeletionTask.objects.values_list('item_id', flat=True)), [self.folder.id])
+
+	def test_process_deletions(self):
+		blob = Blob.objects.get(pk=self.file.blob_id)
+		self.client.delete(f'/filesystem/{self.folder.id}/delete/')
+
+		call_command('process_deletions', batch_size=1, stdout=StringIO())
+
+		self.assertFalse(FilesystemItem.all_objects.filter(pk__in=self.subtree).exists())
+		self.assertFalse(FilesystemItemAncestry.objects.filter(descendant_id__in=self.subtree).exists())
+		self.assertFalse(FilesystemSharedItem.objects.exists())
+		self.assertFalse(DeletionTask.objects.exists())
+		self.assertEqual(Blob.objects.get(pk=blob.pk).refcount, blob.refcount - 1)
+
+	def test_delete_inside_deleted_folder(self):
+		self.client.delete(f'/filesystem/{self.subfolder.id}/delete/')
+		self.client.delete(f'/filesystem/{self.folder.id}/delete/')
+
+		# the task of the subfolder was taken over by the one of the folder
+		self.assertEqual(list(DeletionTask.objects.values_list('item_id', flat=True)), [self.folder.id])
+
+		call_command('process_deletions', stdout=StringIO())
+		self.assertFalse(FilesystemItem.all_objects.filter(pk__in=self.subtree).exists())
+
+
+class ReconcileStorageTests(TestCase):
+	"""
+	reconcile_storage lists the files nothing refers to, the blobs whose
+	file is missing and the storage used that is off, and fixes them when
+	asked to.
+	"""
+	def setUp(self):
+		media_root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+		media_settings = self.settings(MEDIA_ROOT=media_root)
+		media_settings.enable()
+		self.addCleanup(media_settings.disable)
+
+		self.user = User.objects.create_user(email='owner@bongo.local', password='password', username='owner')
+		(access_token, _) = generate_tokens_for_user(self.user)
+		self.client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+		response = self.client.post('/filesystem/create/', {
+			'parent': '',
+			'name': 'file.txt',
+			'uploaded_file': SimpleUploadedFile('file.txt', b'contents')
+		}, format='multipart')
+		self.blob_path = Path(FilesystemItem.objects.get(pk=response.json()['id']).blob.path())
+
+		# a blob file without its row, an upload without its session and a staged upload
+		self.orphans = [self.blob_path.with_name('e' * 64), Path(media_root, 'uploads', str(uuid.uuid4())), Path(media_root, 'staging', 'upload')]
+		for path in self.orphans:
+			path.parent.mkdir(parents=True, exist_ok=True)
+			path.write_bytes(b'orphaned')
+
+		# rows without a file, unreferenced or not
+		Blob.objects.create(sha256='d' * 64, size=8, refcount=0)
+		Blob.objects.create(sha256='c' * 64, size=8, refcount=1)
+
+		User.objects.filter(pk=self.user.pk).update(storage_used=999)
+
+	def reconcile(self, **options):
+		out = StringIO()
+		call_command('reconcile_storage', grace=-60, stdout=out, **options)
+		return out.getvalue()
+
+	def test_report(self):
+		out = self.reconcile()
+
+		for path in self.orphans:
+			self.assertIn(str(path), out)
+			self.assertTrue(path.exists())
+		self.assertIn('Found 3 orphaned files.', out)
+
+		self.assertIn(f'{"d" * 64}: missing file, 0 references', out)
+		self.assertIn(f'{"c" * 64}: missing file, 1 references', out)
+		self.assertIn('Found 2 blobs without a file.', out)
+		self.assertEqual(Blob.objects.count(), 3)
+
+		self.assertIn('owner: storage used is 999, should be 8', out)
+		self.assertIn('Found the storage used of 1 users.', out)
+		self.assertEqual(User.objects.get(pk=self.user.pk).storage_used, 999)
+
+	def test_fix(self):
+		out = self.reconcile(fix=True)
+
+		self.assertIn('Removed 3 orphaned files.', out)
+		self.assertFalse(any(path.exists() for path in self.orphans))
+		self.assertTrue(self.blob_path.is_file())
+
+		# a blob that's still referenced is kept, its items have to be dealt with by hand
+		self.assertEqual(sorted(Blob.objects.values_list('pk', flat=True)), sorted(['c' * 64, self.blob_path.name]))
+
+		self.assertIn('Corrected the storage used of 1 users.', out)
+		self.assertEqual(User.objects.get(pk=self.user.pk).storage_used, 8)
+
+		self.assertIn('Found 0 orphaned files.', self.reconcile())
+
+	def test_grace(self):
+		out = StringIO()
+		call_command('reconcile_storage', fix=True, stdout=out)
+
+		self.assertIn('Removed 0 orphaned files.', out.getvalue())
+		self.assertIn('Found 0 blobs without a file.', out.getvalue())
+		self.assertTrue(all(path.exists() for path in self.orphans))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ArchiveCacheTests(TestCase):
+	"""
+	Folder archives are stored while they're streamed to the first
+	client, and served from the cache until the subtree changes.
+	"""
+	def setUp(self):
+		self.user = User.objects.create_user(email='owner@bongo.local', password='password', username='owner')
+		(access_token, _) = generate_tokens_for_user(self.user)
+		self.client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+
+		self.folder = self.create_folder('folder', None)
+		self.subfolder = self.create_folder('subfolder', self.folder)
+		response = self.client.post('/filesystem/create/', {
+			'parent': self.subfolder.id,
+			'name': 'file.txt',
+			'uploaded_file': SimpleUploadedFile('file.txt', b'contents')
+		}, format='multipart')
+		self.file = FilesystemItem.objects.get(pk=response.json()['id'])
+
+		self.cache_dir = tempfile.mkdtemp()
+		patcher = mock.patch('filesystem.views.archive_cache', ArchiveCache(self.cache_dir, 10 ** 6))
+		self.cache = patcher.start()
+		self.addCleanup(patcher.stop)
+		self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+
+	@classmethod
+	def tearDownClass(cls):
+		super().tearDownClass()
+		shutil.rmtree(cls._overridden_settings['MEDIA_ROOT'], ignore_errors=True)
+
+	def create_folder(self, name, parent):
+		response = self.client.post('/filesystem/create/', { 'parent': parent.id if parent else '', 'name': name }, format='multipart')
+		return FilesystemItem.objects.get(pk=response.json()['id'])
+
+	def download(self):
+		response = self.client.get(f'/filesystem/{self.folder.id}/download/')
+		return (response, b''.join(response.streaming_content))
+
+	def cached(self):
+		return sorted(path.name for path in Path(self.cache_dir).iterdir())
+
+	def test_stored_while_streamed(self):
+		(response, data) = self.download()
+		self.assertNotIsInstance(response, FileResponse)
+		self.assertEqual(self.cached(), [f'{archive_key(FilesystemItem.objects.get(pk=self.folder.pk))}.zip'])
+
+		(response, cached_data) = self.download()
+		self.assertIsInstance(response, FileResponse)
+		self.assertEqual(cached_data, data)
+
+	def test_changes_deep_in_the_subtree(self):
+		self.download()
+
+		self.client.patch(f'/filesystem/{self.file.id}/move/', { 'parent': self.subfolder.id, 'name': 'renamed.txt' }, format='json')
+		(response, data) = self.download()
+
+		self.assertNotIsInstance(response, FileResponse)
+		self.assertEqual(sorted(zipfile.ZipFile(BytesIO(data)).namelist()), ['folder/', 'folder/subfolder/', 'folder/subfolder/renamed.txt'])
+		# the archive of the earlier version is gone
+		self.assertEqual(len(self.cached()), 1)
+
+	def test_not_stored_twice_at_once(self):
+		folder = FilesystemItem.objects.get(pk=self.folder.pk)
+		with self.cache.try_lock(f'archive-{archive_key(folder)}'):
+			(response, data) = self.download()
+
+		self.assertIn('folder/subfolder/file.txt', zipfile.ZipFile(BytesIO(data)).namelist())
+		self.assertEqual(self.cached(), [])
+
+	def test_read_along_while_stored(self):
+		folder = FilesystemItem.objects.get(pk=self.folder.pk)
+		with mock.patch('filesystem.archive.stream_folder_archive', wraps=stream_folder_archive) as generate:
+			storing = self.cache.stream(folder)
+			stored = [next(storing)]
+
+			following = self.cache.stream(folder)
+			followed = [next(following)]
+
+			stored += list(storing)
+			followed += list(following)
+
+		# zipped once, for both
+		self.assertEqual(generate.call_count, 1)
+		self.assertEqual(b''.join(followed), b''.join(stored))
+		self.assertEqual(self.cached(), [f'{archive_key(folder)}.zip'])
+
+	def test_read_along_when_storing_stops(self):
+		folder = FilesystemItem.objects.get(pk=self.folder.pk)
+		expected = b''.join(stream_folder_archive(folder))
+
+		storing = self.cache.stream(folder)
+		next(storing)
+		following = self.cache.stream(folder)
+		followed = [next(following)]
+
+		# the client of the first request went away, the second one generates the rest
+		storing.close()
+		followed += list(following)
+
+		self.assertEqual(b''.join(followed), expected)
+		self.assertEqual(self.cached(), [])
+
+	def test_interrupted_download_is_not_stored(self):
+		response = self.client.get(f'/filesystem/{self.folder.id}/download/')
+		next(iter(response.streaming_content))
+		response.close()
+
+		self.assertEqual(self.cached(), [])
+		self.assertIsNone(self.cache.open(FilesystemItem.objects.get(pk=self.folder.pk)))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class BlobDedupTests(TestCase):
+	"""
+	A file can be created from its sha256 alone when the user already has
+	it, or proves to have it, never from a blob of someone else otherwise.
+	"""
+	contents = b'private contents of the owner'
+
+	def setUp(self):
+		self.user = User.objects.create_user(email='owner@bongo.local', password='password', username='owner')
+		(access_token, _) = generate_tokens_for_user(self.user)
+		self.client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+
+		self.other_user = User.objects.create_user(email='other@bongo.local', password='password', username='other')
+		(access_token, _) = generate_tokens_for_user(self.other_user)
+		self.other_client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+
+		self.client.post('/filesystem/create/', {
+			'parent': '',
+			'name': 'secret.txt',
+			'uploaded_file': SimpleUploadedFile('secret.txt', self.contents)
+		}, format='multipart')
+		self.sha256 = hashlib.sha256(self.contents).hexdigest()
+
+	@classmethod
+	def tearDownClass(cls):
+		super().tearDownClass()
+		shutil.rmtree(cls._overridden_settings['MEDIA_ROOT'], ignore_errors=True)
+
+	def create(self, client, sha256, **extra):
+		return client.post('/filesystem/create/', { 'parent': '', 'name': 'copy.txt', 'sha256': sha256, 'filesize': len(self.contents), **extra }, format='json')
+
+	def test_same_user(self):
+		response = self.create(self.client, self.sha256)
+		self.assertEqual(response.status_code, 201)
+		self.assertEqual(Blob.objects.get(pk=self.sha256).refcount, 2)
+
+	def test_other_user_gets_the_same_challenge_either_way(self):
+		response = self.create(self.other_client, self.sha256)
+		unknown_response = self.create(self.other_client, 'f' * 64)
+
+		self.assertEqual(response.status_code, 428)
+		self.assertEqual(unknown_response.status_code, 428)
+		self.assertEqual(response.json().keys(), unknown_response.json().keys())
+		self.assertEqual(Blob.objects.get(pk=self.sha256).refcount, 1)
+
+	def test_other_user_with_a_wrong_proof(self):
+		challenge = self.create(self.other_client, self.sha256).json()
+		response = self.create(self.other_client, self.sha256, challenge=challenge['challenge'], proof='0' * 64)
+
+		self.assertEqual(response.status_code, 404)
+		self.assertFalse(FilesystemItem.objects.filter(owner=self.other_user).exists())
+
+	def test_other_user_with_the_file(self):
+		challenge = self.create(self.other_client, self.sha256).json()
+		proof = hash_ranges(BytesIO(self.contents), challenge['ranges'])
+
+		# a challenge is only good for the user it was given to
+		self.assertEqual(self.create(self.client, 'f' * 64, challenge=challenge['challenge'], proof=proof).status_code, 404)
+
+		response = self.create(self.other_client, self.sha256, challenge=challenge['challenge'], proof=proof)
+		self.assertEqual(response.status_code, 201)
+		self.assertEqual(Blob.objects.get(pk=self.sha256).refcount, 2)
+
+	def test_refcount_through_create_delete_and_collect(self):
+		blob_path = Path(Blob.objects.get(pk=self.sha256).path())
+		response = self.other_client.post('/filesystem/create/', {
+			'parent': '',
+			'name': 'same.txt',
+			'uploaded_file': SimpleUploadedFile('same.txt', self.contents)
+		}, format='multipart')
+		self.assertEqual(Blob.objects.get(pk=self.sha256).refcount, 2)
+		self.assertEqual(list(blob_path.parent.parent.parent.glob('*/*/*')), [blob_path])
+
+		# still referenced by the other user's item
+		item = FilesystemItem.objects.get(owner=self.user)
+		self.client.delete(f'/filesystem/{item.id}/delete/')
+		call_command('process_deletions', stdout=StringIO())
+		call_command('collect_blobs', grace=-60, stdout=StringIO())
+		self.assertEqual(Blob.objects.get(pk=self.sha256).refcount, 1)
+		self.assertTrue(blob_path.is_file())
+
+		self.other_client.delete(f'/filesystem/{response.json()["id"]}/delete/')
+		call_command('process_deletions', stdout=StringIO())
+		self.assertEqual(Blob.objects.get(pk=self.sha256).refcount, 0)
+
+		call_command('collect_blobs', grace=-60, stdout=StringIO())
+		self.assertFalse(Blob.objects.filter(pk=self.sha256).exists())
+		self.assertFalse(blob_path.exists())
+
+	def test_grace_period_runs_from_the_last_reference(self):
+		# stored long ago, dereferenced just now
+		Blob.objects.filter(pk=self.sha256).update(updated_at=timezone.now() - timedelta(days=1))
+		item = FilesystemItem.objects.get(owner=self.user)
+		self.client.delete(f'/filesystem/{item.id}/delete/')
+		call_command('process_deletions', stdout=StringIO())
+
+		call_command('collect_blobs', grace=3600, stdout=StringIO())
+		self.assertEqual(Blob.objects.get(pk=self.sha256).refcount, 0)
+
+		Blob.objects.filter(pk=self.sha256).update(updated_at=timezone.now() - timedelta(hours=2))
+		call_command('collect_blobs', grace=3600, stdout=StringIO())
+		self.assertFalse(Blob.objects.filter(pk=self.sha256).exists())
+
+	def test_file_is_gone_with_the_row(self):
+		blob_path = Path(Blob.objects.get(pk=self.sha256).path())
+		FilesystemItem.objects.get(owner=self.user).delete()
+
+		# removed with the row locked, not once the transaction commits
+		with self.captureOnCommitCallbacks() as callbacks:
+			call_command('collect_blobs', grace=-60, stdout=StringIO())
+
+		self.assertEqual(callbacks, [])
+		self.assertFalse(blob_path.exists())
+		self.assertFalse(Blob.objects.filter(pk=self.sha256).exists())
+
+	def test_collect_orphans(self):
+		orphan = Path(Blob.objects.get(pk=self.sha256).path()).with_name('f' * 64)
+		orphan.write_bytes(b'left behind')
+
+		call_command('collect_blobs', grace=-60, orphans=True, stdout=StringIO())
+
+		self.assertFalse(orphan.exists())
+		self.assertTrue(Path(Blob.objects.get(pk=self.sha256).path()).is_file())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class StorageQuotaTests(TestCase):
+	"""
+	The storage used by each user is counted as files come and go, and
+	uploads that don't fit in the quota are turned away.
+	"""
+	def setUp(self):
+		self.user = User.objects.create_user(email='owner@bongo.local', password='password', username='owner', storage_quota=1000)
+		(access_token, _) = generate_tokens_for_user(self.user)
+		self.client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+
+		self.folder = FilesystemItem(owner=self.user, name='folder', is_file=False)
+		self.folder.save()
+
+	@classmethod
+	def tearDownClass(cls):
+		super().tearDownClass()
+		shutil.rmtree(cls._overridden_settings['MEDIA_ROOT'], ignore_errors=True)
+
+	def upload(self, name, contents):
+		return self.client.post('/filesystem/create/', {
+			'parent': self.folder.id,
+			'name': name,
+			'uploaded_file': SimpleUploadedFile(name, contents)
+		}, format='multipart')
+
+	def usage(self):
+		return self.client.get('/auth/me/').json()['user']['usage']
+
+	def test_upload_and_delete(self):
+		self.assertEqual(self.upload('file.txt', b'contents').status_code, 201)
+		self.assertEqual(self.usage(), { 'used': 8, 'quota': 1000 })
+
+		self.client.delete(f'/filesystem/{self.folder.id}/delete/')
+		self.assertEqual(self.usage(), { 'used': 0, 'quota': 1000 })
+
+	def test_upload_over_quota(self):
+		with mock.patch.object(StreamingStorageUploadHandler, 'receive_data_chunk') as receive_data_chunk:
+			response = self.upload('big.bin', b'x' * 2000)
+
+		self.assertEqual(response.status_code, 507)
+		receive_data_chunk.assert_not_called()
+		self.assertFalse(FilesystemItem.objects.filter(name='big.bin').exists())
+		self.assertEqual(self.usage()['used'], 0)
+
+	def test_upload_session_over_quota(self):
+		response = self.client.post('/filesystem/uploads/create/', { 'parent': self.folder.id, 'name': 'big.bin', 'filesize': 2000 }, format='json')
+		self.assertEqual(response.status_code, 507)
+
+		self.assertEqual(self.usage()['used'], 0)
+
+	def test_upload_sessions_reserve_storage(self):
+		first = self.client.post('/filesystem/uploads/create/', { 'parent': self.folder.id, 'name': 'first.bin', 'filesize': 600 }, format='json')
+		self.assertEqual(first.status_code, 201)
+		self.assertEqual(self.usage()['used'], 600)
+
+		# the first one holds the space, even though none of it was uploaded yet
+		second = self.client.post('/filesystem/uploads/create/', { 'parent': self.folder.id, 'name': 'second.bin', 'filesize': 600 }, format='json')
+		self.assertEqual(second.status_code, 507)
+
+		self.client.delete(f'/filesystem/uploads/{first.json()["id"]}/delete/')
+		self.assertEqual(self.usage()['used'], 0)
+
+		second = self.client.post('/filesystem/uploads/create/', { 'parent': self.folder.id, 'name': 'second.bin', 'filesize': 10 }, format='json')
+		session_id = second.json()['id']
+		self.client.put(f'/filesystem/uploads/{session_id}/chunks/0/', b'0123456789', content_type='application/octet-stream')
+
+		# the commit takes over the reservation
+		self.assertEqual(self.client.post(f'/filesystem/uploads/{session_id}/commit/').status_code, 201)
+		self.assertEqual(self.usage()['used'], 10)
+
+	def test_purged_sessions_release_storage(self):
+		self.client.post('/filesystem/uploads/create/', { 'parent': self.folder.id, 'name': 'upload.bin', 'filesize': 600 }, format='json')
+		self.client.post('/filesystem/uploads/create/', { 'parent': None, 'name': 'upload.bin', 'filesize': 100 }, format='json')
+		self.assertEqual(self.usage()['used'], 700)
+
+		# the sessions of deleted folders go along with them
+		self.client.delete(f'/filesystem/{self.folder.id}/delete/')
+		call_command('process_deletions', stdout=StringIO())
+		self.assertEqual(self.usage()['used'], 100)
+
+		call_command('purge_upload_sessions', max_age=-60, stdout=StringIO())
+		self.assertEqual(self.usage()['used'], 0)
+
+	def test_recompute_usage(self):
+		self.upload('file.txt', b'contents')
+		User.objects.filter(pk=self.user.pk).update(storage_used=50)
+
+		self.client.post('/filesystem/uploads/create/', { 'parent': self.folder.id, 'name': 'upload.bin', 'filesize': 10 }, format='json')
+
+		call_command('recompute_usage', stdout=StringIO())
+		self.assertEqual(self.usage()['used'], 18)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class UploadSessionTests(TestCase):
+	"""
+	Files uploaded in chunks, in any order and over as many requests as
+	needed, become an item once committed.
+	"""
+	chunk_size = 256 * 1024
+	contents = bytes(range(256)) * 2500
+
+	def setUp(self):
+		self.user = User.objects.create_user(email='owner@bongo.local', password='password', username='owner', storage_quota=10 * 1024 * 1024)
+		(access_token, _) = generate_tokens_for_user(self.user)
+		self.client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+
+		self.folder = FilesystemItem(owner=self.user, name='folder', is_file=False)
+		self.folder.save()
+
+	@classmethod
+	def tearDownClass(cls):
+		super().tearDownClass()
+		shutil.rmtree(cls._overridden_settings['MEDIA_ROOT'], ignore_errors=True)
+
+	def create_session(self, **extra):
+		data = { 'parent': self.folder.id, 'name': 'upload.bin', 'filesize': len(self.contents), 'chunk_size': self.chunk_size, **extra }
+		return self.client.post('/filesystem/uploads/create/', data, format='json')
+
+	def put_chunk(self, session_id, index):
+		chunk = self.contents[index * self.chunk_size:(index + 1) * self.chunk_size]
+		return self.client.put(f'/filesystem/uploads/{session_id}/chunks/{index}/', chunk, content_type='application/octet-stream')
+
+	def usage(self):
+		return User.objects.filter(pk=self.user.pk).values_list('storage_used', flat=True).get()
+
+	def test_upload_resume_and_commit(self):
+		session = self.create_session().json()
+		self.assertEqual(session['chunk_count'], 3)
+
+		self.assertEqual(self.put_chunk(session['id'], 2).status_code, 204)
+		self.assertEqual(self.put_chunk(session['id'], 0).status_code, 204)
+
+		# a client picking the upload up again asks which chunks made it
+		response = self.client.get(f'/filesystem/uploads/{session["id"]}/')
+		self.assertEqual(response.json()['received_chunks'], [0, 2])
+
+		response = self.client.post(f'/filesystem/uploads/{session["id"]}/commit/')
+		self.assertEqual(response.status_code, 400)
+
+		self.put_chunk(session['id'], 1)
+		response = self.client.post(f'/filesystem/uploads/{session["id"]}/commit/')
+		self.assertEqual(response.status_code, 201)
+
+		item = FilesystemItem.objects.get(pk=response.json()['id'])
+		self.assertEqual(item.sha256, hashlib.sha256(self.contents).hexdigest())
+		self.assertEqual(Path(item.blob.path()).read_bytes(), self.contents)
+		self.assertEqual(FilesystemItem.objects.get(pk=self.folder.pk).filesize, len(self.contents))
+		self.assertEqual(self.usage(), len(self.contents))
+
+		# committed once only, and closed to more chunks
+		self.assertEqual(self.client.post(f'/filesystem/uploads/{session["id"]}/commit/').status_code, 404)
+		self.assertEqual(self.put_chunk(session['id'], 0).status_code, 404)
+		self.assertEqual(FilesystemItem.objects.filter(name='upload.bin').count(), 1)
+
+	def test_chunk_of_the_wrong_length(self):
+		session = self.create_session().json()
+		response = self.client.put(f'/filesystem/uploads/{session["id"]}/chunks/2/', b'short', content_type='application/octet-stream')
+
+		self.assertEqual(response.status_code, 400)
+		self.assertEqual(self.client.get(f'/filesystem/uploads/{session["id"]}/').json()['received_chunks'], [])
+
+	def test_filesize_limit(self):
+		response = self.create_session(filesize=settings.UPLOAD_MAX_FILESIZE + 1)
+
+		self.assertEqual(response.status_code, 400)
+		self.assertIn('filesize', response.json())
+
+	def test_preallocation_failure(self):
+		open_blob = mock.mock_open()
+		open_blob.return_value.truncate.side_effect = OSError(errno.EFBIG, 'File too large')
+		with mock.patch('filesystem.views.open', open_blob, create=True):
+			response = self.create_session()
+
+		self.assertEqual(response.status_code, 507)
+		self.assertFalse(UploadSession.objects.exists())
+		self.assertEqual(self.usage(), 0)
+
+	def test_rollback_keeps_the_session_file(self):
+		# another item has the same contents, its blob must not change
+		self.client.post('/filesystem/create/', {
+			'parent': '',
+			'name': 'same.bin',
+			'uploaded_file': SimpleUploadedFile('same.bin', self.contents)
+		}, format='multipart')
+		blob = Blob.objects.get(pk=hashlib.sha256(self.contents).hexdigest())
+
+		session = self.create_session().json()
+		for index in range(3):
+			self.put_chunk(session['id'], index)
+
+		# the blob was stored by then
+		with mock.patch('filesystem.views.propagate_size_change', side_effect=IntegrityError):
+			response = self.client.post(f'/filesystem/uploads/{session["id"]}/commit/')
+		self.assertEqual(response.status_code, 400)
+
+		blob_path = UploadSession.objects.get(pk=session['id']).blob_path()
+		self.assertEqual(Path(blob_path).read_bytes(), self.contents)
+		self.assertFalse(os.path.samefile(blob_path, blob.path()))
+
+		chunk = b'X' * self.chunk_size
+		self.client.put(f'/filesystem/uploads/{session["id"]}/chunks/0/', chunk, content_type='application/octet-stream')
+		self.assertEqual(Path(blob.path()).read_bytes(), self.contents)
+
+		response = self.client.post(f'/filesystem/uploads/{session["id"]}/commit/')
+		self.assertEqual(response.status_code, 201)
+		self.assertEqual(Blob.objects.get(pk=blob.pk).refcount, 1)
+		self.assertEqual(Path(FilesystemItem.objects.get(pk=response.json()['id']).blob.path()).read_bytes(), chunk + self.contents[self.chunk_size:])
+
+
+class ShareGroupTests(TestCase):
+	"""
+	Shares can be opened to named groups of users, and allowed users
+	are looked up by their usernames all at once.
+	"""
+	def setUp(self):
+		self.user = User.objects.create_user(email='owner@bongo.local', password='password', username='owner')
+		(access_token, _) = generate_tokens_for_user(self.user)
+		self.client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+
+		self.member = User.objects.create_user(email='member@bongo.local', password='password', username='member')
+		(access_token, _) = generate_tokens_for_user(self.member)
+		self.member_client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+
+		self.other_user = User.objects.create_user(email='other@bongo.local', password='password', username='other')
+		(access_token, _) = generate_tokens_for_user(self.other_user)
+		self.other_client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+
+		self.file = FilesystemItem(owner=self.user, name='file.txt', is_file=True)
+		self.file.save()
+
+	def test_unknown_usernames_are_reported_together(self):
+		response = self.client.post(f'/filesystem/{self.file.id}/share/', { 'allowed_users': ['member', 'nobody', 'noone'] }, format='json')
+
+		self.assertEqual(response.status_code, 400)
+		self.assertEqual(response.json()['allowed_users'], ['Users not found: "nobody", "noone".'])
+
+	def test_share_with_group(self):
+		response = self.client.post('/filesystem/groups/create/', { 'name': 'team', 'members': ['member'] }, format='json')
+		self.assertEqual(response.status_code, 201)
+		group_id = response.json()['id']
+
+		response = self.client.post(f'/filesystem/{self.file.id}/share/', { 'allowed_groups': [group_id] }, format='json')
+		self.assertEqual(response.status_code, 201)
+		self.assertEqual(response.json()['allowed_groups'], [{ 'id': group_id, 'name': 'team' }])
+		shared_item_id = response.json()['id']
+
+		self.assertEqual(self.member_client.get(f'/filesystem/share/{shared_item_id}/').status_code, 200)
+		self.assertEqual(self.other_client.get(f'/filesystem/share/{shared_item_id}/').status_code, 403)
+
+		# it's in use, the share would become public without it
+		self.assertEqual(self.client.delete(f'/filesystem/groups/{group_id}/delete/').status_code, 400)
+
+	def test_groups_of_someone_else(self):
+		response = self.other_client.post('/filesystem/groups/create/', { 'name': 'team' }, format='json')
+		group_id = response.json()['id']
+
+		response = self.client.post(f'/filesystem/{self.file.id}/share/', { 'allowed_groups': [group_id] }, format='json')
+		self.assertEqual(response.status_code, 400)
+		self.assertEqual(self.client.get(f'/filesystem/groups/{group_id}/').status_code, 403)
+
+
+class ShareExpiryTests(TestCase):
+	"""
+	Expired shares are hidden by the read paths and
+	deleted by purge_expired_shares.
+	"""
+	def setUp(self):
+		self.user = User.objects.create_user(email='owner@bongo.local', password='password', username='owner')
+		(access_token, _) = generate_tokens_for_user(self.user)
+		self.client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+
+		self.file = FilesystemItem(owner=self.user, name='file.txt', is_file=True)
+		self.file.save()
+		self.shared_item = FilesystemSharedItem.objects.create(
+			item=self.file,
+			does_expire=True,
+			expiry=timezone.now() - timedelta(minutes=1)
+		)
+
+	def test_expired_share_is_hidden(self):
+		self.assertEqual(self.client.get(f'/filesystem/share/{self.shared_item.id}/').status_code, 404)
+		self.assertEqual(self.client.get(f'/filesystem/share/item/{self.file.id}/').status_code, 404)
+		self.assertFalse(self.client.get(f'/filesystem/{self.file.id}/info/').json()['is_shared'])
+
+		# reading doesn't delete it
+		self.assertTrue(FilesystemSharedItem.objects.filter(pk=self.shared_item.pk).exists())
+
+	def test_purge_expired_shares(self):
+		active = FilesystemSharedItem.objects.create(item=self.file, does_expire=True, expiry=timezone.now() + timedelta(days=1))
+
+		call_command('purge_expired_shares', batch_size=1, stdout=StringIO())
+
+		self.assertEqual(list(FilesystemSharedItem.objects.values_list('pk', flat=True)), [active.pk])
+
+
+class SearchTests(TestCase):
+	"""
+	Searching looks through the names of the whole tree of the user,
+	through the trigram index.
+	"""
+	def setUp(self):
+		self.user = User.objects.create_user(email='owner@bongo.local', password='password', username='owner')
+		(access_token, _) = generate_tokens_for_user(self.user)
+		self.client = APIClient(HTTP_ACCESS_TOKEN=access_token)
+
+		self.folder = FilesystemItem(owner=self.user, name='Reports', is_file=False)
+		self.folder.save()
+		for (name, parent) in (('report', None), ('old report.pdf', self.folder), ('report.pdf', self.folder), ('notes.txt', None)):
+			FilesystemItem(owner=self.user, parent=parent, name=name, is_file=True).save()
+
+		other_user = User.objects.create_user(email='other@bongo.local', password='password', username='other')
+		FilesystemItem(owner=other_user, name='report.pdf', is_file=True).save()
+
+	def search(self, **params):
+		response = self.client.get('/filesystem/search/', params)
+		self.assertEqual(response.status_code, 200)
+		return [item['path'] for item in response.json()['items']]
+
+	def test_substring(self):
+		# exact names, then names starting with the query, then the others, how
+		# names differing in case sort within a rank depends on the collation
+		paths = self.search(q='report')
+		self.assertEqual(paths[:1], ['/report'])
+		self.assertCountEqual(paths[1:3], ['/Reports', '/Reports/report.pdf'])
+		self.assertEqual(paths[3:], ['/Reports/old report.pdf'])
+		self.assertEqual(self.search(q='ORT.P'), ['/Reports/old report.pdf', '/Reports/report.pdf'])
+
+	def test_prefix_and_extension(self):
+		# how names differing in case sort depends on the collation
+		self.assertCountEqual(self.search(q='re', match='prefix'), ['/report', '/Reports', '/Reports/report.pdf'])
+		self.assertEqual(self.search(ext='pdf'), ['/Reports/old report.pdf', '/Reports/report.pdf'])
+		self.assertEqual(self.search(q='old', ext='.pdf'), ['/Reports/old report.pdf'])
+
+	def test_too_short(self):
+		self.assertEqual(self.client.get('/filesystem/search/', { 'q': 're' }).status_code, 400)
+
+	def test_rename_move_and_delete(self):
+		item = FilesystemItem.objects.get(name='notes.txt')
+		self.client.put(f'/filesystem/{item.id}/move/', { 'parent': self.folder.id, 'name': 'minutes.txt' }, format='json')
+		self.assertEqual(self.search(q='notes'), [])
+		self.assertEqual(self.search(q='minutes'), ['/Reports/minutes.txt'])
+
+		self.client.delete(f'/filesystem/{self.folder.id}/delete/')
+		self.assertEqual(self.search(q='report'), ['/report'])
+
+	def test_pages(self):
+		paths = []
+		params = { 'q': 'report', 'page_size': 3 }
+		while True:
+			response = self.client.get('/filesystem/search/', params).json()
+			paths += [item['path'] for item in response['items']]
+			if response['next_cursor'] is None:
+				break
+			params['cursor'] = response['next_cursor']
+
+		self.assertEqual(paths, self.search(q='report'))
+
+
+class StreamingASGIHandlerTests(SimpleTestCase):
+	"""
+	Streaming responses are sent part by part, and stop
+	when the client disconnects.
+	"""
+	def send_response(self, response, receive=None):
+		messages = []
+
+		async def send(message):
+			messages.append(message)
+			# lets the disconnect arrive between parts
+			await asyncio.sleep(0)
+
+		async def run():
+			current_receive.set(receive)
+			await StreamingASGIHandler(max_streams=1, read_threads=1).send_response(response, send)
+
+		async_to_sync(run)()
+		return messages
+
+	def test_file_response(self):
+		response = FileResponse(BytesIO(b'x' * 100000))
+		response.block_size = 4096
+
+		messages = self.send_response(response)
+
+		self.assertEqual(messages[0]['type'], 'http.response.start')
+		self.assertEqual(b''.join(message.get('body', b'') for message in messages[1:]), b'x' * 100000)
+		self.assertFalse(messages[-1].get('more_body', False))
+
+	def test_disconnect_stops_streaming(self):
+		parts = []
+
+		def content():
+			for i in range(1000):
+				parts.append(i)
+				yield b'part'
+
+		async def receive():
+			return { 'type': 'http.disconnect' }
+
+		self.send_response(StreamingHttpResponse(content()), receive)
+		self.assertLess(len(parts), 1000)
@@ -0,0 +1,81 @@
+import hashlib
+import os
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopFutureHandlers
+
+class StoredUploadedFile(UploadedFile):
+	"""
+	A file that has already been written to MEDIA_ROOT, and hashed,
+	while it was being received.
+	"""
+	def __init__(self, path, storage_name, name, content_type, size, charset, content_type_extra, sha256):
+		super().__init__(None, name, content_type, size, charset, content_type_extra)
+		self.path = path
+		self.storage_name = storage_name
+		self.sha256 = sha256
+
+	def open(self, mode='rb'):
+		self.file = open(self.path, mode)
+		return self
+
+	def discard(self):
+		if os.path.isfile(self.path):
+			os.remove(self.path)
+
+class StreamingStorageUploadHandler(FileUploadHandler):
+	"""
+	Writes the uploaded file of a new FilesystemItem straight into
+	MEDIA_ROOT, instead of spooling it to a temporary file first, and
+	computes its SHA-256 on the way. From there it is moved into the
+	blob store, which is on the same filesystem, without another copy.
+	"""
+	field_name = 'uploaded_file'
+
+	def __init__(self, request):
+		super().__init__(request)
+		self.uploaded_file = None
+
+	def new_file(self, field_name, *args, **kwargs):
+		super().new_file(field_name, *args, **kwargs)
+
+		# there is only one file per item
+		if field_name != self.field_name or self.uploaded_file is not None:
+			raise SkipFile()
+
+		self.storage_name = f'staging/{uuid.uuid4()}'
+		self.path = os.path.join(settings.MEDIA_ROOT, self.storage_name)
+
+		os.makedirs(os.path.dirname(self.path), exist_ok=True)
+		self.file = open(self.path, 'wb')
+		self.sha256 = hashlib.sha256()
+		self.size = 0
+
+		raise StopFutureHandlers()
+
+	def receive_data_chunk(self, raw_data, start):
+		self.file.write(raw_data)
+		self.sha256.update(raw_data)
+		self.size += len(raw_data)
+
+	def file_complete(self, file_size):
+		self.file.close()
+		self.uploaded_file = StoredUploadedFile(
+			path=self.path,
+			storage_name=self.storage_name,
+			name=self.file_name,
+			content_type=self.content_type,
+			size=self.size,
+			charset=self.charset,
+			content_type_extra=self.content_type_extra,
+			sha256=self.sha256.hexdigest()
+		)
+		return self.uploaded_file
+
+	def upload_interrupted(self):
+		if hasattr(self, 'file'):
+			self.file.close()
+			if os.path.isfile(self.path):
+				os.remove(self.path)
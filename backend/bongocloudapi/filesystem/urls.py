@@ -5,6 +5,8 @@ urlpatterns = [
   path('', views.ListFilesystemItemAPIView.as_view()),
   path('<uuid:pk>/', views.ListFilesystemItemAPIView.as_view()),
   path('path/<str:path>/', views.RetrieveFilesystemItemFromPathAPIView.as_view()),
+  path('paths/', views.ResolveFilesystemItemPathsAPIView.as_view()),
+  path('search/', views.SearchFilesystemItemAPIView.as_view()),
   
   path('create/', views.CreateFilesystemItemAPIView.as_view()),
   path('<uuid:pk>/move/', views.MoveFilesystemItemAPIView.as_view()),
@@ -13,9 +15,21 @@ urlpatterns = [
   path('<uuid:pk>/download/', views.DownloadFilesystemItemAPIView.as_view(), name='filesystem_item-download'),
   path('<uuid:pk>/share/', views.CreateFilesystemSharedItemAPIView.as_view()),
 
+  path('uploads/create/', views.CreateUploadSessionAPIView.as_view()),
+  path('uploads/<uuid:pk>/', views.RetrieveUploadSessionAPIView.as_view()),
+  path('uploads/<uuid:pk>/chunks/<int:index>/', views.UploadSessionChunkAPIView.as_view()),
+  path('uploads/<uuid:pk>/commit/', views.CommitUploadSessionAPIView.as_view()),
+  path('uploads/<uuid:pk>/delete/', views.DestroyUploadSessionAPIView.as_view()),
+
   path('share/item/<uuid:pk>/', views.RetrieveFilesystemSharedItemFromItemIdAPIView.as_view()),
   path('share/<uuid:pk>/', views.RetrieveFilesystemSharedItemAPIVIew.as_view()),
   path('share/<uuid:pk>/update/', views.UpdateFilesystemSharedItemAPIView.as_view()),
   path('share/<uuid:pk>/delete/', views.DestroyFilesystemSharedItemAPIView.as_view()),
   path('share/<uuid:pk>/download/', views.DownloadFilesystemSharedItemAPIVIew.as_view(), name='filesystem_shared_item-download'),
+
+  path('groups/', views.ListShareGroupsAPIView.as_view()),
+  path('groups/create/', views.CreateShareGroupAPIView.as_view()),
+  path('groups/<uuid:pk>/', views.RetrieveShareGroupAPIView.as_view()),
+  path('groups/<uuid:pk>/update/', views.UpdateShareGroupAPIView.as_view()),
+  path('groups/<uuid:pk>/delete/', views.DestroyShareGroupAPIView.as_view()),
 ]
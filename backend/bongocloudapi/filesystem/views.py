@@ -1,3 +1,7 @@
+import hashlib
+import os
+import shutil
+import tempfile
 from urllib import parse as parse_url
 
 from rest_framework import status
@@ -6,54 +10,114 @@ from rest_framework.generics import CreateAPIView, ListAPIView, DestroyAPIView,
 from rest_framework.response import Response
 
 from django.conf import settings
-from django.views.static import serve
+from django.db import IntegrityError, transaction
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.contrib.auth import get_user_model
 from django.contrib.auth.hashers import make_password, check_password
 
-from .models import FilesystemItem, FilesystemSharedItem
+from .archive import archive_cache, stream_folder_archive
+from .downloads import serve_item_file
+from .lookups import get_item_or_404, get_share_group_or_404, get_shared_item_or_404, get_upload_session_or_404
+from .quota import charge_storage, check_storage_quota, delete_upload_sessions, get_declared_size, release_storage
+from .possession import create_possession_challenge, verify_possession
+from .pagination import FilesystemItemCursorPagination, SearchCursorPagination, get_listing_ordering, order_listing
+from .search import get_search_terms, search_items
+from .models import (
+	FilesystemItem,
+	FilesystemSharedItem,
+	ShareGroup,
+	UploadSession,
+	UploadSessionChunk,
+	detach_subtree,
+	hash_path,
+	normalize_path,
+	propagate_size_change,
+	reference_blob,
+	store_blob,
+	touch_listings
+)
+from .uploadhandlers import StreamingStorageUploadHandler
 from .serializers import (
 	CreateFilesystemItemSerializer,
 	CreateFilesystemSharedItemSerializer,
+	CreateUploadSessionSerializer,
 	DownloadFilesystemSharedItemSerializer,
 	FilesystemItemSerializer,
 	FilesystemSharedItemSerializer,
 	MoveFilesystemItemSerializer,
 	PublicFilesystemSharedItemSerializer,
-	UpdateFilesystemSharedItemSerializer
+	ResolveFilesystemItemPathsSerializer,
+	ShareGroupSerializer,
+	UpdateFilesystemSharedItemSerializer,
+	UploadSessionSerializer
 )
 from .permissions import (
 	FilesystemItemOwnerPermissionsMixin,
 	FilesystemSharedItemOwnerOrInAllowedUsersPermissionsMixin,
-	FilesystemSharedItemOwnerPermissionsMixin
+	FilesystemSharedItemOwnerPermissionsMixin,
+	ShareGroupOwnerPermissionsMixin,
+	UploadSessionOwnerPermissionsMixin
 )
 
 User = get_user_model()
 
-MEDIA_ROOT = getattr(settings, 'MEDIA_ROOT', None)
+UPLOAD_STREAM_BLOCK_SIZE = 64 * 1024
 
+class CachedObjectMixin():
+	"""
+	get_object() of the generic views, through the request-scoped
+	lookups that the permission checks have already used.
+	"""
+	get_cached_object = None
 
-class RetrieveFilesystemItemAPIView(FilesystemItemOwnerPermissionsMixin, RetrieveAPIView):
-	queryset = FilesystemItem.objects.all()
+	def get_object(self):
+		obj = type(self).get_cached_object(self.request, self.kwargs['pk'])
+		self.check_object_permissions(self.request, obj)
+		return obj
+
+class RetrieveFilesystemItemAPIView(FilesystemItemOwnerPermissionsMixin, CachedObjectMixin, RetrieveAPIView):
 	serializer_class = FilesystemItemSerializer
+	get_cached_object = staticmethod(get_item_or_404)
 
 class RetrieveFilesystemItemFromPathAPIView(FilesystemItemOwnerPermissionsMixin, RetrieveAPIView):
 	serializer_class = FilesystemItemSerializer
 
 	def retrieve(self, request, *args, **kwargs):
-		path = parse_url.unquote(kwargs['path'])
-		item = get_object_or_404(FilesystemItem, path=path)
+		path = normalize_path(parse_url.unquote(kwargs['path']))
+		item = get_object_or_404(FilesystemItem.objects.with_share_state(), owner=request.user, path_hash=hash_path(path), path=path)
 		item_serializer = self.get_serializer(item, many=False)
 		item_data = item_serializer.data
 		return Response({ 'item': item_data })
 
+class ResolveFilesystemItemPathsAPIView(FilesystemItemOwnerPermissionsMixin, APIView):
+	def post(self, request, *args, **kwargs):
+		serializer = ResolveFilesystemItemPathsSerializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		paths = [normalize_path(path) for path in serializer.validated_data['paths']]
+
+		items = FilesystemItem.objects.with_share_state().filter(owner=request.user, path_hash__in={ hash_path(path) for path in paths })
+		items_by_path = { item.path: item for item in items }
+
+		# in the order they were asked for, None for the paths that weren't found
+		context = { 'request': request }
+		resolved = []
+		for path in paths:
+			item = items_by_path.get(path)
+			resolved.append(None if item is None else FilesystemItemSerializer(item, context=context).data)
+
+		return Response({ 'items': resolved })
+
 class ListFilesystemItemAPIView(FilesystemItemOwnerPermissionsMixin, ListAPIView):
-	queryset = FilesystemItem.objects.all().order_by('is_file', 'name', '-created_at')
+	queryset = FilesystemItem.objects.with_share_state()
 	serializer_class = FilesystemItemSerializer
+	pagination_class = FilesystemItemCursorPagination
 
 	def list(self, request, *args, **kwargs):
 		if 'pk' in kwargs:
-			item = get_object_or_404(FilesystemItem, pk=kwargs['pk'])
+			item = get_item_or_404(request, kwargs['pk'])
 		else:
 			item = None
 
@@ -62,31 +126,79 @@ class ListFilesystemItemAPIView(FilesystemItemOwnerPermissionsMixin, ListAPIView
 		qs = qs.filter(parent=item)
 		
 		if item is not None:
-			if not item.owner == user:
+			if not item.owner_id == user.id:
 				return Response(None, status=status.HTTP_404_NOT_FOUND)
 
-			item_serializer = self.get_serializer(item, many=False)
-			item_data = item_serializer.data
+			etag = item.listing_etag()
 		else:
-			item_data = None
+			# read it fresh, request.user may have been loaded before the last change
+			root_version = User.objects.filter(pk=user.pk).values_list('listing_version', flat=True).get()
+			etag = f'"root.{user.pk}.{root_version}"'
+
+		# decided before any of the children are fetched
+		response = get_conditional_response(request, etag=etag)
+		if response is None:
+			if item is not None:
+				item_serializer = self.get_serializer(item, many=False)
+				item_data = item_serializer.data
+			else:
+				item_data = None
+
+			subitems_queryset = self.filter_queryset(qs)
+			page = self.paginate_queryset(subitems_queryset)
+			if page is not None:
+				subitems_serializer = self.get_serializer(page, many=True)
+				response = Response({
+					'current': item_data,
+					'items': subitems_serializer.data,
+					'next_cursor': self.paginator.get_next_cursor()
+				})
+			else:
+				(field, descending) = get_listing_ordering(request)
+				subitems_serializer = self.get_serializer(order_listing(subitems_queryset, field, descending), many=True)
+				response = Response({ 'current': item_data, 'items': subitems_serializer.data })
 
-		subitems_queryset = self.filter_queryset(qs)
-		subitems_serializer = self.get_serializer(subitems_queryset, many=True)
-		subitems_data = subitems_serializer.data
+		response['ETag'] = etag
+		# the listing changes under the same URL, always revalidate it
+		patch_cache_control(response, private=True, no_cache=True)
+		return response
 
-		return Response({ 'current': item_data, 'items': subitems_data })
+class SearchFilesystemItemAPIView(FilesystemItemOwnerPermissionsMixin, ListAPIView):
+	serializer_class = FilesystemItemSerializer
+	pagination_class = SearchCursorPagination
+
+	def list(self, request, *args, **kwargs):
+		(query, match, extension) = get_search_terms(request)
+		page = self.paginate_queryset(search_items(request.user, query, match, extension))
+		serializer = self.get_serializer(page, many=True)
+		return Response({ 'items': serializer.data, 'next_cursor': self.paginator.get_next_cursor() })
 
 class CreateFilesystemItemAPIView(FilesystemItemOwnerPermissionsMixin, CreateAPIView):
 	serializer_class = CreateFilesystemItemSerializer
 
 	def post(self, request, *args, **kwargs):
+		# turned away before the body is read
+		check_storage_quota(request.user, get_declared_size(request))
+
+		# the file is written to MEDIA_ROOT and hashed while it's received
+		upload_handler = StreamingStorageUploadHandler(request._request)
+		request._request.upload_handlers = [upload_handler]
+
+		try:
+			return self.create_item(request)
+		finally:
+			# unless it was moved into the blob store
+			if upload_handler.uploaded_file is not None:
+				upload_handler.uploaded_file.discard()
+
+	def create_item(self, request):
 		serializer = self.get_serializer(data=request.data)
 		data = serializer.initial_data
 
 		# Check if the user has access to the parent
 		if 'parent' in data and data.get('parent'):
-			parent = get_object_or_404(FilesystemItem, pk=data.get('parent'))
-			if not parent.owner == request.user:
+			parent = get_item_or_404(request, data.get('parent'))
+			if not parent.owner_id == request.user.id:
 				return Response(None, status=status.HTTP_404_NOT_FOUND)
 
 		serializer.is_valid(raise_exception=True)
@@ -94,44 +206,98 @@ class CreateFilesystemItemAPIView(FilesystemItemOwnerPermissionsMixin, CreateAPI
 		data = serializer.validated_data
 		user = self.request.user
 
-		is_file = False
-		filesize = 0
+		uploaded_file = data.get('uploaded_file')
+		sha256 = data.get('sha256')
 
-		try:
-			uploaded_file = data['uploaded_file']
-		except Exception:
-			return Response(None, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+		if uploaded_file is not None and sha256 is not None and sha256 != uploaded_file.sha256:
+			return Response({ 'sha256': ['The uploaded file does not match this checksum.'] }, status=status.HTTP_400_BAD_REQUEST)
 
-		if uploaded_file is not None:
-			is_file = True
-			filesize = uploaded_file.size
+		# without the file, only a blob that's already in the user's tree can be referenced right away
+		proof_required = (
+			uploaded_file is None and sha256 is not None
+			and not FilesystemItem.objects.filter(owner=user, blob_id=sha256).exists()
+		)
+		if proof_required and ('challenge' not in data or 'proof' not in data):
+			# the same whether or not anyone has the file
+			body = { 'detail': 'Send the sha256 of these byte ranges of the file as proof that you have it.' }
+			body.update(create_possession_challenge(user, sha256, data.get('filesize')))
+			return Response(body, status=status.HTTP_428_PRECONDITION_REQUIRED)
 
-		created_item = serializer.save(owner=user, is_file=is_file, filesize=filesize)
+		try:
+			with transaction.atomic():
+				if uploaded_file is not None:
+					# before the file is moved into the blob store, which a rollback wouldn't undo
+					charge_storage(user.id, uploaded_file.size)
+					blob = store_blob(uploaded_file.path, uploaded_file.sha256, uploaded_file.size)
+				elif sha256 is not None:
+					# we may already store this file, in which case it doesn't have to be uploaded
+					blob = None
+					if not proof_required or verify_possession(user, sha256, data.get('filesize'), data['challenge'], data['proof']):
+						blob = reference_blob(sha256, data.get('filesize'))
+					if blob is None:
+						return Response({ 'detail': 'No file with this checksum was found, please upload it.' }, status=status.HTTP_404_NOT_FOUND)
+					charge_storage(user.id, blob.size)
+				else:
+					blob = None
+
+				if blob is not None:
+					created_item = serializer.save(
+						owner=user,
+						is_file=True,
+						filesize=blob.size,
+						sha256=blob.sha256,
+						blob=blob,
+						uploaded_file=blob.storage_name()
+					)
+				else:
+					created_item = serializer.save(owner=user, is_file=False, filesize=0)
+
+				propagate_size_change(created_item.parent_id, created_item.filesize)
+				touch_listings(user.id, [created_item.parent_id, None])
+		except IntegrityError:
+			# an item of the same name created at the same time, the blob store's leftovers
+			# of a new blob are removed by collect_blobs --orphans
+			return Response({ 'name': [f'"{data["name"]}" already exists at this location.'] }, status=status.HTTP_400_BAD_REQUEST)
 
 		serialized_item = FilesystemItemSerializer(created_item, context=self.get_serializer_context()).data
 
 		headers = self.get_success_headers(serialized_item)
 		return Response(serialized_item, status=status.HTTP_201_CREATED, headers=headers)
 
-class DestroyFilesystemItemAPIView(FilesystemItemOwnerPermissionsMixin, DestroyAPIView):
-	queryset = FilesystemItem.objects.all()
+class DestroyFilesystemItemAPIView(FilesystemItemOwnerPermissionsMixin, CachedObjectMixin, DestroyAPIView):
 	serializer_class = FilesystemItemSerializer
+	get_cached_object = staticmethod(get_item_or_404)
+
+	def perform_destroy(self, instance):
+		with transaction.atomic():
+			propagate_size_change(instance.parent_id, -instance.filesize)
+			release_storage(instance.owner_id, instance.filesize)
+			touch_listings(instance.owner_id, [instance.parent_id, None])
+			# returns right away however large the subtree is, process_deletions does the rest
+			detach_subtree(instance)
 	
-class MoveFilesystemItemAPIView(FilesystemItemOwnerPermissionsMixin, UpdateAPIView):
-	queryset = FilesystemItem.objects.all()
+class MoveFilesystemItemAPIView(FilesystemItemOwnerPermissionsMixin, CachedObjectMixin, UpdateAPIView):
 	serializer_class = MoveFilesystemItemSerializer
+	get_cached_object = staticmethod(get_item_or_404)
 
 class DownloadFilesystemItemAPIView(FilesystemItemOwnerPermissionsMixin, APIView):
 	def get(self, request, *args, **kwargs):
-		item_id = kwargs['pk']
-		item = get_object_or_404(FilesystemItem, pk=item_id)
+		item = get_item_or_404(request, kwargs['pk'])
 
-		item_real_path = str(item.uploaded_file)
+		if not item.is_file:
+			if not archive_cache.can_cache(item):
+				response = StreamingHttpResponse(stream_folder_archive(item), content_type='application/zip')
+			else:
+				archive = archive_cache.open(item)
+				if archive is not None:
+					response = FileResponse(archive, content_type='application/zip')
+				else:
+					# stored on the way, the first byte doesn't wait for the whole archive to be built
+					response = StreamingHttpResponse(archive_cache.stream(item), content_type='application/zip')
+			response['Content-Disposition'] = f'attachment; filename="{item.name}.zip"'
+			return response
 
-		response = serve(request, path=item_real_path, document_root=MEDIA_ROOT)
-		response['Content-Disposition'] = f'inline; filename="{item.name}"'
-		response['Content-Length'] = str(item.filesize)
-		return response
+		return serve_item_file(request, item)
 
 
 class RetrieveFilesystemSharedItemAPIVIew(
@@ -142,12 +308,7 @@ class RetrieveFilesystemSharedItemAPIVIew(
 	serializer_class = PublicFilesystemSharedItemSerializer
 
 	def retrieve(self, request, *args, **kwargs):
-		item_id = kwargs['pk']
-		item = get_object_or_404(FilesystemSharedItem, pk=item_id)
-
-		if item.is_expired():
-			item.delete()
-			return Response(None, status=status.HTTP_404_NOT_FOUND)
+		item = get_shared_item_or_404(request, kwargs['pk'])
 
 		serializer = self.get_serializer(item)
 		return Response(serializer.data)
@@ -157,17 +318,12 @@ class DownloadFilesystemSharedItemAPIVIew(
 	APIView
 ):
 	def post(self, request, *args, **kwargs):
-		shared_item_id = kwargs['pk']
-		shared_item = get_object_or_404(FilesystemSharedItem, pk=shared_item_id)
+		shared_item = get_shared_item_or_404(request, kwargs['pk'])
 
 		serializer = DownloadFilesystemSharedItemSerializer(data=request.data)
 		serializer.is_valid(raise_exception=True)
 		data = serializer.validated_data
 
-		if shared_item.is_expired():
-			shared_item.delete()
-			return Response({ 'detail': 'Not found.' }, status=status.HTTP_404_NOT_FOUND)
-
 		if shared_item.has_password:
 			if 'password' not in data or len(data['password']) == 0:
 				return Response({ 'detail': 'Please provide a password.' }, status=status.HTTP_400_BAD_REQUEST)
@@ -176,19 +332,13 @@ class DownloadFilesystemSharedItemAPIVIew(
 				return Response({ 'detail': 'Invalid password.' }, status=status.HTTP_400_BAD_REQUEST)
 
 		item = shared_item.item
-		item_real_path = str(item.uploaded_file)
-
-		response = serve(request, path=item_real_path, document_root=MEDIA_ROOT)
-		response['Content-Disposition'] = f'inline; filename="{item.name}"'
-		response['Content-Length'] = str(item.filesize)
-		return response
+		return serve_item_file(request, item)
 
 class CreateFilesystemSharedItemAPIView(FilesystemItemOwnerPermissionsMixin, CreateAPIView):
 	serializer_class = CreateFilesystemSharedItemSerializer
 
 	def post(self, request, *args, **kwargs):
-		item_id = kwargs['pk']
-		item = get_object_or_404(FilesystemItem, pk=item_id)
+		item = get_item_or_404(request, kwargs['pk'])
 
 		if item.is_shared():
 			return Response({ 'detail': 'This item is already shared.' }, status=status.HTTP_400_BAD_REQUEST)
@@ -196,25 +346,8 @@ class CreateFilesystemSharedItemAPIView(FilesystemItemOwnerPermissionsMixin, Cre
 		if not item.is_file:
 			return Response({ 'detail': 'This item is not file.' }, status=status.HTTP_400_BAD_REQUEST)
 
-		user = request.user
-
+		# the allowed users and groups are looked up by the serializer, all at once
 		serializer = self.get_serializer(data=request.data)
-		data = serializer.initial_data
-
-		allowed_users = []
-		if 'allowed_users' in data and len(data['allowed_users']) > 0:
-			for allowed_user in data['allowed_users']:
-				try:
-					if allowed_user == user.username:
-						continue
-
-					u = get_object_or_404(User, username=allowed_user)
-					allowed_users.append(u.id)
-				except:
-					return Response({ 'detail': f'User "{allowed_user}" was not found.' }, status=status.HTTP_400_BAD_REQUEST)
-		
-		data['allowed_users'] = allowed_users
-
 		serializer.is_valid(raise_exception=True)
 		data = serializer.validated_data
 
@@ -241,21 +374,25 @@ class RetrieveFilesystemSharedItemFromItemIdAPIView(
 	
 	def retrieve(self, request, *args, **kwargs):
 		item_id = kwargs['pk']
-		item = get_object_or_404(FilesystemSharedItem, item__id=item_id)
-
-		if item.is_expired():
-			item.delete()
-			return Response(None, status=status.HTTP_404_NOT_FOUND)
+		# the owner is checked here too, the permission lets missing and deleted items through
+		item = get_object_or_404(
+			FilesystemSharedItem.objects.active().select_related('item__owner'),
+			item__id=item_id,
+			item__owner=request.user,
+			item__is_deleted=False
+		)
+		item.item.has_share = True
 
 		serializer = self.get_serializer(item)
 		return Response(serializer.data)
 
 class UpdateFilesystemSharedItemAPIView(
 	FilesystemSharedItemOwnerPermissionsMixin,
+	CachedObjectMixin,
 	UpdateAPIView
 ):
-	queryset = FilesystemSharedItem.objects.all()
 	serializer_class = UpdateFilesystemSharedItemSerializer
+	get_cached_object = staticmethod(get_shared_item_or_404)
 
 	def put(self, request, *args, **kwargs):
 		return Response(None, status=status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -264,31 +401,8 @@ class UpdateFilesystemSharedItemAPIView(
 		# fetch shared item
 		shared_item = self.get_object()
 
-		# check if is expired
-		if shared_item.is_expired():
-			shared_item.delete()
-			return Response({ 'detail': 'Not found' }, status=status.HTTP_404_NOT_FOUND)
-
-		user = request.user
-
-		# init serializer
+		# init serializer, it finds the allowed users from their usernames
 		serializer = self.get_serializer(shared_item, data=request.data, partial=True)
-		data = serializer.initial_data
-
-		# find users from their usernames
-		allowed_users = []
-		if 'allowed_users' in data and len(data['allowed_users']) > 0:
-			for allowed_user in data['allowed_users']:
-				try:
-					if allowed_user == user.username:
-						continue
-
-					u = get_object_or_404(User, username=allowed_user)
-					allowed_users.append(u.id)
-				except:
-					return Response({ 'detail': f'User "{allowed_user}" was not found.' }, status=status.HTTP_400_BAD_REQUEST)
-		
-		data['allowed_users'] = allowed_users
 
 		# check if data is valid
 		serializer.is_valid(raise_exception=True)
@@ -316,6 +430,210 @@ class UpdateFilesystemSharedItemAPIView(
 
 class DestroyFilesystemSharedItemAPIView(
 	FilesystemSharedItemOwnerPermissionsMixin,
+	CachedObjectMixin,
 	DestroyAPIView
 ):
-	queryset = FilesystemSharedItem.objects.all()
\ No newline at end of file
+	get_cached_object = staticmethod(get_shared_item_or_404)
+
+class ListShareGroupsAPIView(ShareGroupOwnerPermissionsMixin, ListAPIView):
+	serializer_class = ShareGroupSerializer
+
+	def get_queryset(self):
+		return ShareGroup.objects.filter(owner=self.request.user).prefetch_related('members').order_by('name')
+
+class CreateShareGroupAPIView(ShareGroupOwnerPermissionsMixin, CreateAPIView):
+	serializer_class = ShareGroupSerializer
+
+	def perform_create(self, serializer):
+		serializer.save(owner=self.request.user)
+
+class RetrieveShareGroupAPIView(ShareGroupOwnerPermissionsMixin, CachedObjectMixin, RetrieveAPIView):
+	serializer_class = ShareGroupSerializer
+	get_cached_object = staticmethod(get_share_group_or_404)
+
+class UpdateShareGroupAPIView(ShareGroupOwnerPermissionsMixin, CachedObjectMixin, UpdateAPIView):
+	serializer_class = ShareGroupSerializer
+	get_cached_object = staticmethod(get_share_group_or_404)
+
+	def put(self, request, *args, **kwargs):
+		return Response(None, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+
+class DestroyShareGroupAPIView(ShareGroupOwnerPermissionsMixin, CachedObjectMixin, DestroyAPIView):
+	get_cached_object = staticmethod(get_share_group_or_404)
+
+	def destroy(self, request, *args, **kwargs):
+		group = self.get_object()
+
+		# the shares would be left open to everyone else
+		shared_items = group.shared_items.count()
+		if shared_items > 0:
+			return Response({ 'detail': f'This group is used by {shared_items} shares.' }, status=status.HTTP_400_BAD_REQUEST)
+
+		group.delete()
+		return Response(None, status=status.HTTP_204_NO_CONTENT)
+
+class CreateUploadSessionAPIView(UploadSessionOwnerPermissionsMixin, CreateAPIView):
+	serializer_class = CreateUploadSessionSerializer
+
+	def post(self, request, *args, **kwargs):
+		serializer = self.get_serializer(data=request.data)
+		data = serializer.initial_data
+
+		# Check if the user has access to the parent
+		if 'parent' in data and data.get('parent'):
+			parent = get_item_or_404(request, data.get('parent'))
+			if not parent.owner_id == request.user.id:
+				return Response(None, status=status.HTTP_404_NOT_FOUND)
+
+		serializer.is_valid(raise_exception=True)
+		data = serializer.validated_data
+
+		chunk_size = data.get('chunk_size') or settings.UPLOAD_CHUNK_SIZE
+		try:
+			with transaction.atomic():
+				# reserved until the session is committed or deleted, see delete_upload_sessions
+				charge_storage(request.user.id, data['filesize'])
+				session = serializer.save(owner=request.user, chunk_size=chunk_size)
+
+				# preallocate the blob, every chunk is written at its own offset. Still
+				# in the transaction, a session is never saved without its blob
+				blob_path = session.blob_path()
+				os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+				with open(blob_path, 'wb') as blob:
+					blob.truncate(session.filesize)
+		except OSError:
+			# EFBIG or ENOSPC, the session and its reservation have been rolled back
+			if os.path.isfile(blob_path):
+				os.remove(blob_path)
+			return Response({ 'detail': 'There is not enough space to store this file.' }, status=status.HTTP_507_INSUFFICIENT_STORAGE)
+
+		serialized_session = UploadSessionSerializer(session, context=self.get_serializer_context()).data
+		return Response(serialized_session, status=status.HTTP_201_CREATED)
+
+class RetrieveUploadSessionAPIView(UploadSessionOwnerPermissionsMixin, CachedObjectMixin, RetrieveAPIView):
+	serializer_class = UploadSessionSerializer
+	get_cached_object = staticmethod(get_upload_session_or_404)
+
+class DestroyUploadSessionAPIView(UploadSessionOwnerPermissionsMixin, CachedObjectMixin, DestroyAPIView):
+	get_cached_object = staticmethod(get_upload_session_or_404)
+
+	def perform_destroy(self, instance):
+		with transaction.atomic():
+			delete_upload_sessions(UploadSession.objects.filter(pk=instance.pk))
+
+class UploadSessionChunkAPIView(UploadSessionOwnerPermissionsMixin, APIView):
+	def put(self, request, *args, **kwargs):
+		session = get_upload_session_or_404(request, kwargs['pk'])
+		index = kwargs['index']
+
+		if index >= session.chunk_count():
+			return Response({ 'detail': 'Chunk index is out of range.' }, status=status.HTTP_400_BAD_REQUEST)
+
+		chunk_length = session.chunk_length(index)
+		try:
+			content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+		except ValueError:
+			content_length = 0
+
+		if content_length != chunk_length:
+			return Response({ 'detail': f'Chunk {index} must be {chunk_length} bytes long.' }, status=status.HTTP_400_BAD_REQUEST)
+
+		blob_path = session.blob_path()
+		try:
+			# received first, so that the session is only locked while it's copied into the blob
+			received = tempfile.TemporaryFile(dir=os.path.dirname(blob_path))
+		except FileNotFoundError:
+			return Response(None, status=status.HTTP_404_NOT_FOUND)
+
+		with received:
+			written = 0
+			while written < chunk_length:
+				data = request.stream.read(min(UPLOAD_STREAM_BLOCK_SIZE, chunk_length - written))
+				if not data:
+					break
+				received.write(data)
+				written += len(data)
+
+			if written != chunk_length:
+				return Response({ 'detail': f'Chunk {index} was not received completely.' }, status=status.HTTP_400_BAD_REQUEST)
+
+			received.seek(0)
+			with transaction.atomic():
+				# locked, a commit hashes the blob once no chunk is being written into it
+				if not UploadSession.objects.select_for_update().filter(pk=session.pk).exists():
+					return Response(None, status=status.HTTP_404_NOT_FOUND)
+
+				try:
+					with open(blob_path, 'r+b') as blob:
+						blob.seek(index * session.chunk_size)
+						shutil.copyfileobj(received, blob, UPLOAD_STREAM_BLOCK_SIZE)
+				except FileNotFoundError:
+					return Response(None, status=status.HTTP_404_NOT_FOUND)
+
+				UploadSessionChunk.objects.get_or_create(session=session, index=index)
+				UploadSession.objects.filter(pk=session.pk).update(updated_at=timezone.now())
+
+		return Response(None, status=status.HTTP_204_NO_CONTENT)
+
+class CommitUploadSessionAPIView(UploadSessionOwnerPermissionsMixin, APIView):
+	def post(self, request, *args, **kwargs):
+		session = get_upload_session_or_404(request, kwargs['pk'])
+		user = request.user
+		blob_path = session.blob_path()
+
+		blob = None
+		try:
+			with transaction.atomic():
+				# locked, a second commit of the session waits for this one and then finds it gone
+				session = UploadSession.objects.select_for_update().filter(pk=session.pk).first()
+				if session is None:
+					return Response(None, status=status.HTTP_404_NOT_FOUND)
+
+				missing_chunks = session.chunk_count() - session.chunks.count()
+				if missing_chunks > 0:
+					return Response({ 'detail': f'{missing_chunks} chunks have not been uploaded yet.' }, status=status.HTTP_400_BAD_REQUEST)
+
+				if FilesystemItem.objects.all().filter(owner=user, parent=session.parent_id, name__exact=session.name).exists():
+					return Response({ 'name': [f'"{session.name}" already exists at this location.'] }, status=status.HTTP_400_BAD_REQUEST)
+
+				# the folder may have been deleted while the chunks were uploaded
+				if session.parent_id is not None and not FilesystemItem.objects.filter(pk=session.parent_id).exists():
+					return Response({ 'parent': ['This folder has been deleted.'] }, status=status.HTTP_400_BAD_REQUEST)
+
+				# the chunks were written out of order, so the blob can only be hashed now
+				sha256 = hashlib.sha256()
+				with open(blob_path, 'rb') as blob_file:
+					for data in iter(lambda: blob_file.read(UPLOAD_STREAM_BLOCK_SIZE), b''):
+						sha256.update(data)
+				sha256 = sha256.hexdigest()
+
+				# the storage was reserved when the session was created, the item keeps it
+				session.delete()
+				blob = store_blob(blob_path, sha256, session.filesize)
+
+				item = FilesystemItem.objects.create(
+					owner=user,
+					parent_id=session.parent_id,
+					name=session.name,
+					is_file=True,
+					filesize=blob.size,
+					sha256=blob.sha256,
+					blob=blob,
+					uploaded_file=blob.storage_name()
+				)
+				propagate_size_change(item.parent_id, item.filesize)
+				touch_listings(user.id, [item.parent_id, None])
+		except Exception as error:
+			# the rollback brought the session back but not its file, which store_blob
+			# moved into the blob store or removed as the blob was already there. A
+			# copy, chunks written into a link to the blob would change every file of it
+			if blob is not None and not os.path.isfile(blob_path):
+				shutil.copyfile(blob.path(), blob_path)
+
+			# an item of the same name created meanwhile
+			if isinstance(error, IntegrityError):
+				return Response({ 'name': [f'"{session.name}" already exists at this location.'] }, status=status.HTTP_400_BAD_REQUEST)
+			raise
+
+		serialized_item = FilesystemItemSerializer(item, context={ 'request': request }).data
+		return Response(serialized_item, status=status.HTTP_201_CREATED)
@@ -1,3 +1,8 @@
 #!/bin/bash
 cd /code/bongocloudapi
-gunicorn --worker-tmp-dir /dev/shm bongocloudapi.wsgi:application --bind "0.0.0.0:8000"
\ No newline at end of file
+if [ "$BONGO_ASGI" = "true" ]; then
+	# downloads are streamed by the event loop, a slow client doesn't hold a worker
+	gunicorn --worker-tmp-dir /dev/shm -k uvicorn.workers.UvicornWorker bongocloudapi.asgi:application --bind "0.0.0.0:8000"
+else
+	gunicorn --worker-tmp-dir /dev/shm bongocloudapi.wsgi:application --bind "0.0.0.0:8000"
+fi